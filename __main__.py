@@ -1,15 +1,18 @@
 from server.server_manager import ServerManager
-from config.configs import ObsidiaConfigParser
+from server.remote import RemoteServerManager
+from server.registry import ServerEntry, ServerRegistry
 import bot.discord_server as discord_server
 from loguru import logger
 from typing import Union
+import asyncio
 import time
 import os
 
 
 class ConsolePrintListener:
-    def __init__(self, manager: ServerManager):
-        self._manager: ServerManager = manager
+    def __init__(self, manager: Union[ServerManager, RemoteServerManager], prefix: str = ""):
+        self._manager: Union[ServerManager, RemoteServerManager] = manager
+        self._prefix = prefix
 
     def start(self):
         self._manager.server.add_listener(self)
@@ -18,7 +21,7 @@ class ConsolePrintListener:
         self._print_and_log_entry(message)
 
     def _print_and_log_entry(self, entry: Union[str, None]):
-        logger.info(entry)
+        logger.info(f"{self._prefix}{entry}")
 
 
 import sys
@@ -36,25 +39,33 @@ if __name__ == "__main__":
 
     logger.info("Starting main")
 
-    config_file = os.path.join("config", "obsidia.conf")
-    configs = ObsidiaConfigParser(config_file)
-    server_dir = configs.get("Server", "directory")
-    name = configs.get("Server", "name")
-    ip = configs.get("Server", "ip")
+    def print_console(entry: ServerEntry):  # called as each server is first used
+        ConsolePrintListener(entry.manager(), f"[{entry.key}] " if len(registry) > 1 else "").start()
 
-    if server_dir == None:
-        logger.error("Server directory not provided")
+    config_file = os.path.join("config", "obsidia.conf")
+    try:
+        registry = ServerRegistry.from_config(config_file, on_load=print_console)
+    except ValueError as e:
+        logger.error(e)
         exit(1)
-    manager = ServerManager(server_dir, config_file)
-    listener = ConsolePrintListener(manager)
-    listener.start()
+    logger.info(f"Managing {len(registry)} server(s): {', '.join(registry.keys())}")
 
-    discord_server.prep_client(manager, os.path.join("config", "operators.txt"), os.path.join("config", "owners.txt"), manager_log_file, name, ip)
+    discord_server.prep_client(registry, os.path.join("config", "operators.txt"), os.path.join("config", "owners.txt"), manager_log_file)
     discord_server.start_client()  # block
 
     discord_server.cleanup_client()
-    stop_server_result = manager.stop_server()
-    if stop_server_result != None:
-        logger.warning(stop_server_result)
+    stopping = []
+    for entry in registry.loaded():  # servers that were never used have nothing to stop
+        if entry.is_remote():  # servers on other machines keep running under their agents
+            continue
+        stop_server_result = entry.manager().stop_server()
+        if stop_server_result != None:
+            logger.warning(f"{entry.key}: {stop_server_result}" if len(registry) > 1 else stop_server_result)
+        else:
+            stopping.append(entry.manager().wait_for_server_exit(timeout=60))
+    # the servers run on the client's loop, so keep that loop going until they finish shutting down
+    if len(stopping) > 0:
+        asyncio.get_event_loop().run_until_complete(asyncio.gather(*stopping))
+    registry.close_agents()
 
     logger.info("Closing main")
@@ -0,0 +1,143 @@
+'''
+Console parsing benchmark
+
+Generates a representative console log (a mix of vanilla, Paper, Forge and Fabric lines, chat, and stack traces), then
+measures the cost of the console checks the manager makes on every line, done two ways:
+    raw:    substring and regex scans of the raw line by each consumer, as before server.console_parser existed
+    parsed: one ConsoleParser.parse() per line, then the same checks against the record's fields
+Parser throughput alone is reported too. See README.md beside this file for recorded results.
+
+Usage:
+    python -m benchmarks.console_parser generate <log file> [lines, default 200000]
+    python -m benchmarks.console_parser run <log file> [repeat, default 5]
+'''
+
+from server.console_parser import ConsoleParser
+from server.server import PLAYER_PATTERN
+from typing import Callable, List
+import random
+import time
+import sys
+
+
+PLAYERS = ["Steve", "Alex", "Notch", "jeb_", "Dinnerbone", "xX_Builder_Xx", "Grumm", "Herobrine"]
+FORMATS = {  # the share of lines in each format, servers print one format but logs from several are benchmarked together
+    "vanilla": 0.55,
+    "paper": 0.2,
+    "forge": 0.15,
+    "fabric": 0.1,
+}
+
+
+def _message(rng: random.Random) -> str:
+    player = rng.choice(PLAYERS)
+    roll = rng.random()
+    if roll < 0.35:
+        return f"<{player}> {' '.join(rng.choice(['hi', 'lol', 'where', 'is', 'the', 'base', 'diamonds', 'gg']) for _ in range(rng.randint(1, 12)))}"
+    if roll < 0.5:
+        return f"{player} {rng.choice(['joined', 'left'])} the game"
+    if roll < 0.6:
+        return f"{player} has made the advancement [{rng.choice(['Stone Age', 'Getting an Upgrade', 'Hot Stuff'])}]"
+    if roll < 0.7:
+        return f"Can't keep up! Is the server overloaded? Running {rng.randint(2000, 9000)}ms or {rng.randint(40, 180)} ticks behind"
+    if roll < 0.8:
+        return "Saved the game"
+    if roll < 0.9:
+        return f"Average time per tick: {rng.uniform(1, 60):.1f}ms (Target: 50.0ms)"
+    return f"[{player}: Teleported {player} to {rng.randint(-3000, 3000)}.5, 64.0, {rng.randint(-3000, 3000)}.5]"
+
+
+def _line(rng: random.Random, form: str) -> str:
+    timestamp = f"{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02}"
+    level = "WARN" if rng.random() < 0.1 else "INFO"
+    message = _message(rng)
+    if form == "vanilla":
+        return f"[{timestamp}] [Server thread/{level}]: {message}"
+    if form == "paper":
+        return f"[{timestamp} {level}]: {message}"
+    if form == "forge":
+        return f"[17Mar2023 {timestamp}.{rng.randint(0, 999):03}] [Server thread/{level}] [net.minecraft.server.MinecraftServer/]: {message}"
+    return f"[{timestamp}] [Server thread/{level}] (Minecraft) {message}"
+
+
+def generate_log(path: str, lines: int = 200000, seed: int = 1):
+    '''Write a log of the given number of lines, the same for a given seed. Formats come in long runs, as from one server.'''
+    rng = random.Random(seed)
+    forms = list(FORMATS)
+    with open(path, "w") as log:
+        written = 0
+        while written < lines:
+            form = rng.choices(forms, weights=list(FORMATS.values()))[0]
+            for _ in range(min(rng.randint(500, 5000), lines - written)):
+                if rng.random() < 0.01:  # a stack trace, which matches no format
+                    log.write("java.lang.IllegalStateException: Something went wrong\n\tat net.minecraft.server.Main.main(Main.java:1)\n")
+                    written += 2
+                else:
+                    log.write(_line(rng, form) + "\n")
+                    written += 1
+
+
+def check_raw(lines: List[str]) -> int:
+    '''The checks made on raw lines before parsing: readiness, EULA, players, saves, overload warnings.'''
+    hits = 0
+    for line in lines:
+        if "INFO]: Done (" in line or "INFO]: You need to agree to the EULA" in line:
+            hits += 1
+        if PLAYER_PATTERN.search(line) != None:
+            hits += 1
+        if "]: Saved the game" in line or "]: Saved the world" in line:
+            hits += 1
+        if "]: Can't keep up!" in line:
+            hits += 1
+    return hits
+
+
+def check_parsed(lines: List[str]) -> int:
+    '''The same checks, made against records parsed once.'''
+    parser = ConsoleParser()
+    hits = 0
+    for line in lines:
+        record = parser.parse(line)
+        message = record.message
+        if record.level == "INFO" and message.startswith(("Done (", "You need to agree to the EULA")):
+            hits += 1
+        if PLAYER_PATTERN.match(message) != None:
+            hits += 1
+        if message.startswith(("Saved the game", "Saved the world")):
+            hits += 1
+        if message.startswith("Can't keep up!"):
+            hits += 1
+    return hits
+
+
+def parse_only(lines: List[str]) -> int:
+    ConsoleParser().parse_all(lines)
+    return 0
+
+
+def best_rate(function: Callable[[List[str]], int], lines: List[str], repeat: int) -> float:
+    '''Run the function over the lines repeat times, returning the best rate in lines per second.'''
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(lines)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(lines) / elapsed if elapsed > 0 else float("inf"))
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("generate", "run"):
+        print(__doc__.strip().split("Usage:")[1])
+        exit(1)
+    if sys.argv[1] == "generate":
+        generate_log(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 200000)
+        exit(0)
+    with open(sys.argv[2], "r", errors="replace") as log:
+        lines = [line.rstrip("\r\n") for line in log]
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    size = sum(len(line) + 1 for line in lines) / 1048576
+    print(f"{len(lines)} lines, {size:.1f} MiB, best of {repeat}")
+    for name, function in [("raw checks", check_raw), ("parse + field checks", check_parsed), ("parse only", parse_only)]:
+        hits = f", {function(lines)} checks matched" if function != parse_only else ""
+        print(f"{name:>22}: {best_rate(function, lines, repeat):>12,.0f} lines/s{hits}")
@@ -1,11 +1,8 @@
-from server.server_manager import ServerManager
-from server.server_ping import StatusPing
+from server.registry import ServerEntry, ServerRegistry
 from bot.servercog import ServerCog
-from json import JSONDecodeError
 from bot.pingcog import PingCog
 from dotenv import load_dotenv
 from loguru import logger
-from typing import Union
 import nextcord
 import asyncio
 import os
@@ -18,60 +15,66 @@ if DISCORD_TOKEN == None:
     raise RuntimeError("Could not find DISCORD_TOKEN in .env file. Did you create a bot?")
 
 
-async def _presence_update_loop(pinger: StatusPing, server_name: Union[str, None], manager: ServerManager):
+async def _presence_update_loop(registry: ServerRegistry):
     global _stop_presence_updater
-    # wait until the server starts to do the first ping
-    while not _stop_presence_updater and not manager.server_active():
+    # wait until a server starts to do the first ping
+    while not _stop_presence_updater and not any(entry.manager().server_active() for entry in registry.loaded()):
         await asyncio.sleep(5)
     # ping every 60 seconds to update the status
     while not _stop_presence_updater:
-        try:
-            response = pinger.get_status()
-        except JSONDecodeError:
-            response = None  # possible to attempt ping during startup, would kill updater permanently
-        if response == None:
-            status = "offline"
+        if len(registry) == 1:
+            activity = await _single_server_activity(registry.entries()[0])
         else:
-            try:
-                status = f"{response['players']['online']}/{response['players']['max']}"
-            except KeyError:
-                status = "?/?"
+            activity = await _multi_server_activity(registry)
         try:
-            await client.change_presence(activity=nextcord.Game(name=f"{server_name} | {status}"))
+            await client.change_presence(activity=nextcord.Game(name=activity))
         except:
             pass
         await asyncio.sleep(60)
 
 
-def _is_valid_value(value: Union[str, None]) -> bool:
-    return value != None and value != ""
+async def _single_server_activity(entry: ServerEntry) -> str:
+    cached = await entry.status_cache().get()  # None during startup, when the server is not listening yet
+    if cached == None:
+        status = "offline"
+    else:
+        try:
+            status = f"{cached.status['players']['online']}/{cached.status['players']['max']}"
+        except KeyError:
+            status = "?/?"
+        if cached.stale:
+            status += f" (as of {cached.age():.0f}s ago)"
+    return f"{entry.title()} | {status}"
+
+
+async def _multi_server_activity(registry: ServerRegistry) -> str:
+    active = [entry for entry in registry.loaded() if entry.manager().server_active()]
+    statuses = await asyncio.gather(*[entry.status_cache().get() for entry in active])  # pinged concurrently
+    players = 0
+    for cached in statuses:
+        if cached != None and not cached.stale:
+            try:
+                players += int(cached.status["players"]["online"])
+            except (KeyError, TypeError, ValueError):
+                pass
+    return f"{len(active)}/{len(registry)} servers | {players} players"
 
 
-def prep_client(
-        manager: ServerManager, operators_file: str, owners_file: str, manager_logfile: str,
-        name: Union[str, None] = None, ip: Union[str, None] = None):
-    '''Prepare the client with applicable commands'''
-    valid_name = _is_valid_value(name)
-    valid_ip = _is_valid_value(ip)
-    if valid_name and valid_ip:  # name and ip
-        server_name = name
-        server_ip = f"{ip}:{manager._port}"
-    elif valid_name:  # name, but no ip
-        server_name = name
-        server_ip = None
-    elif valid_ip:  # ip, but no name
-        server_name = ip
-        server_ip = f"{ip}:{manager._port}"
-    else:  # neither name nor ip
-        server_name = "MC Server"
-        server_ip = None
-
-    pinger: StatusPing = StatusPing(port=manager._port, timeout=2)
+async def _connect_agents(registry: ServerRegistry):
+    '''Connect to the servers on other machines, so their state and console are followed from the start.'''
+    remote = [entry for entry in registry.entries() if entry.is_remote()]
+    results = await asyncio.gather(*[entry.load() for entry in remote], return_exceptions=True)
+    for entry, result in zip(remote, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not connect to the agent of {entry.key} (it will be retried when used): {result}")
+
 
+def prep_client(registry: ServerRegistry, operators_file: str, owners_file: str, manager_logfile: str):
+    '''Prepare the client with applicable commands'''
     global client
     client = nextcord.Client(intents=INTENTS)
     client.add_cog(PingCog(client))
-    client.add_cog(ServerCog(client, manager, operators_file, owners_file, manager_logfile, pinger, server_name, server_ip))
+    client.add_cog(ServerCog(client, registry, operators_file, owners_file, manager_logfile))
 
     global _should_start_presence_updater
     global _stop_presence_updater
@@ -85,7 +88,8 @@ def prep_client(
         # on_ready may be called multiple times, do not spawn multiple loops
         if _should_start_presence_updater:
             _should_start_presence_updater = False
-            await _presence_update_loop(pinger, server_name, manager)
+            await _connect_agents(registry)
+            await _presence_update_loop(registry)
 
 
 def start_client():
@@ -9,17 +9,21 @@ ServerCog
 
 from bot.buttonviews import ButtonEnums, ConfirmButtons, PageButtons
 from nextcord import Interaction, SlashOption, Embed
-from server.server_manager import ServerManager
+from server.local import LocalServerManager
+from server.remote import RemoteServerManager
+from server.registry import ServerRegistry
+from server.backups.catalog import CatalogEntry
 from bot.helpers.embedhelper import EmbedField
-from typing import Callable, Union, Dict, List
+from typing import Callable, Sequence, Union, Dict, List
 import bot.helpers.embedhelper as embedhelper
-from server.server_ping import StatusPing
 from nextcord.ext import commands
 from datetime import datetime
-import threading
 import nextcord
 import asyncio
-import os
+
+
+SERVER_DESCRIPTION = "The server to use, needed if the bot manages more than one"
+Manager = Union[LocalServerManager, RemoteServerManager]
 
 
 class ServerCog (commands.Cog):
@@ -30,23 +34,20 @@ class ServerCog (commands.Cog):
     ----------
     client: `nextcord.Client`
         Client this cog is applied to
-    manager: `server.server_manager.ServerManager`
-        The server manager this bot should affect
+    registry: `server.registry.ServerRegistry`
+        The servers this bot manages, which commands choose from with their server option
     operators_file: `str`
         The file to read operators from
     owners_file: `str`
         The file to read owners from, owners are given operator status
     manager_logfile: `str`
         The file to read when calling /server managerlog
-    pinger: `StatusPing`
-        The object to use when pinging the server
-    server_name: `str`
-        The server name as it appears in queries
-    server_ip: `str`
-        The server IP as it should appear in query descriptions (e.g. "192.168.1.1:25565"), None to ignore
 
     Commands
     --------
+    Every command that acts on a server takes a server option, which can be left out if there is only one server.
+
+    servers()
     server()
         command(command: `str`)
         say(message: `str`)
@@ -56,6 +57,8 @@ class ServerCog (commands.Cog):
         managerlog()
         backup(name: `str`)
         listbackups()
+        pendingdeletions()
+        statuscache()
     admin()
         restore(name: `str`)
         deletebackup(name: `str`)
@@ -64,77 +67,95 @@ class ServerCog (commands.Cog):
     query()
     '''
 
-    def __init__(self, client: nextcord.Client, manager: ServerManager, operators_file: str, owners_file: str,
-                 manager_logfile: str, pinger: StatusPing, server_name: Union[str, None] = "Minecraft Server", server_ip: Union[str, None] = None):
+    def __init__(self, client: nextcord.Client, registry: ServerRegistry, operators_file: str, owners_file: str, manager_logfile: str):
         self.client: nextcord.Client = client
-        self.manager: ServerManager = manager
+        self.registry: ServerRegistry = registry
         self.operators_file: str = operators_file
         self.owners_file: str = owners_file
         self.manager_logfile: str = manager_logfile
-        self.pinger = pinger
         self._ops: set[int] = set()
         self._owners: set[int] = set()
-        self._server_name = server_name
-        self._server_ip = server_ip
         self._embed_color = nextcord.Color.green()
+        self._server_tasks: Dict[str, asyncio.Task] = {}
         self._load_admins()
 
+    @nextcord.slash_command(name="servers", description="List the servers this bot manages")
+    async def _servers(self, interaction: Interaction):
+        fields = []
+        for entry in self.registry.entries():
+            if not entry.is_loaded():
+                state = "Not started since the bot started"
+            elif entry.manager().server_active():
+                state = "Online"
+            elif entry.manager().server_should_be_running():
+                state = "Starting or restarting"
+            else:
+                state = "Offline"
+            fields.append(EmbedField(entry.key, f"{entry.title()}: {state}", inline=False))
+        await interaction.send(embed=embedhelper.build_embed(*fields[:25], title="Servers", color=self._embed_color), ephemeral=True)
+
     @nextcord.slash_command(name="server", description="Server management commands")
     async def _server(self, interaction: Interaction):
         pass
 
     @_server.subcommand(name="command", description="Write any command to the server console")
     async def _sv_command(self, interaction: Interaction,
-                          command: str = SlashOption(required=True, description="Command to run")):
-        await self._write_to_console_helper(interaction, command.strip())
+                          command: str = SlashOption(required=True, description="Command to run"),
+                          server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        await self._write_to_console_helper(interaction, server, command.strip())
 
     @_server.subcommand(name="say", description="Say something to the server console")
     async def _sv_say(self, interaction: Interaction,
-                      message: str = SlashOption(required=True, name="message", description="Message to say")):
-        await self._write_to_console_helper(interaction, f"say {message.strip()}")
+                      message: str = SlashOption(required=True, name="message", description="Message to say"),
+                      server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        await self._write_to_console_helper(interaction, server, f"say {message.strip()}")
 
-    async def _write_to_console_helper(self, interaction: Interaction, content: str):
+    async def _write_to_console_helper(self, interaction: Interaction, server: Union[str, None], content: str):
         '''Should be used for commands that are operator+ restricted. Pre-trim your content.'''
-        if await self._verify_operator_and_reply(interaction) or await self._verify_server_online_and_reply(interaction):
+        if await self._verify_operator_and_reply(interaction):
             return
-        special_result = self.manager.write(content)
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None or await self._verify_server_online_and_reply(interaction, manager):
+            return
+        special_result = await manager.write(content)
         if special_result != None:
             await interaction.send(special_result, ephemeral=True)
         else:
             await interaction.send(f"Command sent.", ephemeral=True)
 
     @_server.subcommand(name="stop", description="Shut down the server")
-    async def _sv_stop(self, interaction: Interaction):
-        if await self._verify_operator_and_reply(interaction) or await self._verify_server_online_and_reply(interaction):
+    async def _sv_stop(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_operator_and_reply(interaction):
+            return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None or await self._verify_server_online_and_reply(interaction, manager):
             return
         await interaction.send("Shutting down server.")
-        self.manager.stop_server()
+        await manager.stop_server()
 
     @_server.subcommand(name="start", description="Start up the server")
-    async def _sv_start(self, interaction: Interaction):
+    async def _sv_start(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_operator_and_reply(interaction):
             return
-        elif self.manager.server_should_be_running():
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
+        elif manager.server_should_be_running():
             await interaction.send("Server already running.", ephemeral=True)
             return
         await interaction.send("Starting server.")
-        # start on a new thread so as not to block the bot
-        threading.Thread(target=self._start_async_minecraft_server, name="MinecraftServerThread").start()
-
-    def _start_async_minecraft_server(self):
-        '''
-        Start the Minecraft server client, blocks until it closes.
-
-        Do not call this if the server is already running!
-        '''
-        asyncio.run(self.manager.start_server())
+        # run as a task on the bot's loop so as not to block the bot, every server shares this loop
+        self._server_tasks[self.registry.resolve(server).key] = asyncio.create_task(manager.start_server())
 
     @_server.subcommand(name="log", description="Read the server log")
-    async def _sv_log(self, interaction: Interaction):
+    async def _sv_log(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_operator_and_reply(interaction):
             return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
         embed_title = "Server Log"
-        log_entries = self.manager.get_latest_log()
+        log_entries = await manager.get_latest_log()
         await self._start_log_view(interaction, log_entries, embed_title)
 
     @_server.subcommand(name="managerlog", description="Read the manager log")
@@ -150,13 +171,17 @@ class ServerCog (commands.Cog):
 
     @_server.subcommand(name="backup", description="Make a backup for the server, leave out name to use the timestamp and respect max backups.")
     async def _sv_backup(self, interaction: Interaction,
-                         name: str = SlashOption(required=False, name="name", description="Name of the backup")):
+                         name: str = SlashOption(required=False, name="name", description="Name of the backup"),
+                         server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_operator_and_reply(interaction):
             return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
         await interaction.response.defer(ephemeral=True)
         if name != None:
             name = name.strip()
-        special_result = await self.manager.backup_world(name)
+        special_result = await manager.backup_world(name)
         if special_result != None:
             await interaction.send(special_result)
         else:
@@ -165,35 +190,69 @@ class ServerCog (commands.Cog):
                 await interaction.channel.send(f"Server backed up by {interaction.user.mention}.")  # type: ignore
 
     @_server.subcommand(name="listbackups", description="Get a list of available backups")
-    async def _sv_listbackups(self, interaction: Interaction):
+    async def _sv_listbackups(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_operator_and_reply(interaction):
             return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
         embed_title = "Available Backups"
-        backup_list = sorted(self.manager.list_backups())
+        await interaction.response.defer(ephemeral=True)  # listing replicated backups can take a moment
+        backup_list = list(await manager.list_backups())  # oldest first
+        remote_backups = await manager.get_remote_backups()
+        infos = await manager.get_backup_infos(backup_list)
+        remote_only = [name for name in remote_backups if name not in backup_list]
+        if len(remote_only) > 0:
+            backup_list = sorted(backup_list + remote_only, key=lambda name: infos[name].created  # type: ignore
+                                 if name not in remote_only else remote_backups[name].get("created", 0))
         if len(backup_list) >= 10:  # max 10 fields per discord embed, so offer buttons to page through them
             def build_backup_embed_with_offset(backups: List[str], title: str, index: int) -> Embed:
                 fields = []
                 for i in range(index, min(index + 10, len(backups))):
-                    fields.append(self._build_backup_field(backups[i]))
+                    fields.append(self._build_backup_field(backups[i], infos.get(backups[i]), remote_backups))
                 return embedhelper.build_embed(*fields, title=title, color=self._embed_color)
             await self._manage_pageable_embed(interaction, backup_list, embed_title, build_backup_embed_with_offset)
         else:  # less than 10, no need for buttons
             fields = []
             for backup in backup_list:
-                fields.append(self._build_backup_field(backup))
+                fields.append(self._build_backup_field(backup, infos.get(backup), remote_backups))
             emb = embedhelper.build_embed(*fields, title=embed_title, color=self._embed_color)
             await interaction.send(embed=emb, ephemeral=True)
 
-    def _build_backup_field(self, backup: str) -> EmbedField:
-        try:  # try to translate epochs, otherwise read the file creation date
-            backup_timestamp = datetime.fromtimestamp(int(backup)).strftime("%D %H:%M:%S")
-        except ValueError:
-            try:
-                st = os.path.getmtime(os.path.join(self.manager.backup_directory, backup))
-                backup_timestamp = datetime.fromtimestamp(int(st)).strftime("%D %H:%M:%S")
-            except FileNotFoundError:
-                backup_timestamp = "Could not get timestamp"
-        return EmbedField(backup, backup_timestamp)
+    @_server.subcommand(name="pendingdeletions", description="List deleted backups whose files are still being removed")
+    async def _sv_pendingdeletions(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_operator_and_reply(interaction):
+            return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
+        pending = await manager.pending_deletions()
+        if len(pending) == 0:
+            await interaction.send("No backups are waiting to be deleted.", ephemeral=True)
+        else:
+            await interaction.send(f"Still removing the files of: {', '.join(pending)}", ephemeral=True)
+
+    @_server.subcommand(name="statuscache", description="Show how often status requests were answered without pinging the server")
+    async def _sv_statuscache(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_operator_and_reply(interaction):
+            return
+        if await self._get_manager_and_reply(interaction, server) == None:
+            return
+        cache = self.registry.resolve(server).status_cache()
+        requests = cache.hits + cache.misses + cache.coalesced
+        saved = f" ({(cache.hits + cache.coalesced) / requests:.0%} without a new ping)" if requests > 0 else ""
+        await interaction.send(f"{requests} status requests{saved}: {cache.hits} cached, {cache.coalesced} shared a ping, "
+                               f"{cache.misses} pinged, {cache.stale_served} answered with a stale status. TTL is {cache.ttl:g}s.", ephemeral=True)
+
+    def _build_backup_field(self, backup: str, info: Union[CatalogEntry, None], remote_backups: Dict[str, Dict]) -> EmbedField:
+        if info == None:
+            if backup not in remote_backups:
+                return EmbedField(backup, "Not in the backup catalog")
+            info = CatalogEntry.from_dict(remote_backups[backup])
+            info.replication = "remote only"
+        backup_timestamp = datetime.fromtimestamp(int(info.created)).strftime("%D %H:%M:%S")
+        replication = f", {info.replication}" if info.replication != None else ""
+        return EmbedField(backup, f"{backup_timestamp} ({info.size / 1048576:.1f} MiB, {info.files} files, {info.format}{replication})")
 
     @nextcord.slash_command(name="admin", description="Server owner commands")
     async def _admin(self, interaction: Interaction):
@@ -201,13 +260,29 @@ class ServerCog (commands.Cog):
 
     @_admin.subcommand(name="restore", description="Restore the world from a given backup")
     async def _ad_restore(self, interaction: Interaction,
-                          name: str = SlashOption(required=True, name="name", description="Name of the backup")):
+                          name: str = SlashOption(required=True, name="name", description="Name of the backup"),
+                          dimension: str = SlashOption(required=False, name="dimension",
+                                                       description="Only restore this dimension (overworld, nether, end, or a namespaced id)"),
+                          box: str = SlashOption(required=False, name="box", description="Only restore regions in this block box: x1 z1 x2 z2"),
+                          chunks: bool = SlashOption(required=False, name="chunks", description="With box, only restore the chunks in the box"),
+                          player: str = SlashOption(required=False, name="player", description="Only restore this player's data, by UUID"),
+                          server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_owner_and_reply(interaction):
             return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
         name = name.strip()
         button_timeout = 15
         buttons = ConfirmButtons(timeout=button_timeout)
-        await interaction.send(f"Are you sure you want to restore {name}?", view=buttons, ephemeral=True)
+        is_partial = dimension != None or box != None or player != None
+        if is_partial:
+            question = f"Are you sure you want to restore part of {name}?"
+        elif manager.server_should_be_running():
+            question = f"Are you sure you want to restore {name}? The server will restart once the backup is ready."
+        else:
+            question = f"Are you sure you want to restore {name}?"
+        await interaction.send(question, view=buttons, ephemeral=True)
         while not buttons.is_finished():
             await buttons.wait()
             if buttons.user == interaction.user:  # ephemeral anyway, but can't hurt
@@ -216,11 +291,25 @@ class ServerCog (commands.Cog):
                 elif buttons.value == ButtonEnums.ACCEPT:
                     try:
                         await interaction.edit_original_message(content="Working...", view=None)
-                        await self.manager.restore_backup(name)
-                    except RuntimeError:
-                        await interaction.edit_original_message(content="Cannot restore while server is running.", view=None)
+                        if is_partial:
+                            await manager.restore_partial(name, dimension=dimension if dimension != None else "overworld",
+                                                               box=box, player=player, chunks_only=chunks == True)
+                        elif await manager.restore_backup(name, restart=True):  # staged, swapped in as the server restarts
+                            await interaction.edit_original_message(content=f"Backup {name} staged, restarting the server to swap it in...", view=None)
+                            await manager.wait_for_restore_swap(timeout=600)
+                    except asyncio.TimeoutError:
+                        await interaction.edit_original_message(content=f"Backup {name} is staged, but the server has not restarted to swap it in yet.", view=None)
+                    except RuntimeError as e:
+                        if is_partial:
+                            await interaction.edit_original_message(content="Cannot restore while server is running.", view=None)
+                        else:  # the staged restore was replaced by another
+                            await interaction.edit_original_message(content=f"{e}", view=None)
                     except FileNotFoundError:
                         await interaction.edit_original_message(content="Specified backup does not exist.", view=None)
+                    except ValueError as e:
+                        await interaction.edit_original_message(content=f"{e}", view=None)
+                    except OSError as e:
+                        await interaction.edit_original_message(content=f"Failed to restore backup: {e}", view=None)
                     else:
                         await interaction.edit_original_message(content=f"Backup {name} restored.", view=None)
                         if interaction.user != None and type(interaction.channel) == nextcord.channel.TextChannel:
@@ -233,9 +322,13 @@ class ServerCog (commands.Cog):
 
     @_admin.subcommand(name="deletebackup", description="Delete a given backup")
     async def _ad_deletebackup(self, interaction: Interaction,
-                               name: str = SlashOption(required=True, name="name", description="Name of the backup")):
+                               name: str = SlashOption(required=True, name="name", description="Name of the backup"),
+                               server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
         if await self._verify_owner_and_reply(interaction):
             return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
         name = name.strip()
         button_timeout = 15
         buttons = ConfirmButtons(timeout=button_timeout)
@@ -248,17 +341,80 @@ class ServerCog (commands.Cog):
                 elif buttons.value == ButtonEnums.ACCEPT:
                     try:
                         await interaction.edit_original_message(content="Working...", view=None)
-                        self.manager.delete_backup(name.strip())
+                        await manager.delete_backup(name.strip())
                     except FileNotFoundError:
                         await interaction.edit_original_message(content="Specified backup does not exist.", view=None)
                     else:
-                        await interaction.edit_original_message(content=f"Backup {name} deleted.", view=None)
+                        await interaction.edit_original_message(content=f"Backup {name} deleted (its files are removed in the background).", view=None)
+            elif buttons.user != None:
+                buttons = ConfirmButtons(timeout=button_timeout)
+                await interaction.edit_original_message(view=buttons)
+        if buttons.value == None:
+            await interaction.edit_original_message(content="Request timed out.", view=None)
+
+    @_admin.subcommand(name="rollbackrestore", description="Undo the last restore, swapping the replaced world back in")
+    async def _ad_rollbackrestore(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_owner_and_reply(interaction):
+            return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
+        try:
+            await manager.rollback_restore()
+        except RuntimeError:
+            await interaction.send("Cannot roll back a restore while server is running.", ephemeral=True)
+        except FileNotFoundError:
+            await interaction.send("There is no restore to roll back.", ephemeral=True)
+        else:
+            await interaction.send("Rolled back the last restore.")
+
+    @_admin.subcommand(name="discardrollback", description="Delete the world kept from before the last restore")
+    async def _ad_discardrollback(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_owner_and_reply(interaction):
+            return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
+        if not await manager.has_restore_rollback():
+            await interaction.send("There is no restore rollback point to discard.", ephemeral=True)
+            return
+        button_timeout = 15
+        buttons = ConfirmButtons(timeout=button_timeout)
+        await interaction.send("Are you sure you want to delete the world from before the last restore?", view=buttons, ephemeral=True)
+        while not buttons.is_finished():
+            await buttons.wait()
+            if buttons.user == interaction.user:
+                if buttons.value == ButtonEnums.DENY:
+                    await interaction.edit_original_message(content="Canceled deletion.", view=None)
+                elif buttons.value == ButtonEnums.ACCEPT:
+                    try:
+                        await interaction.edit_original_message(content="Working...", view=None)
+                        await manager.discard_restore_rollback()
+                    except FileNotFoundError:
+                        await interaction.edit_original_message(content="There is no restore rollback point to discard.", view=None)
+                    else:
+                        await interaction.edit_original_message(content="Rollback point deleted.", view=None)
             elif buttons.user != None:
                 buttons = ConfirmButtons(timeout=button_timeout)
                 await interaction.edit_original_message(view=buttons)
         if buttons.value == None:
             await interaction.edit_original_message(content="Request timed out.", view=None)
 
+    @_admin.subcommand(name="rebuildbackups", description="Rebuild the backup list by reading the backup folder")
+    async def _ad_rebuildbackups(self, interaction: Interaction, server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        if await self._verify_owner_and_reply(interaction):
+            return
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        try:
+            backup_count = await manager.rebuild_backup_catalog()
+        except Exception as e:
+            await interaction.send(f"Failed to rebuild backup list: {e}", ephemeral=True)
+        else:
+            await interaction.send(f"Rebuilt backup list, found {backup_count} backups.", ephemeral=True)
+
     @_admin.subcommand(name="op", description="Give a user operator status")
     async def _ad_op(self, interaction: Interaction,
                      user: nextcord.User = SlashOption(required=True, name="user", description="User to op")):
@@ -289,38 +445,68 @@ class ServerCog (commands.Cog):
 
     @nextcord.slash_command(name="query", description="Query the server's state")
     async def _query(self, interaction: Interaction,
-                     hidden: bool = SlashOption(default=True, required=False, name="hidden", description="Make false to let everyone see this query")):
-        if await self._verify_server_online_and_reply(interaction):
-            return
-        response = self.pinger.get_status()
-        if response == None:
-            await interaction.send("Request timed out.", ephemeral=True)
+                     hidden: bool = SlashOption(default=True, required=False, name="hidden", description="Make false to let everyone see this query"),
+                     server: str = SlashOption(required=False, name="server", description=SERVER_DESCRIPTION)):
+        manager = await self._get_manager_and_reply(interaction, server)
+        if manager == None or await self._verify_server_online_and_reply(interaction, manager):
             return
-        version = self._read_dict_with_default(response, *["version", "name"], default_value="Unknown")
-        players_max = self._read_dict_with_default(response, *["players", "max"], default_value="?")
-        players_online = self._read_dict_with_default(response, *["players", "online"], default_value="?")
-        players_text = ""
-        try:
-            players_list = response["players"]["sample"]
-            for player in players_list:
-                players_text += f"{player['name']}, "
-            players_text = players_text[:-2]
-        except KeyError:
-            pass
-        motd = self._read_dict_with_default(response, *["description", "text"], default_value="\n")
-        if self._server_ip != None:
-            motd = f"{self._server_ip}\n\n{motd}"
+        entry = self.registry.resolve(server)
+        await interaction.response.defer(ephemeral=hidden)  # a server that does not answer takes a few seconds to time out
+        fields = []
+        query_client = entry.query_client()
+        stat = await query_client.full_stat() if query_client != None else None
+        if stat != None:  # Query lists every player, Server List Ping only a sample of them
+            version = stat.get("version", "Unknown")
+            players_online = stat.get("numplayers", "?")
+            players_max = stat.get("maxplayers", "?")
+            players = stat["players"]
+            motd = stat.get("hostname", "\n")
+        else:
+            cached = await entry.status_cache().get()
+            if cached == None:
+                await interaction.send("Request timed out.", ephemeral=True)
+                return
+            response = cached.status
+            version = self._read_dict_with_default(response, *["version", "name"], default_value="Unknown")
+            players_max = self._read_dict_with_default(response, *["players", "max"], default_value="?")
+            players_online = self._read_dict_with_default(response, *["players", "online"], default_value="?")
+            try:
+                players = [player["name"] for player in response["players"]["sample"]]  # type: ignore
+            except KeyError:
+                players = []
+            motd = self._read_dict_with_default(response, *["description", "text"], default_value="\n")
+            if cached.stale:
+                fields.append(EmbedField("Not responding", f"Showing the last status, from {cached.age():.0f}s ago", inline=False))
+            else:
+                fields.append(EmbedField("Latency", f"{cached.latency:.0f} ms", inline=True))
+        server_ip = entry.address()
+        if server_ip != None:
+            motd = f"{server_ip}\n\n{motd}"
         elif motd == None or motd == "":  # otherwise would crash embed, and not guaranteed default
             motd = "\n"
-        fields = []
-        fields.append(EmbedField("Online", players_online, inline=True))
-        fields.append(EmbedField("Capacity", players_max, inline=True))
-        fields.append(EmbedField("Version", version, inline=True))
-        if players_text != "":
-            fields.append(EmbedField("Current Players", players_text, inline=False))
-        emb = embedhelper.build_embed(*fields, title=self._server_name, description=motd, color=self._embed_color)
+        fields.insert(0, EmbedField("Online", players_online, inline=True))
+        fields.insert(1, EmbedField("Capacity", players_max, inline=True))
+        fields.insert(2, EmbedField("Version", version, inline=True))
+        if len(players) > 0:
+            fields.append(EmbedField("Current Players", self._join_players(players), inline=False))
+        emb = embedhelper.build_embed(*fields, title=entry.title(), description=motd, color=self._embed_color)
         await interaction.send(embed=emb, ephemeral=hidden)
 
+    def _join_players(self, players: List[str]) -> str:
+        '''Join player names for an embed field, leaving out the end of the list if it is too long (fields hold 1024 characters).'''
+        text = ", ".join(players)
+        if len(text) <= 1024:
+            return text
+        shown = []
+        length = 0
+        for player in players:
+            remaining = len(players) - len(shown) - 1
+            if length + len(player) + 2 + len(f"and {remaining} more") > 1024:
+                break
+            shown.append(player)
+            length += len(player) + 2
+        return f"{', '.join(shown)}, and {len(players) - len(shown)} more"
+
     def _read_dict_with_default(self, dict: Dict[str, str], *keys: str, default_value: Union[str, None] = None) -> str:
         try:
             # HACK this is a really stupid way of iterating a dict
@@ -334,19 +520,19 @@ class ServerCog (commands.Cog):
             else:
                 return default_value
 
-    async def _start_log_view(self, interaction: Interaction, log_entries: List[str], embed_title: str):
-        def build_log_embed_with_offset(logs: List[str], title: str, index: int) -> Embed:
+    async def _start_log_view(self, interaction: Interaction, log_entries: Sequence[str], embed_title: str):
+        def build_log_embed_with_offset(logs: Sequence[str], title: str, index: int) -> Embed:
             content = ""
-            for i in range(max(0, index), min(index + 10, len(logs))):
-                content += f"{logs[i]}\n"
+            for line in logs[max(0, index):index + 10]:  # slice so lazily loaded logs fetch the page at once
+                content += f"{line}\n"
             return embedhelper.build_embed(title=title, description=content, color=self._embed_color)
         await self._manage_pageable_embed(interaction, log_entries, embed_title, build_log_embed_with_offset, start_index=len(log_entries) - 10)
 
     async def _manage_pageable_embed(self,
                                      interaction: Interaction,
-                                     items: List,
+                                     items: Sequence,
                                      embed_title: str,
-                                     embed_builder: Callable[[List, str, int], Embed],
+                                     embed_builder: Callable[[Sequence, str, int], Embed],
                                      start_index: int = 0):
         index = start_index
         button_timeout = 30
@@ -389,11 +575,23 @@ class ServerCog (commands.Cog):
             return True
         return False
 
-    async def _verify_server_online_and_reply(self, interaction: Interaction):
+    async def _get_manager_and_reply(self, interaction: Interaction, server: Union[str, None]) -> Union[Manager, None]:
+        '''Get the manager of the server a command is for (loading it on first use), or None if there is none, replying to the interaction if so.'''
+        try:
+            return await self.registry.resolve(server).load()
+        except KeyError as e:
+            await interaction.send(e.args[0], ephemeral=True)
+        except (FileNotFoundError, RuntimeError) as e:
+            await interaction.send(f"Could not load the server: {e}", ephemeral=True)
+        except (OSError, asyncio.TimeoutError) as e:
+            await interaction.send(f"Could not reach the server's agent: {e}", ephemeral=True)
+        return None
+
+    async def _verify_server_online_and_reply(self, interaction: Interaction, manager: Manager):
         '''Return true if the server is NOT able to run commands, replying to the interaction if so.'''
-        if self.manager.server_active():
+        if manager.server_active():
             return False
-        elif self.manager.server_should_be_running():
+        elif manager.server_should_be_running():
             await interaction.send(f"The server is changing state, please wait a moment.", ephemeral=True)
             return True
         else:
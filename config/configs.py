@@ -1,5 +1,5 @@
 from configparser import ConfigParser
-from typing import Union
+from typing import Union, List
 import os
 
 
@@ -33,9 +33,9 @@ class ObsidiaConfigParser:
         '''Returns the absolute path of the current config file'''
         return self._file
 
-    def get(self, section: str, option: str) -> Union[str, None]:
+    def get(self, section: str, option: str, default: Union[str, None] = None) -> Union[str, None]:
         '''
-        Returns a given option in the specified config file, or None if it does not exist
+        Returns a given option in the specified config file, or default (None) if it does not exist
 
         Parameters
         ----------
@@ -43,6 +43,8 @@ class ObsidiaConfigParser:
             The section that the data is under, such as [Settings]
         option: `str`
             The actual option name, such as varname in varname=42
+        default: `str`, optional
+            The value to return if the option does not exist, default None
 
         Return
         ------
@@ -53,9 +55,19 @@ class ObsidiaConfigParser:
         except RuntimeError:  # fallback does not apply to missing sections
             value = None
         if value == None:
-            return value
+            return default
         return value.strip()
 
+    def sections(self) -> List[str]:
+        '''Returns the names of every section, in the order they appear in the file'''
+        return self._parser.sections()
+
+    def options(self, section: str) -> List[str]:
+        '''Returns the names of the options in a section, or an empty list if the section does not exist'''
+        if not self._parser.has_section(section):
+            return []
+        return self._parser.options(section)
+
     def add_section(self, section: str):
         '''Add a new section to the config'''
         self._parser.add_section(section)
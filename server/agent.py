@@ -0,0 +1,291 @@
+'''
+A node agent, which runs the servers on one machine for a bot running elsewhere
+
+The agent manages the servers configured on its machine (with the same [Server] or [Server:<key>] sections the bot uses),
+and serves them over the RPC protocol in server.rpc to bots that know its token. Servers keep running when the bot
+disconnects. Run it with:
+    python -m server.agent [config file, default config/obsidia.conf]
+which reads host, port and token from the [Agent] section.
+
+Classes
+-------
+NodeAgent
+    Serves a registry of servers to bots
+'''
+
+from server.rpc import AUTH_FRAME_SIZE, auth_digest, encode_frame, read_frame
+from server.console_subscription import OverflowPolicy
+from server.registry import ServerRegistry
+from server.server_manager import ServerManager
+from config.configs import ObsidiaConfigParser
+from loguru import logger
+from typing import Any, Dict, List, Set, Union
+import asyncio
+import secrets
+import hmac
+import sys
+import os
+
+
+DEFAULT_PORT = 25580
+STATE_INTERVAL = 1  # seconds between checks for changes to a watched server's state
+LOG_LINES = 1000  # the most recent lines of a server's latest log sent for /server log
+
+
+class _Client:
+    '''One connected bot: its writer, and the tasks of its requests and streams by request id.'''
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.write_lock = asyncio.Lock()
+
+    async def send(self, message: Dict):
+        async with self.write_lock:
+            self.writer.write(encode_frame(message))
+            await self.writer.drain()
+
+
+class NodeAgent:
+    '''
+    Serves the servers in a registry to bots over the RPC protocol in server.rpc.
+
+    Every request names the server it is for (by its key in the registry), except list_servers.
+    Each connection's requests run concurrently, and its streams (watch) run until cancelled or the connection closes.
+
+    Parameters
+    ----------
+    registry: `ServerRegistry`
+        The servers to serve
+    token: `str`
+        The shared secret bots must prove they know
+    host: `str`
+        The address to listen on, default "127.0.0.1" (only bots on this machine, give "0.0.0.0" for every interface)
+    port: `int`
+        The port to listen on, default 25580
+    '''
+
+    STREAMS = {"watch"}
+
+    def __init__(self, registry: ServerRegistry, token: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        if token == "":
+            raise ValueError("The agent needs a token")
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._token = token
+        self._server: Union[asyncio.AbstractServer, None] = None
+        self._clients: Set[_Client] = set()
+        self._start_tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        '''Start listening. The port is chosen by the system if it was 0, and can then be read from port.'''
+        self._server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        '''Stop listening and disconnect every bot. The servers keep running.'''
+        if self._server != None:
+            self._server.close()
+            await self._server.wait_closed()
+        for client in list(self._clients):
+            client.writer.close()
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = _Client(writer)
+        try:
+            challenge = secrets.token_hex(16)
+            await client.send({"challenge": challenge})
+            answer = await asyncio.wait_for(read_frame(reader, AUTH_FRAME_SIZE), 10)
+            if not hmac.compare_digest(str(answer.get("auth")), auth_digest(self._token, challenge)):
+                return  # the client sees the connection close, and raises PermissionError
+            await client.send({"authenticated": True})
+            self._clients.add(client)
+            while True:
+                message = await read_frame(reader)
+                if "cancel" in message:
+                    task = client.tasks.pop(message["cancel"], None)
+                    if task != None:
+                        task.cancel()
+                    continue
+                request_id = message.get("id")
+                client.tasks[request_id] = asyncio.ensure_future(  # type: ignore
+                    self._handle(client, request_id, str(message.get("method")), message.get("params", {})))  # type: ignore
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(client)
+            for task in client.tasks.values():
+                task.cancel()
+            writer.close()
+
+    async def _handle(self, client: _Client, request_id: int, method: str, params: Dict):
+        try:
+            handler = getattr(self, f"_rpc_{method}", None)
+            if handler == None:
+                raise ValueError(f"Unknown method {method}")
+            if method in self.STREAMS:
+                await handler(client, request_id, **params)
+                await client.send({"id": request_id, "end": True})
+            else:
+                await client.send({"id": request_id, "result": await handler(**params)})
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            message = str(e.args[0]) if isinstance(e, KeyError) and len(e.args) > 0 else str(e)  # str() would quote a KeyError's message
+            try:
+                await client.send({"id": request_id, "error": {"type": type(e).__name__, "message": message}})
+            except OSError:
+                pass
+        finally:
+            client.tasks.pop(request_id, None)
+
+    def _manager(self, server: str) -> ServerManager:
+        return self.registry.resolve(server).manager()
+
+    def _state(self, server: str) -> Dict[str, Any]:
+        entry = self.registry.resolve(server)
+        if not entry.is_loaded():
+            return {"active": False, "should_be_running": False, "port": None, "query_port": None}
+        manager = entry.manager()
+        return {"active": manager.server_active(), "should_be_running": manager.server_should_be_running(),
+                "port": manager._port, "query_port": manager._query_port}
+
+    async def _rpc_list_servers(self) -> List[Dict[str, Any]]:
+        return [{"key": entry.key, "name": entry.name, "ip": entry.ip} for entry in self.registry.entries()]
+
+    async def _rpc_state(self, server: str) -> Dict[str, Any]:
+        self._manager(server)  # load it, so its ports are known
+        return self._state(server)
+
+    async def _rpc_watch(self, client: _Client, request_id: int, server: str):
+        '''Stream {"state": ...} whenever the server's state changes (and once at the start), and {"console": [lines]} as it logs.'''
+        manager = self._manager(server)
+        subscription = manager.server.subscribe(1000, OverflowPolicy.DROP_OLDEST)
+
+        async def send_console():
+            async for batch in subscription:
+                await client.send({"id": request_id, "event": {"console": [str(record) for record in batch]}})
+
+        console_task = asyncio.ensure_future(send_console())
+        try:
+            state = None
+            while not console_task.done():
+                new_state = self._state(server)
+                if new_state != state:
+                    state = new_state
+                    await client.send({"id": request_id, "event": {"state": state}})
+                await asyncio.wait([console_task], timeout=STATE_INTERVAL)
+        finally:
+            manager.server.unsubscribe(subscription)
+            console_task.cancel()
+
+    async def _rpc_start(self, server: str):
+        manager = self._manager(server)
+        if manager.server_should_be_running():
+            raise RuntimeError("Server already running.")
+        self._start_tasks[server] = asyncio.ensure_future(self._monitor_server(server, manager))
+
+    async def _monitor_server(self, server: str, manager: ServerManager):
+        '''Run a server's monitor, logging its failure and telling its watchers, since no request waits for it.'''
+        try:
+            await manager.start_server()
+        except Exception as e:
+            logger.opt(exception=e).error(f"Server {server} stopped with an error")
+            await manager._update_server_listeners(f"Server stopped with an error: {e}")
+        finally:
+            if self._start_tasks.get(server) is asyncio.current_task():
+                del self._start_tasks[server]
+
+    async def _rpc_stop(self, server: str) -> Union[str, None]:
+        return self._manager(server).stop_server()
+
+    async def _rpc_write(self, server: str, command: str) -> Union[str, None]:
+        return self._manager(server).write(command)
+
+    async def _rpc_latest_log(self, server: str) -> List[str]:
+        log = await self._manager(server).get_latest_log()
+        # lines older than the console history are read from the log file, so read them off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: list(log[max(0, len(log) - LOG_LINES):]))
+
+    async def _rpc_backup(self, server: str, name: Union[str, None] = None) -> Union[str, None]:
+        return await self._manager(server).backup_world(name)
+
+    async def _rpc_list_backups(self, server: str) -> Union[str, List[str]]:
+        manager = self._manager(server)
+        await manager.load_backup_catalog()
+        return manager.list_backups()
+
+    async def _rpc_backup_infos(self, server: str, names: List[str]) -> Dict[str, Union[Dict, None]]:
+        manager = self._manager(server)
+        await manager.load_backup_catalog()
+        infos = manager.get_backup_infos(names)
+        return {name: info.to_dict() if info != None else None for name, info in infos.items()}
+
+    async def _rpc_remote_backups(self, server: str) -> Dict[str, Dict]:
+        return await self._manager(server).get_remote_backups()
+
+    async def _rpc_pending_deletions(self, server: str) -> List[str]:
+        return self._manager(server).pending_deletions()
+
+    async def _rpc_restore(self, server: str, name: str, restart: bool = True) -> bool:
+        return await self._manager(server).restore_backup(name, restart=restart)
+
+    async def _rpc_wait_restore_swap(self, server: str, timeout: Union[float, None] = None):
+        await self._manager(server).wait_for_restore_swap(timeout)
+
+    async def _rpc_restore_partial(self, server: str, name: str, dimension: str = "overworld", box: Union[str, None] = None,
+                                   player: Union[str, None] = None, chunks_only: bool = False):
+        await self._manager(server).restore_partial(name, dimension=dimension, box=box, player=player, chunks_only=chunks_only)
+
+    async def _rpc_delete_backup(self, server: str, name: str):
+        await self._manager(server).delete_backup(name)
+
+    async def _rpc_rollback_restore(self, server: str):
+        self._manager(server).rollback_restore()
+
+    async def _rpc_has_restore_rollback(self, server: str) -> bool:
+        return self._manager(server).has_restore_rollback()
+
+    async def _rpc_discard_restore_rollback(self, server: str):
+        await self._manager(server).discard_restore_rollback()
+
+    async def _rpc_rebuild_backups(self, server: str) -> int:
+        return await self._manager(server).rebuild_backup_catalog()
+
+
+async def _run_agent(config_file: str):
+    class ConsoleLogListener:
+        def __init__(self, key: str):
+            self._prefix = f"[{key}] "
+
+        def update(self, message: str):
+            logger.info(f"{self._prefix}{message}")
+
+    def log_console(entry):
+        entry.manager().server.add_listener(ConsoleLogListener(entry.key))
+
+    config = ObsidiaConfigParser(config_file)
+    try:
+        registry = ServerRegistry.from_config(config_file, on_load=log_console)
+        agent = NodeAgent(registry, config.get("Agent", "token", default=""), config.get("Agent", "host", default="127.0.0.1"),  # type: ignore
+                          int(config.get("Agent", "port", default=str(DEFAULT_PORT))))  # type: ignore
+    except ValueError as e:
+        logger.error(e)
+        return
+    await agent.start()
+    logger.info(f"Agent listening on {agent.host}:{agent.port} for {', '.join(registry.keys())}")
+    try:
+        await asyncio.Event().wait()  # serve until interrupted
+    finally:
+        await agent.close()
+        for entry in registry.loaded():
+            if entry.manager().stop_server() == None:
+                await entry.manager().wait_for_server_exit(timeout=60)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_run_agent(sys.argv[1] if len(sys.argv) > 1 else os.path.join("config", "obsidia.conf")))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,318 @@
+'''
+Compressed, seekable archive backups
+
+An archive is a tar stream compressed in independent blocks (like pigz or bgzip), so blocks are compressed in parallel
+and any block can be decompressed on its own. The file is still an ordinary .tar.gz or .tar.xz that other tools can open.
+A JSON index beside it (<archive>.idx) lists every block and member, so single files or folders can be read without
+decompressing the rest of the archive.
+
+zlib and lzma release the GIL while compressing, so the blocks are compressed on a thread pool rather than a process pool.
+
+Classes
+-------
+ArchiveReader
+    Reads members out of an archive using its index
+
+Methods
+-------
+write_archive(path: `str`, sources: `List[Tuple[str, str]]`, compression: `str`, level: `int`, workers: `int`,
+block_size: `int`, progress: `Callable[[int, int, int, int], None]`) -> `int`
+    Write an archive of directory trees, returning its size
+archive_name(filename: `str`) -> `str`
+    Get the backup name of an archive file, or None if it is not one
+archive_files(path: `str`) -> `List[str]`
+    Get the files that make up an archive (the archive and its index)
+'''
+
+from server.backups.throttle import Throttle, ThrottledReader
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Tuple, Union
+from collections import deque
+import tarfile
+import fnmatch
+import shutil
+import gzip
+import lzma
+import json
+import zlib
+import time
+import os
+
+
+ARCHIVE_SUFFIXES = {"gzip": ".tar.gz", "xz": ".tar.xz"}
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+IGNORED_PATTERNS = ["*.lock"]
+
+
+def _compress_block(data: bytes, compression: str, level: int) -> bytes:
+    if compression == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 writes a complete gzip member
+        return compressor.compress(data) + compressor.flush()
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+def _decompress_block(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return zlib.decompress(data, 31)
+    return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+class _BlockWriter:
+    '''File-like object that tarfile writes into, compressing each full block on the pool and writing blocks in order.'''
+
+    def __init__(self, output, executor: ThreadPoolExecutor, compression: str, level: int, block_size: int, max_pending: int):
+        self._output = output
+        self._executor = executor
+        self._compression = compression
+        self._level = level
+        self._block_size = block_size
+        self._max_pending = max_pending
+        self._buffer = bytearray()
+        self._pending: Deque[Tuple[int, int, Future]] = deque()
+        self._uncompressed_offset = 0
+        self._compressed_offset = 0
+        self.blocks: List[List[int]] = []  # [uncompressed offset, uncompressed size, compressed offset, compressed size]
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        future = self._executor.submit(_compress_block, block, self._compression, self._level)
+        self._pending.append((self._uncompressed_offset, len(block), future))
+        self._uncompressed_offset += len(block)
+        while len(self._pending) > self._max_pending:  # bound memory by waiting for the oldest block
+            self._write_oldest()
+
+    def _write_oldest(self):
+        uncompressed_offset, uncompressed_size, future = self._pending.popleft()
+        compressed = future.result()
+        self._output.write(compressed)
+        self.blocks.append([uncompressed_offset, uncompressed_size, self._compressed_offset, len(compressed)])
+        self._compressed_offset += len(compressed)
+
+    def close(self):
+        if len(self._buffer) > 0:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while len(self._pending) > 0:
+            self._write_oldest()
+
+    def abort(self):
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+
+def write_archive(path: str, sources: List[Tuple[str, str]], compression: str = "gzip", level: int = 6, workers: int = 4,
+                  block_size: int = 4 * 1024 * 1024, progress: Union[Callable[[int, int, int, int], None], None] = None,
+                  throttle: Union[Throttle, None] = None) -> int:
+    '''
+    Write an archive of directory trees at path, along with its index, returning the archive's size in bytes.
+
+    This blocks until the archive is written, so run it off the event loop.
+
+    Parameters
+    ----------
+    path: `str`
+        The archive to create, which should end with the suffix for its compression (see ARCHIVE_SUFFIXES)
+    sources: `List[Tuple[str, str]]`
+        (directory, name in the archive) for each tree, such as ("/srv/mc/world", "world")
+    compression: `str`
+        "gzip" or "xz", default "gzip"
+    level: `int`
+        The compression level (gzip 1-9, xz 0-9), default 6
+    workers: `int`
+        The number of blocks to compress at once, default 4
+    block_size: `int`
+        The uncompressed size of each independently compressed block, default 4 MiB
+    progress: `Callable[[int, int, int, int], None]`, optional
+        Called from the writing thread with (files done, total files, bytes done, total bytes), at most every 5 seconds
+    throttle: `Throttle`, optional
+        Take an operation for each file and the bytes read from the files from this throttle
+    '''
+    if compression not in ARCHIVE_SUFFIXES:
+        raise ValueError(f"Unknown archive compression \"{compression}\", use one of {', '.join(ARCHIVE_SUFFIXES)}.")
+    entries = []
+    for directory, archive_root in sources:
+        for root, dirs, files in os.walk(directory):
+            relative_root = os.path.relpath(root, directory)
+            archive_directory = os.path.normpath(os.path.join(archive_root, relative_root)).replace(os.sep, "/")
+            entries.append((root, archive_directory, 0))
+            for name in sorted(files):
+                if not any(fnmatch.fnmatch(name, pattern) for pattern in IGNORED_PATTERNS):
+                    file_path = os.path.join(root, name)
+                    entries.append((file_path, f"{archive_directory}/{name}", os.path.getsize(file_path)))
+    total_files = sum(1 for _, _, size in entries if size > 0)
+    total_bytes = sum(size for _, _, size in entries)
+    members: Dict[str, Dict] = {}
+    temporary_path = f"{path}.tmp"
+    last_report = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ArchiveCompressor") as executor, \
+            open(temporary_path, "wb") as output:
+        writer = _BlockWriter(output, executor, compression, level, block_size, max_pending=max(1, workers) * 2)
+        try:
+            files_done = bytes_done = 0
+            with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:  # type: ignore
+                for entry_path, archive_path, _ in entries:
+                    info = tar.gettarinfo(entry_path, archive_path)
+                    if info.isfile():
+                        with open(entry_path, "rb") as entry_file:
+                            if throttle != None:
+                                throttle.acquire(operations=1)
+                                entry_file = ThrottledReader(entry_file, throttle)  # type: ignore
+                            tar.addfile(info, entry_file)
+                        files_done += 1
+                        bytes_done += info.size
+                    else:
+                        tar.addfile(info)
+                    # tarfile pads file data to 512 bytes, so the data starts that far before the end of the member
+                    members[archive_path] = {"offset": tar.offset - (-(-info.size // 512) * 512), "size": info.size,
+                                             "type": "file" if info.isfile() else "dir", "mode": info.mode, "mtime": info.mtime}
+                    if progress != None and time.monotonic() - last_report >= 5:
+                        last_report = time.monotonic()
+                        progress(files_done, total_files, bytes_done, total_bytes)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            output.close()
+            os.unlink(temporary_path)
+            raise
+    index = {"version": INDEX_VERSION, "compression": compression, "blocks": writer.blocks, "members": members}
+    with open(path + INDEX_SUFFIX, "w") as index_file:
+        json.dump(index, index_file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+    return os.path.getsize(path)
+
+
+def archive_name(filename: str) -> Union[str, None]:
+    '''Get the backup name of an archive file (e.g. "1622694042" for "1622694042.tar.gz"), or None if it is not one.'''
+    for suffix in ARCHIVE_SUFFIXES.values():
+        if filename.endswith(suffix) and len(filename) > len(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def archive_files(path: str) -> List[str]:
+    '''Get the files that make up the archive at path (the archive and its index).'''
+    return [path, path + INDEX_SUFFIX]
+
+
+class ArchiveReader:
+    '''
+    Reads members out of an archive using its index, decompressing only the blocks they are stored in.
+
+    Parameters
+    ----------
+    path: `str`
+        The archive to read, raises FileNotFoundError if it or its index are missing
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + INDEX_SUFFIX, "r") as index_file:
+            index = json.load(index_file)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported archive index: {path + INDEX_SUFFIX}")
+        self._compression = index["compression"]
+        self._blocks: List[List[int]] = index["blocks"]
+        self._members: Dict[str, Dict] = index["members"]
+
+    def members(self, prefix: str = "") -> List[str]:
+        '''Get the names of the members (files and folders) at or under prefix, such as "world/region".'''
+        prefix = prefix.strip("/")
+        if prefix == "":
+            return list(self._members)
+        return [name for name in self._members if name == prefix or name.startswith(prefix + "/")]
+
+    def top_level(self) -> List[str]:
+        '''Get the names of the trees in the archive, such as the world folders.'''
+        return sorted({name.split("/", 1)[0] for name in self._members})
+
+    def is_file(self, name: str) -> bool:
+        '''Whether a member is a file (rather than a folder), raises KeyError if it is not in the archive.'''
+        return self._members[name]["type"] == "file"
+
+    def size(self, name: str) -> int:
+        '''The uncompressed size of a member, raises KeyError if it is not in the archive.'''
+        return self._members[name]["size"]
+
+    def read(self, name: str) -> bytes:
+        '''Read a file from the archive, raises KeyError if it is not in the archive.'''
+        member = self._members[name]
+        return self._read_range(member["offset"], member["size"])
+
+    def _read_range(self, offset: int, size: int) -> bytes:
+        '''Read a range of the uncompressed tar stream.'''
+        data = bytearray()
+        end = offset + size
+        with open(self.path, "rb") as archive:
+            for uncompressed_offset, uncompressed_size, compressed_offset, compressed_size in self._blocks:
+                block_end = uncompressed_offset + uncompressed_size
+                if block_end <= offset or uncompressed_offset >= end:
+                    continue
+                archive.seek(compressed_offset)
+                block = _decompress_block(archive.read(compressed_size), self._compression)
+                data += block[max(0, offset - uncompressed_offset):min(uncompressed_size, end - uncompressed_offset)]
+        return bytes(data)
+
+    def extract(self, prefix: str, destination: str, archive_root: Union[str, None] = None):
+        '''
+        Extract the members under prefix into destination.
+
+        Member paths are made relative to archive_root (default prefix), e.g. extracting "world" into /srv/mc/world.
+        '''
+        archive_root = (prefix if archive_root == None else archive_root).strip("/")
+        destination = os.path.abspath(destination)
+        directories = []
+        for name in sorted(self.members(prefix)):
+            relative = os.path.relpath(name, archive_root) if archive_root != "" else name
+            target = os.path.normpath(os.path.join(destination, relative))
+            if target != destination and not target.startswith(destination + os.sep):
+                raise ValueError(f"Archive member {name} is outside of the destination.")
+            member = self._members[name]
+            if member["type"] == "dir":
+                os.makedirs(target, exist_ok=True)
+                directories.append((target, member))
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as target_file:
+                target_file.write(self.read(name))
+            os.chmod(target, member["mode"] & 0o7777)
+            os.utime(target, (member["mtime"], member["mtime"]))
+        for target, member in reversed(directories):  # after their contents, which change their times
+            os.utime(target, (member["mtime"], member["mtime"]))
+
+    def extract_all(self, prefix: str, destination: str):
+        '''
+        Extract the tree at prefix (such as "world") into destination by streaming through the archive once.
+
+        Faster than extract() for large trees, since every block is decompressed exactly once and in order.
+        '''
+        prefix = prefix.strip("/")
+        destination = os.path.abspath(destination)
+        directories = []
+        # tarfile's own "r|gz" stops after the first gzip member, while the gzip and lzma modules read every member in turn
+        opener = gzip.open if self._compression == "gzip" else lzma.open
+        with opener(self.path, "rb") as stream, tarfile.open(fileobj=stream, mode="r|") as tar:  # type: ignore
+            for info in tar:
+                if info.name != prefix and not info.name.startswith(prefix + "/"):
+                    continue
+                target = os.path.normpath(os.path.join(destination, os.path.relpath(info.name, prefix)))
+                if target != destination and not target.startswith(destination + os.sep):
+                    raise ValueError(f"Archive member {info.name} is outside of the destination.")
+                if info.isdir():
+                    os.makedirs(target, exist_ok=True)
+                    directories.append((target, info))
+                elif info.isfile():
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with tar.extractfile(info) as source, open(target, "wb") as target_file:  # type: ignore
+                        shutil.copyfileobj(source, target_file, 1024 * 1024)
+                    os.chmod(target, info.mode & 0o7777)
+                    os.utime(target, (info.mtime, info.mtime))
+        for target, info in reversed(directories):
+            os.utime(target, (info.mtime, info.mtime))
@@ -0,0 +1,148 @@
+'''
+A persistent catalog of backups, so they can be listed without reading the backup folder
+
+Classes
+-------
+CatalogEntry
+    What the catalog records about one backup
+BackupCatalog
+    The catalog, kept in memory in creation order and saved as JSON
+'''
+
+from typing import Dict, List, Union
+import tempfile
+import json
+import os
+
+
+CATALOG_VERSION = 1
+
+
+class CatalogEntry:
+    '''
+    What the catalog records about one backup
+
+    Attributes
+    ----------
+    name: `str`
+        The backup's name
+    created: `float`
+        When the backup was made, in epoch seconds
+    size: `int`
+        The size of the backup's files in bytes: as stored for directory backups (where region delta manifests are small),
+        and as restored for archives and repository snapshots (before compression or sharing chunks with other backups)
+    files: `int`
+        The number of backed up files
+    worlds: `List[str]`
+        The world folders in the backup
+    format: `str`
+        How the backup is stored: "directory", "archive", or "repository"
+    origin: `str`
+        "scheduled" for timestamped backups (which max_backups prunes), or "named" for backups given a name
+    fingerprint: `str`
+        A fingerprint of the world files when the backup was taken (see fingerprint_trees()), or None if not recorded
+    replication: `str`
+        Whether the backup has been copied offsite: "pending", "uploading", "replicated", "failed", or None if it is not replicated
+    '''
+
+    __slots__ = ("name", "created", "size", "files", "worlds", "format", "origin", "fingerprint", "replication")
+
+    def __init__(self, name: str, created: float, size: int, files: int, worlds: List[str], format: str, origin: str,
+                 fingerprint: Union[str, None] = None, replication: Union[str, None] = None):
+        self.name = name
+        self.created = created
+        self.size = size
+        self.files = files
+        self.worlds = worlds
+        self.format = format
+        self.origin = origin
+        self.fingerprint = fingerprint
+        self.replication = replication
+
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, entry: Dict) -> "CatalogEntry":
+        return cls(**{slot: entry[slot] for slot in cls.__slots__ if slot in entry})
+
+
+class BackupCatalog:
+    '''
+    The catalog of backups, kept in memory in creation order and saved as JSON after every change.
+
+    Every lookup is served from memory. The file is written to a temporary file and renamed into place,
+    so an interrupted save leaves the previous catalog intact.
+
+    Parameters
+    ----------
+    path: `str`
+        The catalog file, loaded now if it exists
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, CatalogEntry] = {}
+        if self.exists():
+            with open(path, "r") as catalog_file:
+                catalog = json.load(catalog_file)
+            if catalog.get("version") != CATALOG_VERSION:
+                raise ValueError(f"Unsupported backup catalog: {path}")
+            self._set_entries(CatalogEntry.from_dict(entry) for entry in catalog["backups"])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def exists(self) -> bool:
+        '''Whether the catalog has been saved to disk (if not, it should be rebuilt from the backup folder).'''
+        return os.path.isfile(self.path)
+
+    def get(self, name: str) -> Union[CatalogEntry, None]:
+        '''Get a backup's entry, or None if it is not in the catalog.'''
+        return self._entries.get(name)
+
+    def entries(self) -> List[CatalogEntry]:
+        '''Get every entry, oldest first.'''
+        return list(self._entries.values())
+
+    def names(self) -> List[str]:
+        '''Get the name of every backup, oldest first.'''
+        return list(self._entries)
+
+    def add(self, entry: CatalogEntry):
+        '''Record a backup, replacing any entry with the same name.'''
+        self._entries.pop(entry.name, None)
+        if len(self._entries) > 0 and entry.created < next(reversed(self._entries.values())).created:
+            self._set_entries(list(self._entries.values()) + [entry])  # out of order (e.g. the clock moved back), re-sort
+        else:
+            self._entries[entry.name] = entry
+        self.save()
+
+    def remove(self, name: str):
+        '''Forget a backup, if it is in the catalog.'''
+        if self._entries.pop(name, None) != None:
+            self.save()
+
+    def replace_all(self, entries: List[CatalogEntry]):
+        '''Replace every entry, such as after rebuilding the catalog from the backup folder.'''
+        self._set_entries(entries)
+        self.save()
+
+    def _set_entries(self, entries):
+        self._entries = {entry.name: entry for entry in sorted(entries, key=lambda entry: entry.created)}
+
+    def save(self):
+        '''Write the catalog to disk, such as after changing an entry in place.'''
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "w") as catalog_file:
+                json.dump({"version": CATALOG_VERSION, "backups": [entry.to_dict() for entry in self._entries.values()]}, catalog_file)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
@@ -0,0 +1,80 @@
+from typing import Iterator, Set, Tuple
+import hashlib
+import tempfile
+import os
+
+
+class ChunkPool:
+    '''
+    A directory of blobs stored once each, named by the hash of their contents.
+
+    Blobs are spread over subdirectories by the first two characters of their hash (pool/ab/abcdef...).
+    Writes go to a temporary file that is renamed into place, so concurrent writers and interrupted writes are safe.
+
+    Parameters
+    ----------
+    directory: `str`
+        The directory to store blobs in, created when the first blob is stored
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        '''Get the hash that a blob would be stored under.'''
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def path(self, blob_hash: str) -> str:
+        '''Get the file a blob is (or would be) stored in.'''
+        return os.path.join(self.directory, blob_hash[:2], blob_hash)
+
+    def __contains__(self, blob_hash: str) -> bool:
+        return os.path.exists(self.path(blob_hash))
+
+    def put(self, data: bytes) -> str:
+        '''Store a blob if it is not already stored, returning its hash.'''
+        blob_hash = self.hash(data)
+        path = self.path(blob_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(descriptor, "wb") as blob_file:
+                    blob_file.write(data)
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+        return blob_hash
+
+    def get(self, blob_hash: str) -> bytes:
+        '''Read a stored blob, raises FileNotFoundError if it is not stored.'''
+        with open(self.path(blob_hash), "rb") as blob_file:
+            return blob_file.read()
+
+    def hashes(self) -> Iterator[str]:
+        '''Iterate over the hashes of every stored blob.'''
+        if not os.path.isdir(self.directory):
+            return
+        for prefix in os.listdir(self.directory):
+            prefix_directory = os.path.join(self.directory, prefix)
+            if os.path.isdir(prefix_directory):
+                for name in os.listdir(prefix_directory):
+                    if not name.startswith("."):
+                        yield name
+
+    def collect_garbage(self, referenced: Set[str]) -> Tuple[int, int]:
+        '''Delete every blob not in referenced, returning the number of blobs and bytes removed.'''
+        removed = freed = 0
+        for blob_hash in list(self.hashes()):
+            if blob_hash not in referenced:
+                path = self.path(blob_hash)
+                try:
+                    size = os.path.getsize(path)
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += size
+        return removed, freed
@@ -0,0 +1,306 @@
+'''
+Parallel file copying for backups and restores, run off the event loop
+
+Classes
+-------
+CopyEngine
+    Copies and deletes directory trees on a pool of worker threads
+
+Methods
+-------
+copy_file_fast(source: `str`, destination: `str`, reflink: `bool`) -> `bool`
+    Copy a file's contents and metadata using the fastest method the platform offers
+clone_file(source: `str`, destination: `str`) -> `bool`
+    Make a copy-on-write clone of a file (a reflink), where the filesystem supports it
+probe_reflink(source_directory: `str`, destination_directory: `str`) -> `bool`
+    Check whether files can be cloned from one directory into another
+benchmark(source: `str`, destination: `str`, workers: `int`) -> `Dict[str, float]`
+    Time copying a tree with and without reflinks
+'''
+
+from server.backups.throttle import Throttle, ThrottledReader, lower_thread_priority, set_idle_io_priority
+from typing import Awaitable, Callable, Dict, List, Set, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import tempfile
+import asyncio
+import fnmatch
+import shutil
+import time
+import sys
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+IGNORED_PATTERNS = ["*.lock"]
+THROTTLED_PIECE_SIZE = 1048576  # how much a throttled copy moves between taking tokens
+FICLONE = 0x40049409  # from linux/fs.h, supported by btrfs, XFS (with reflink=1), bcachefs, and others
+# (source file, destination file, previous file, key)
+FileFunction = Callable[[str, Union[str, None], Union[str, None], str], None]
+# (files done, total files, bytes done, total bytes)
+ProgressCallback = Callable[[int, int, int, int], Awaitable]
+
+
+def clone_file(source: str, destination: str) -> bool:
+    '''
+    Make destination a copy-on-write clone of source with the FICLONE ioctl, which is nearly instant and shares the
+    file's blocks until either copy changes. Returns false (leaving destination empty) where the filesystem does not support it.
+    Only the contents are cloned, not the metadata.
+    '''
+    if fcntl == None or not sys.platform.startswith("linux"):
+        return False
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:  # unsupported filesystem, or the files are on different filesystems
+            return False
+    return True
+
+
+def probe_reflink(source_directory: str, destination_directory: str) -> bool:
+    '''Check whether files in source_directory can be cloned into destination_directory, using small temporary files.'''
+    if fcntl == None or not sys.platform.startswith("linux"):
+        return False
+    source_descriptor, source_path = tempfile.mkstemp(dir=source_directory, prefix=".reflink-probe-")
+    destination_path = None
+    try:
+        with os.fdopen(source_descriptor, "wb") as source_file:
+            source_file.write(b"\0" * 4096)
+        destination_descriptor, destination_path = tempfile.mkstemp(dir=destination_directory, prefix=".reflink-probe-")
+        os.close(destination_descriptor)
+        return clone_file(source_path, destination_path)
+    finally:
+        os.unlink(source_path)
+        if destination_path != None:
+            os.unlink(destination_path)
+
+
+def copy_file_fast(source: str, destination: str, reflink: bool = False, throttle: Union[Throttle, None] = None) -> bool:
+    '''
+    Copy a file's contents and metadata (like shutil.copy2) using the fastest method the platform offers.
+    Returns true if the file was cloned rather than copied.
+
+    If reflink is true, the file is cloned with FICLONE first (see clone_file()), falling back to copying.
+    os.copy_file_range lets the kernel copy without passing data through userspace (and lets some filesystems share blocks).
+    Where it is unavailable or refused, shutil.copyfile is used, which itself uses sendfile or fcopyfile where it can.
+    With a throttle, the copy takes its bytes from it a piece at a time (clones move no data, so take nothing).
+    '''
+    if reflink and clone_file(source, destination):
+        shutil.copystat(source, destination)
+        return True
+    piece_size = THROTTLED_PIECE_SIZE if throttle != None and throttle.is_limited() else 1 << 30
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+                remaining = os.fstat(source_file.fileno()).st_size
+                while remaining > 0:
+                    if throttle != None:
+                        throttle.acquire(min(remaining, piece_size))
+                    copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), min(remaining, piece_size))  # type: ignore
+                    if copied == 0:  # file shrank while copying
+                        break
+                    remaining -= copied
+        except OSError:  # e.g. copying across filesystems on older kernels
+            _copy_file_throttled(source, destination, throttle)
+    else:
+        _copy_file_throttled(source, destination, throttle)
+    shutil.copystat(source, destination)
+    return False
+
+
+def _copy_file_throttled(source: str, destination: str, throttle: Union[Throttle, None]):
+    if throttle == None:
+        shutil.copyfile(source, destination)
+        return
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        shutil.copyfileobj(ThrottledReader(source_file, throttle), destination_file, THROTTLED_PIECE_SIZE)  # type: ignore
+
+
+def _throttled_call(throttle: Throttle, file_function: FileFunction, *args):
+    throttle.acquire(operations=1)
+    file_function(*args)
+
+
+class CopyEngine:
+    '''
+    Copies and deletes directory trees on a pool of worker threads, so the event loop stays responsive.
+
+    Files from every tree in a job are copied concurrently, up to the number of workers.
+    What "copying" a file means is up to the file function (e.g. SnapshotCopier.copy_file), which runs on the workers.
+
+    Parameters
+    ----------
+    workers: `int`
+        The number of worker threads, default 4
+    progress_interval: `float`
+        The minimum number of seconds between progress reports, default 5
+    idle_priority: `bool`
+        Run the workers at the lowest CPU priority and in the idle I/O class (see set_idle_io_priority()), default False
+    '''
+
+    def __init__(self, workers: int = 4, progress_interval: float = 5, idle_priority: bool = False):
+        self.workers = max(1, workers)
+        self.idle_priority = idle_priority
+        self._progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="BackupCopier",
+                                            initializer=self._lower_worker_priority if idle_priority else None)
+
+    @staticmethod
+    def _lower_worker_priority():
+        lower_thread_priority()
+        set_idle_io_priority()
+
+    def shutdown(self):
+        '''Stop the worker threads once queued work is done.'''
+        self._executor.shutdown(wait=False)
+
+    async def copy_trees(self, trees: List[Tuple[str, Union[str, None], Union[str, None], str]], file_function: FileFunction = None,  # type: ignore
+                         progress: Union[ProgressCallback, None] = None, throttle: Union[Throttle, None] = None) -> int:
+        '''
+        Copy several directory trees concurrently, returning the number of files copied.
+
+        Parameters
+        ----------
+        trees: `List[Tuple[str, str, Union[str, None], str]]`
+            (source, destination, previous, key prefix) for each tree.
+            Previous is the matching tree in an earlier snapshot (or None), passed on per file to file_function.
+            Destination may be None if file_function stores files elsewhere (such as RepositorySnapshot.add_file),
+            in which case file_function is passed None and no folders are created.
+        file_function: `Callable[[str, str, Union[str, None], str], None]`, optional
+            Called on a worker as (source file, destination file, previous file, key) for every file,
+            where key is the key prefix + the file's path relative to its source, with "/" separators.
+            Defaults to copy_file_fast.
+        progress: `Callable[[int, int, int, int], Awaitable]`, optional
+            Awaited on the event loop with (files done, total files, bytes done, total bytes) as the copy progresses
+        throttle: `Throttle`, optional
+            Take an operation from this throttle for each file, before it is handed to file_function.
+            The default file_function takes its bytes from it too, other file functions should be given it themselves.
+        '''
+        if file_function == None:
+            file_function = lambda source, destination, previous, key: copy_file_fast(source, destination, throttle=throttle)
+        if throttle != None:
+            file_function = functools.partial(_throttled_call, throttle, file_function)
+        loop = asyncio.get_running_loop()
+        files, directories = await loop.run_in_executor(self._executor, self._plan, trees)
+        total_bytes = sum(size for *_, size in files)
+        counts = [0, 0]  # files done, bytes done
+        last_report = time.monotonic()
+        pending: Set[asyncio.Future] = set()
+        sizes = {}
+
+        async def wait_for_files():
+            nonlocal pending, last_report
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                future.result()  # raise the first failure
+                counts[0] += 1
+                counts[1] += sizes.pop(future)
+            if progress != None and time.monotonic() - last_report >= self._progress_interval:
+                last_report = time.monotonic()
+                await progress(counts[0], len(files), counts[1], total_bytes)
+
+        try:
+            for source_file, destination_file, previous_file, key, size in files:
+                if len(pending) >= self.workers * 4:  # keep the queue short so a failure stops the copy quickly
+                    await wait_for_files()
+                future = loop.run_in_executor(self._executor, file_function, source_file, destination_file, previous_file, key)
+                sizes[future] = size
+                pending.add(future)
+            while len(pending) > 0:
+                await wait_for_files()
+        except BaseException:
+            for future in pending:  # files already being copied finish, the rest never start
+                future.cancel()
+            raise
+        # directory times last, since adding files changes them
+        await loop.run_in_executor(self._executor, self._copy_directory_stats, directories)
+        return len(files)
+
+    async def copy_tree(self, source: str, destination: str, file_function: FileFunction = None,  # type: ignore
+                        previous: Union[str, None] = None, key_prefix: str = "",
+                        progress: Union[ProgressCallback, None] = None) -> int:
+        '''Copy a single directory tree, see copy_trees().'''
+        return await self.copy_trees([(source, destination, previous, key_prefix)], file_function, progress)
+
+    async def run(self, function: Callable, *args):
+        '''Run a blocking function on a worker (at the workers' priority).'''
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def delete_tree(self, path: str):
+        '''Delete a directory tree on a worker.'''
+        await asyncio.get_running_loop().run_in_executor(self._executor, shutil.rmtree, path)
+
+    def _plan(self, trees: List[Tuple[str, Union[str, None], Union[str, None], str]]):
+        '''Walk the trees, creating the destination directories and listing the files to copy.'''
+        files = []
+        directories = []
+        for source, destination, previous, key_prefix in trees:
+            for root, _, names in os.walk(source):
+                relative_root = os.path.relpath(root, source)
+                destination_root = None
+                if destination != None:
+                    destination_root = os.path.normpath(os.path.join(destination, relative_root))
+                    os.makedirs(destination_root, exist_ok=True)
+                    directories.append((root, destination_root))
+                for name in names:
+                    if any(fnmatch.fnmatch(name, pattern) for pattern in IGNORED_PATTERNS):
+                        continue
+                    source_file = os.path.join(root, name)
+                    try:
+                        size = os.path.getsize(source_file)
+                    except OSError:
+                        size = 0
+                    previous_file = os.path.normpath(os.path.join(previous, relative_root, name)) if previous != None else None
+                    key = key_prefix + os.path.normpath(os.path.join(relative_root, name)).replace(os.sep, "/")
+                    destination_file = os.path.join(destination_root, name) if destination_root != None else None
+                    files.append((source_file, destination_file, previous_file, key, size))
+        return files, directories
+
+    def _copy_directory_stats(self, directories: List[Tuple[str, str]]):
+        for source, destination in directories:
+            try:
+                shutil.copystat(source, destination)
+            except OSError:
+                pass
+
+
+def benchmark(source: str, destination: str, workers: int = 4) -> Dict[str, float]:
+    '''
+    Time copying the tree at source into (temporary folders in) destination with and without reflinks, in seconds.
+    Reflinks are only timed if the filesystem supports cloning from source to destination.
+
+    Usage: python -m server.backups.copier <source folder> <destination folder> [workers]
+    '''
+    engine = CopyEngine(workers)
+    results = {}
+    methods = {"copy": False}
+    if probe_reflink(source, destination):
+        methods["reflink"] = True
+    try:
+        for method, reflink in methods.items():
+            target = tempfile.mkdtemp(dir=destination, prefix=f".benchmark-{method}-")
+            try:
+                start = time.perf_counter()
+                asyncio.run(engine.copy_tree(source, target, lambda source_file, destination_file, previous, key:
+                                             copy_file_fast(source_file, destination_file, reflink)))  # type: ignore
+                results[method] = time.perf_counter() - start
+            finally:
+                shutil.rmtree(target)
+    finally:
+        engine.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m server.backups.copier <source folder> <destination folder> [workers]")
+        exit(1)
+    timings = benchmark(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 4)
+    if "reflink" not in timings:
+        print("Reflinks are not supported between these folders.")
+    for method, seconds in timings.items():
+        print(f"{method}: {seconds:.3f}s")
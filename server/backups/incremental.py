@@ -0,0 +1,105 @@
+'''
+Change detection for incremental snapshots, which hard link unchanged files to a previous snapshot like rsync --link-dest
+
+Every snapshot is still a complete directory, files are only shared on disk.
+Deleting a snapshot only removes its links, so older or newer snapshots are unaffected.
+See SnapshotCopier for the copying itself.
+
+Methods
+-------
+file_unchanged(source: `str`, previous: `str`, verify_hash: `bool`, previous_hash: `str`) -> `Tuple[bool, str]`
+    Check whether a file matches its copy in a previous snapshot
+hash_file(path: `str`) -> `str`
+    Hash a file's contents
+load_hashes(snapshot: `str`) -> `Dict[str, str]`
+    Load the content hashes recorded in a snapshot
+save_hashes(snapshot: `str`, hashes: `Dict[str, str]`)
+    Record content hashes in a snapshot
+fingerprint_trees(trees: `List[Tuple[str, str]]`) -> `str`
+    Summarize the paths, sizes, and modification times of every file in some trees
+'''
+
+from typing import Dict, List, Tuple, Union
+import hashlib
+import fnmatch
+import json
+import os
+
+
+HASHES_FILE = ".obsidia-hashes.json"
+FINGERPRINT_IGNORED = ["*.lock", "level.dat", "level.dat_old"]  # rewritten by every save, even with nobody online
+
+
+def file_unchanged(source: str, previous: str, verify_hash: bool = False,
+                   previous_hash: Union[str, None] = None) -> Tuple[bool, Union[str, None]]:
+    '''
+    Check whether the file at source matches its copy in a previous snapshot.
+
+    If verify_hash is set, the contents are compared too, using previous_hash for the previous copy if it is known.
+    Returns whether the file is unchanged, and the source's hash if the source was hashed (otherwise None).
+    '''
+    try:
+        source_stat = os.stat(source)
+        previous_stat = os.stat(previous)
+    except OSError:
+        return False, None
+    if source_stat.st_size != previous_stat.st_size or source_stat.st_mtime_ns != previous_stat.st_mtime_ns:
+        return False, None
+    if not verify_hash:
+        return True, None
+    if previous_hash == None:
+        previous_hash = hash_file(previous)
+    source_hash = hash_file(source)
+    return source_hash == previous_hash, source_hash
+
+
+def hash_file(path: str) -> str:
+    '''Get the BLAKE2b hash of a file's contents.'''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_hashes(snapshot: Union[str, None]) -> Dict[str, str]:
+    '''Load the content hashes recorded for a snapshot, or an empty dict if it has none.'''
+    if snapshot == None:
+        return {}
+    try:
+        with open(os.path.join(snapshot, HASHES_FILE), "r") as hashes_file:
+            return json.load(hashes_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hashes(snapshot: str, hashes: Dict[str, str]):
+    '''Record content hashes for a snapshot.'''
+    with open(os.path.join(snapshot, HASHES_FILE), "w") as hashes_file:
+        json.dump(hashes, hashes_file)
+
+
+def fingerprint_trees(trees: List[Tuple[str, str]]) -> str:
+    '''
+    Summarize every file in some trees as a hash of their paths, sizes, and modification times (the contents are not read).
+    If any file is added, removed, or written, the fingerprint changes.
+
+    Parameters
+    ----------
+    trees: `List[Tuple[str, str]]`
+        (directory, name) for each tree, such as ("/srv/mc/world", "world"). Missing directories are skipped.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    for directory, name in sorted(trees, key=lambda tree: tree[1]):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            relative_root = os.path.relpath(root, directory).replace(os.sep, "/")
+            for file in sorted(files):
+                if any(fnmatch.fnmatch(file, pattern) for pattern in FINGERPRINT_IGNORED):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, file))
+                except OSError:  # deleted while walking
+                    continue
+                digest.update(f"{name}/{relative_root}/{file}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
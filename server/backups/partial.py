@@ -0,0 +1,133 @@
+'''
+Choosing the files (and chunks) to copy back for a partial restore
+
+Paths are keys relative to the backup, such as "world/DIM-1/region/r.0.0.mca", with "/" separators.
+
+Methods
+-------
+dimension_roots(primary_world: `str`, worlds: `List[str]`, dimension: `str`) -> `List[str]`
+    Get the folders that may hold a dimension's region folders
+dimension_keys(roots: `List[str]`) -> `List[str]`
+    Get the region folders of a dimension
+parse_box(text: `str`) -> `Tuple[int, int, int, int]`
+    Parse a block coordinate box
+region_keys(roots: `List[str]`, box: `Tuple[int, int, int, int]`) -> `List[str]`
+    Get the region files that overlap a box
+chunk_indexes(region_key: `str`, box: `Tuple[int, int, int, int]`) -> `List[int]`
+    Get the chunks of a region file that overlap a box
+player_keys(primary_world: `str`, player: `str`) -> `List[str]`
+    Get a player's data files
+splice_chunks(live_path: `str`, backup_path: `str`, indexes: `List[int]`) -> `int`
+    Copy chunks from one region file into another
+'''
+
+from server.backups.region import CHUNKS_PER_REGION, chunk_index, read_region, write_region
+from typing import List, Tuple
+import uuid
+import os
+import re
+
+
+REGION_FOLDERS = ["region", "entities", "poi"]
+REGION_PATTERN = re.compile(r"r\.(-?\d+)\.(-?\d+)\.mca$")
+
+
+def dimension_roots(primary_world: str, worlds: List[str], dimension: str) -> List[str]:
+    '''
+    Get the folders that may hold a dimension's region folders, in the order they should be tried.
+
+    The dimension is "overworld", "nether", "end" (or "the_nether", "the_end"), or a namespaced id such as "mymod:mining".
+    The nether and end are looked for in every world, since Bukkit based servers keep them in their own world folders
+    (world_nether/DIM-1 rather than world/DIM-1). Raises ValueError for anything else.
+    '''
+    dimension = dimension.strip().lower()
+    if dimension.startswith("minecraft:"):
+        dimension = dimension[len("minecraft:"):]
+    other_worlds = [world for world in worlds if world != primary_world]
+    if dimension == "overworld":
+        return [primary_world]
+    if dimension in ("nether", "the_nether"):
+        return [f"{world}/DIM-1" for world in [primary_world] + other_worlds]
+    if dimension in ("end", "the_end"):
+        return [f"{world}/DIM1" for world in [primary_world] + other_worlds]
+    if re.fullmatch(r"[a-z0-9_.-]+:[a-z0-9_./-]+", dimension) and ".." not in dimension:
+        namespace, name = dimension.split(":", 1)
+        return [f"{primary_world}/dimensions/{namespace}/{name}"]
+    raise ValueError(f"Unknown dimension \"{dimension}\", use overworld, nether, end, or a namespaced id.")
+
+
+def dimension_keys(roots: List[str]) -> List[str]:
+    '''Get the region folders (terrain, entities, and points of interest) under each dimension root.'''
+    return [f"{root}/{folder}" for root in roots for folder in REGION_FOLDERS]
+
+
+def parse_box(text: str) -> Tuple[int, int, int, int]:
+    '''
+    Parse a block coordinate box given as "x1 z1 x2 z2" (commas are allowed too), returning (min x, min z, max x, max z).
+
+    Raises ValueError if it is not four integers.
+    '''
+    values = text.replace(",", " ").split()
+    try:
+        x1, z1, x2, z2 = (int(value) for value in values)
+    except ValueError:
+        raise ValueError("The box must be four block coordinates: x1 z1 x2 z2")
+    return min(x1, x2), min(z1, z2), max(x1, x2), max(z1, z2)
+
+
+def region_keys(roots: List[str], box: Tuple[int, int, int, int]) -> List[str]:
+    '''Get the region files (in every region folder of each root) that overlap a block coordinate box.'''
+    min_x, min_z, max_x, max_z = box
+    keys = []
+    for key in dimension_keys(roots):
+        for region_x in range(min_x >> 9, (max_x >> 9) + 1):
+            for region_z in range(min_z >> 9, (max_z >> 9) + 1):
+                keys.append(f"{key}/r.{region_x}.{region_z}.mca")
+    return keys
+
+
+def chunk_indexes(region_key: str, box: Tuple[int, int, int, int]) -> List[int]:
+    '''Get the indexes of the chunks in a region file (named r.x.z.mca) that overlap a block coordinate box.'''
+    match = REGION_PATTERN.search(region_key)
+    if match == None:
+        raise ValueError(f"Not a region file: {region_key}")
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    min_x, min_z, max_x, max_z = box
+    indexes = []
+    for chunk_x in range(max(min_x >> 4, region_x * 32), min(max_x >> 4, region_x * 32 + 31) + 1):
+        for chunk_z in range(max(min_z >> 4, region_z * 32), min(max_z >> 4, region_z * 32 + 31) + 1):
+            indexes.append(chunk_index(chunk_x, chunk_z))
+    return indexes
+
+
+def player_keys(primary_world: str, player: str) -> List[str]:
+    '''Get a player's data, statistics, and advancements files from their UUID. Raises ValueError if it is not a UUID.'''
+    try:
+        player_uuid = str(uuid.UUID(player.strip()))
+    except ValueError:
+        raise ValueError(f"\"{player}\" is not a player UUID.")
+    return [f"{primary_world}/playerdata/{player_uuid}.dat",
+            f"{primary_world}/stats/{player_uuid}.json",
+            f"{primary_world}/advancements/{player_uuid}.json"]
+
+
+def splice_chunks(live_path: str, backup_path: str, indexes: List[int]) -> int:
+    '''
+    Copy the chunks at indexes from the backup region file into the live one (created if missing), returning how many were copied.
+
+    Chunks the backup does not have are left as they are in the live region.
+    '''
+    backup_chunks, backup_timestamps = read_region(backup_path)
+    if os.path.exists(live_path):
+        chunks, timestamps = read_region(live_path)
+    else:
+        chunks, timestamps = [None] * CHUNKS_PER_REGION, [0] * CHUNKS_PER_REGION
+    copied = 0
+    for index in indexes:
+        if backup_chunks[index] != None:
+            chunks[index] = backup_chunks[index]
+            timestamps[index] = backup_timestamps[index]
+            copied += 1
+    if copied > 0:
+        write_region(live_path, chunks, timestamps)
+    return copied
@@ -0,0 +1,109 @@
+'''
+Reading and writing Anvil region (.mca) files
+
+A region file holds up to 1024 chunks (32x32) in 4 KiB sectors, after an 8 KiB header:
+a location table (3 byte sector offset and 1 byte sector count per chunk) and a table of 4 byte modification timestamps.
+Each stored chunk starts with a 4 byte length and a 1 byte compression type, followed by the compressed data.
+
+Methods
+-------
+read_header(region_file: `BinaryIO`) -> `Tuple[List[Tuple[int, int]], List[int]]`
+    Read the location and timestamp tables
+read_chunk(region_file: `BinaryIO`, offset: `int`, sector_count: `int`) -> `bytes`
+    Read one stored chunk
+read_region(path: `str`) -> `Tuple[List[Union[bytes, None]], List[int]]`
+    Read every stored chunk and its timestamp
+write_region(path: `str`, chunks: `List[Union[bytes, None]]`, timestamps: `List[int]`)
+    Write a complete region file
+chunk_index(chunk_x: `int`, chunk_z: `int`) -> `int`
+    Get the index of a chunk within its region file
+'''
+
+from typing import BinaryIO, List, Tuple, Union
+import struct
+import os
+
+
+SECTOR_SIZE = 4096
+CHUNKS_PER_REGION = 1024
+HEADER_SIZE = 2 * SECTOR_SIZE
+
+
+def read_header(region_file: BinaryIO) -> Tuple[List[Tuple[int, int]], List[int]]:
+    '''
+    Read the location and timestamp tables of an open region file.
+
+    Returns a list of (sector offset, sector count) and a list of timestamps, 1024 of each.
+    Empty (or truncated) files are treated as having no chunks.
+    '''
+    region_file.seek(0)
+    header = region_file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        return [(0, 0)] * CHUNKS_PER_REGION, [0] * CHUNKS_PER_REGION
+    locations = [(location >> 8, location & 0xFF) for location in struct.unpack(">1024I", header[:SECTOR_SIZE])]
+    timestamps = list(struct.unpack(">1024I", header[SECTOR_SIZE:]))
+    return locations, timestamps
+
+
+def read_chunk(region_file: BinaryIO, offset: int, sector_count: int) -> Union[bytes, None]:
+    '''
+    Read one stored chunk (length, compression type, and data) from an open region file.
+
+    Returns None if the chunk is not present. If the stored length is invalid, the raw sectors are returned as-is.
+    '''
+    if offset < 2 or sector_count == 0:
+        return None
+    region_file.seek(offset * SECTOR_SIZE)
+    data = region_file.read(sector_count * SECTOR_SIZE)
+    if len(data) < 5:
+        return None
+    length = struct.unpack(">I", data[:4])[0]
+    if length == 0 or length + 4 > len(data):
+        return data
+    return data[:length + 4]
+
+
+def read_region(path: str) -> Tuple[List[Union[bytes, None]], List[int]]:
+    '''Read every stored chunk (None where missing) and the timestamps of a region file.'''
+    with open(path, "rb") as region_file:
+        locations, timestamps = read_header(region_file)
+        chunks = [read_chunk(region_file, offset, sector_count) for offset, sector_count in locations]
+    return chunks, timestamps
+
+
+def write_region(path: str, chunks: List[Union[bytes, None]], timestamps: List[int]):
+    '''
+    Write a complete region file from stored chunks (None where missing) and their timestamps.
+
+    Chunks are laid out in order after the header, each padded to whole sectors.
+    The file is written beside the destination and renamed over it, so a failure never leaves a partial region.
+    '''
+    if len(chunks) != CHUNKS_PER_REGION or len(timestamps) != CHUNKS_PER_REGION:
+        raise ValueError("A region must have exactly 1024 chunk and timestamp entries.")
+    locations = []
+    next_sector = HEADER_SIZE // SECTOR_SIZE
+    for chunk in chunks:
+        if chunk == None:
+            locations.append(0)
+            continue
+        sector_count = -(-len(chunk) // SECTOR_SIZE)
+        if sector_count > 0xFF:
+            raise ValueError("Chunk is too large to store in a region file.")
+        locations.append((next_sector << 8) | sector_count)
+        next_sector += sector_count
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as region_file:
+        region_file.write(struct.pack(">1024I", *locations))
+        region_file.write(struct.pack(">1024I", *timestamps))
+        for chunk in chunks:
+            if chunk != None:
+                region_file.write(chunk)
+                padding = -len(chunk) % SECTOR_SIZE
+                if padding > 0:
+                    region_file.write(b"\x00" * padding)
+    os.replace(temporary_path, path)
+
+
+def chunk_index(chunk_x: int, chunk_z: int) -> int:
+    '''Get the index (0-1023) of a chunk within its region file's tables.'''
+    return (chunk_x & 31) + (chunk_z & 31) * 32
@@ -0,0 +1,113 @@
+'''
+Chunk-level delta backups of Anvil region files
+
+Instead of a copy of each region file, a snapshot holds a small manifest (r.x.z.mca.delta) listing every chunk's
+timestamp and the hash of its stored bytes. The bytes themselves are kept once in a shared ChunkPool.
+A chunk is only read and stored again if its timestamp changed since the previous snapshot (or always with verify).
+Restoring rebuilds the full region file from the manifest and the pool.
+
+Methods
+-------
+is_region_file(path: `str`) -> `bool`
+    Check whether a file should be backed up by chunk
+backup_region(source: `str`, manifest_path: `str`, previous_manifest_path: `str`, pool: `ChunkPool`, verify: `bool`) -> `Tuple[int, int]`
+    Write a region's manifest, storing the chunks that changed
+restore_region(manifest_path: `str`, destination: `str`, pool: `ChunkPool`)
+    Rebuild a region file from its manifest
+load_manifest(manifest_path: `str`) -> `Dict`
+    Read a region manifest
+referenced_chunks(snapshot_directory: `str`) -> `Set[str]`
+    Get the hashes of every chunk a snapshot's manifests use
+'''
+
+from server.backups.region import CHUNKS_PER_REGION, read_chunk, read_header, write_region
+from server.backups.chunk_pool import ChunkPool
+from server.backups.throttle import Throttle
+from typing import Dict, Set, Tuple, Union
+import json
+import os
+
+
+DELTA_SUFFIX = ".delta"
+MANIFEST_VERSION = 1
+
+
+def is_region_file(path: str) -> bool:
+    '''Check whether a file is an Anvil region file (region, entities, and poi folders all use .mca).'''
+    return path.endswith(".mca")
+
+
+def backup_region(source: str, manifest_path: str, previous_manifest_path: Union[str, None], pool: ChunkPool,
+                  verify: bool = False, throttle: Union[Throttle, None] = None) -> Tuple[int, int]:
+    '''
+    Write the manifest for the region file at source, storing its changed chunks in the pool.
+
+    Chunks whose timestamp matches the previous manifest are not read at all, unless verify is set.
+    The chunks that are read take their sectors' bytes from the throttle, if there is one.
+    Returns the number of chunks (reused from the previous manifest, read and stored).
+    '''
+    try:
+        previous = load_manifest(previous_manifest_path) if previous_manifest_path != None else None
+    except (OSError, ValueError):  # store everything again rather than trusting a damaged manifest
+        previous = None
+    chunk_hashes = []
+    reused = stored = 0
+    with open(source, "rb") as region_file:
+        locations, timestamps = read_header(region_file)
+        for index, (offset, sector_count) in enumerate(locations):
+            if offset == 0 or sector_count == 0:
+                chunk_hashes.append(None)
+                continue
+            if not verify and previous != None and previous["timestamps"][index] == timestamps[index] \
+                    and previous["chunks"][index] != None and previous["chunks"][index] in pool:
+                chunk_hashes.append(previous["chunks"][index])
+                reused += 1
+                continue
+            if throttle != None:
+                throttle.acquire(sector_count * 4096)
+            chunk = read_chunk(region_file, offset, sector_count)
+            if chunk == None:
+                chunk_hashes.append(None)
+                continue
+            chunk_hashes.append(pool.put(chunk))
+            stored += 1
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, "w") as manifest_file:
+        json.dump({"version": MANIFEST_VERSION, "timestamps": timestamps, "chunks": chunk_hashes}, manifest_file, separators=(",", ":"))
+    os.replace(temporary_path, manifest_path)
+    stat = os.stat(source)
+    os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return reused, stored
+
+
+def restore_region(manifest_path: str, destination: str, pool: ChunkPool):
+    '''Rebuild the region file described by a manifest at destination. Raises FileNotFoundError if a chunk is missing.'''
+    manifest = load_manifest(manifest_path)
+    chunks = [pool.get(chunk_hash) if chunk_hash != None else None for chunk_hash in manifest["chunks"]]
+    write_region(destination, chunks, manifest["timestamps"])
+    stat = os.stat(manifest_path)
+    os.utime(destination, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def load_manifest(manifest_path: str) -> Dict:
+    '''Read a region manifest, raises ValueError if it is not a valid manifest.'''
+    with open(manifest_path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != MANIFEST_VERSION or len(manifest.get("chunks", [])) != CHUNKS_PER_REGION \
+            or len(manifest.get("timestamps", [])) != CHUNKS_PER_REGION:
+        raise ValueError(f"Invalid region manifest: {manifest_path}")
+    return manifest
+
+
+def referenced_chunks(snapshot_directory: str) -> Set[str]:
+    '''Get the hashes of every chunk used by the region manifests in a snapshot.'''
+    referenced = set()
+    for root, _, files in os.walk(snapshot_directory):
+        for name in files:
+            if name.endswith(".mca" + DELTA_SUFFIX):
+                try:
+                    manifest = load_manifest(os.path.join(root, name))
+                except (OSError, ValueError):
+                    continue
+                referenced.update(chunk_hash for chunk_hash in manifest["chunks"] if chunk_hash != None)
+    return referenced
@@ -0,0 +1,274 @@
+'''
+Copying backups to S3-compatible object storage, so they survive losing the server's disk
+
+Remote keys mirror paths under the backup folder (under an optional prefix), so a bucket can be downloaded back into a
+backup folder as it is. A backup is only complete remotely once its marker (.snapshots/<name>.json) is uploaded, last.
+
+Classes
+-------
+Replicator
+    Uploads backups with parallel, resumable, checksummed multipart uploads
+
+Methods
+-------
+part_size_for(size: `int`, part_size: `int`) -> `int`
+    Get the part size used to upload a file
+file_etag(path: `str`, part_size: `int`) -> `str`
+    Get the ETag that uploading a file will give it
+'''
+
+from server.backups.throttle import Throttle
+from server.backups.s3 import S3Client, S3Error
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Set, Tuple, Union
+import threading
+import hashlib
+import json
+import os
+
+
+PART_SIZE = 8 * 1048576
+MAX_PARTS = 10000  # the most parts S3 allows in one upload
+MARKER_FOLDER = ".snapshots"
+
+
+def part_size_for(size: int, part_size: int) -> int:
+    '''Get the part size used to upload a file, raised from part_size if the file would otherwise need more than MAX_PARTS.'''
+    return max(part_size, -(-size // MAX_PARTS))
+
+
+def file_etag(path: str, part_size: int = PART_SIZE) -> str:
+    '''
+    Get the ETag that uploading a file with a Replicator will give it: its MD5 if it fits in one part, otherwise
+    the MD5 of its parts' MD5s followed by "-<number of parts>" (as S3 computes for multipart uploads).
+    '''
+    size = os.path.getsize(path)
+    part_size = part_size_for(size, part_size)
+    part_digests = []
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(part_size)
+            if len(data) == 0 and len(part_digests) > 0:
+                break
+            part_digests.append(hashlib.md5(data).digest())
+            if len(data) < part_size:
+                break
+    if size <= part_size:
+        return part_digests[0].hex()
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+class Replicator:
+    '''
+    Uploads backups to a bucket, on its own pool of threads.
+
+    Files that fit in one part are uploaded whole, larger ones as multipart uploads, with the files and parts of a backup
+    uploaded in parallel up to the number of workers. Every request's data is checked against its MD5 by the server,
+    and every finished object's ETag is checked against the local file.
+
+    Uploading a backup again resumes it: files already uploaded (with matching ETags) are skipped, and unfinished
+    multipart uploads continue from the parts already stored.
+
+    Parameters
+    ----------
+    client: `S3Client`
+        The client for the bucket
+    prefix: `str`
+        A folder in the bucket to keep backups in, default "" (the top of the bucket)
+    workers: `int`
+        The most requests to send at once, default 2
+    part_size: `int`
+        The size of multipart upload parts, default 8 MiB (at least 5 MiB, as S3 requires)
+    throttle: `Throttle`
+        Take the bytes uploaded (and a request per part) from this throttle, if given
+    '''
+
+    def __init__(self, client: S3Client, prefix: str = "", workers: int = 2, part_size: int = PART_SIZE,
+                 throttle: Union[Throttle, None] = None):
+        self.client = client
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") != "" else ""
+        self.workers = max(1, workers)
+        self.part_size = max(part_size, 5 * 1048576)
+        self._throttle = throttle
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Replicator")
+        self._shared_keys: Dict[str, Set[str]] = {}
+        self._markers: Dict[str, Tuple[str, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def key(self, path: str) -> str:
+        '''Get the key of a path relative to the backup folder.'''
+        return self.prefix + path.replace(os.sep, "/")
+
+    def replicate(self, name: str, files: List[Tuple[str, str]], shared_files: List[Tuple[str, str]], marker: Dict,
+                  progress: Union[Callable[[int, int], None], None] = None) -> Tuple[int, int, int]:
+        '''
+        Upload a backup, returning the number of files (uploaded, already uploaded) and the bytes uploaded.
+
+        This blocks until the backup is uploaded, so run it off the event loop. Raises S3Error or OSError if it fails.
+
+        Parameters
+        ----------
+        name: `str`
+            The backup's name, which its marker is named after
+        files: `List[Tuple[str, str]]`
+            (local file, path relative to the backup folder) for each of the backup's own files
+        shared_files: `List[Tuple[str, str]]`
+            The same for content-addressed files (chunks) the backup uses, which only need uploading if they are missing
+        marker: `Dict`
+            What to record about the backup in its marker (such as its catalog entry)
+        progress: `Callable[[int, int], None]`, optional
+            Called from the uploading thread with (bytes uploaded, bytes to upload) as files finish
+        '''
+        with self._lock:  # chunks may have been deleted remotely (by lifecycle rules or pruning) since the last backup
+            self._shared_keys = {}
+        remote = self._list_remote([self.key(relative) for _, relative in files])
+        uploads = []  # (local file, key, remote (size, etag) or None)
+        for path, relative in files:
+            key = self.key(relative)
+            uploads.append((path, key, remote.get(key)))
+        if len(shared_files) > 0:
+            known = self._shared_remote_keys([self.key(relative) for _, relative in shared_files])
+            uploads += [(path, self.key(relative), None) for path, relative in shared_files if self.key(relative) not in known]
+        uploaded = skipped = 0
+        total_bytes = sum(os.path.getsize(path) for path, _, _ in uploads)
+        bytes_done = [0]
+        multipart: List[Tuple[str, str, str, Dict[int, str], int]] = []  # (file, key, upload id, part etags, number of parts)
+        pending: Set[Future] = set()
+
+        def finished(byte_count: int):
+            with self._lock:
+                bytes_done[0] += byte_count
+            if progress != None:
+                progress(bytes_done[0], total_bytes)
+
+        def submit(function, *args):
+            while len(pending) >= self.workers * 2:  # bound how many parts are read into memory at once
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    future.result()
+            pending.add(self._executor.submit(function, *args))
+
+        try:
+            for path, key, existing in uploads:
+                size = os.path.getsize(path)
+                part_size = part_size_for(size, self.part_size)
+                if existing != None and existing[0] == size and existing[1] == file_etag(path, self.part_size):
+                    skipped += 1
+                    finished(size)
+                    continue
+                uploaded += 1
+                if size <= part_size:
+                    submit(self._upload_whole, path, key, finished)
+                    continue
+                upload_id, part_etags = self._resume_multipart(path, key, part_size)
+                part_count = -(-size // part_size)
+                multipart.append((path, key, upload_id, part_etags, part_count))
+                for number in range(1, part_count + 1):
+                    if number in part_etags:
+                        finished(min(part_size, size - (number - 1) * part_size))
+                    else:
+                        submit(self._upload_part, path, key, upload_id, number, part_size, part_etags, finished)
+            for future in wait(pending).done:
+                future.result()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        for path, key, upload_id, part_etags, part_count in multipart:
+            etag = self.client.complete_multipart_upload(key, upload_id, [(number, part_etags[number]) for number in range(1, part_count + 1)])
+            expected = file_etag(path, self.part_size)
+            if etag.lower() != expected:
+                raise S3Error(0, "ChecksumMismatch", f"{key} was stored with ETag {etag}, expected {expected}")
+        self.client.put_object(self.key(f"{MARKER_FOLDER}/{name}.json"), json.dumps(marker).encode(), "application/json")
+        return uploaded, skipped, bytes_done[0]
+
+    def remote_snapshots(self) -> Dict[str, Dict]:
+        '''Get the marker of every backup uploaded to the bucket, by name. Only markers that changed are downloaded.'''
+        marker_prefix = self.key(f"{MARKER_FOLDER}/")
+        snapshots = {}
+        for key, (_, etag) in self.client.list_objects(marker_prefix).items():
+            if not key.endswith(".json"):
+                continue
+            cached = self._markers.get(key)
+            if cached == None or cached[0] != etag:
+                try:
+                    cached = (etag, json.loads(self.client.get_object(key)))
+                except (S3Error, ValueError):  # deleted since listing, or not a marker
+                    continue
+                self._markers[key] = cached
+            snapshots[key[len(marker_prefix):-len(".json")]] = cached[1]
+        return snapshots
+
+    def _list_remote(self, keys: List[str]) -> Dict[str, Tuple[int, str]]:
+        '''List the objects sharing the keys' common prefix (such as a backup's folder).'''
+        if len(keys) == 0:
+            return {}
+        return self.client.list_objects(os.path.commonprefix(keys))
+
+    def _shared_remote_keys(self, keys: List[str]) -> Set[str]:
+        '''
+        Get which shared keys exist remotely. Their folder is listed fresh on each replicate(), since chunks may be deleted
+        remotely between backups, and keys uploaded during the replication are added to the listing.
+        '''
+        prefix = os.path.commonprefix(keys)
+        prefix = prefix[:prefix.rfind("/") + 1]  # the whole folder (such as .chunks/), rather than a listing per chunk
+        if prefix not in self._shared_keys:
+            self._shared_keys[prefix] = set(self.client.list_objects(prefix))
+        return self._shared_keys[prefix]
+
+    def _upload_whole(self, path: str, key: str, finished: Callable[[int], None]):
+        with open(path, "rb") as file:
+            data = file.read()
+        if self._throttle != None:
+            self._throttle.acquire(len(data), 1)
+        self.client.put_object(key, data)
+        self._remember_shared(key)
+        finished(len(data))
+
+    def _upload_part(self, path: str, key: str, upload_id: str, number: int, part_size: int, part_etags: Dict[int, str],
+                     finished: Callable[[int], None]):
+        with open(path, "rb") as file:
+            file.seek((number - 1) * part_size)
+            data = file.read(part_size)
+        if self._throttle != None:
+            self._throttle.acquire(len(data), 1)
+        etag = self.client.upload_part(key, upload_id, number, data)
+        with self._lock:
+            part_etags[number] = etag
+        finished(len(data))
+
+    def _resume_multipart(self, path: str, key: str, part_size: int) -> Tuple[str, Dict[int, str]]:
+        '''
+        Find an unfinished upload of key to continue, returning its id and the parts already uploaded whose MD5 matches
+        the file, or start a new upload. Other unfinished uploads of the key are aborted.
+        '''
+        uploads = [upload_id for upload_key, upload_id in self.client.list_multipart_uploads(key) if upload_key == key]
+        for stale_upload in uploads[:-1]:
+            self.client.abort_multipart_upload(key, stale_upload)
+        if len(uploads) == 0:
+            return self.client.create_multipart_upload(key), {}
+        upload_id = uploads[-1]
+        try:
+            remote_parts = self.client.list_parts(key, upload_id)
+        except S3Error as e:
+            if e.code != "NoSuchUpload":
+                raise
+            return self.client.create_multipart_upload(key), {}
+        part_etags = {}
+        with open(path, "rb") as file:
+            for number, (size, etag) in remote_parts.items():
+                file.seek((number - 1) * part_size)
+                data = file.read(part_size)
+                if len(data) == size and hashlib.md5(data).hexdigest() == etag.lower():
+                    part_etags[number] = etag
+        return upload_id, part_etags
+
+    def _remember_shared(self, key: str):
+        with self._lock:
+            for prefix, keys in self._shared_keys.items():
+                if key.startswith(prefix):
+                    keys.add(key)
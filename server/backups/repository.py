@@ -0,0 +1,262 @@
+'''
+A content-addressed backup repository
+
+Files are split into content-defined chunks, and each chunk is stored once in a ChunkPool no matter how many files or
+snapshots contain it. A snapshot is only a small JSON manifest listing each file's chunks, so keeping many snapshots
+costs little more than keeping one, and deleting a snapshot only deletes its manifest (chunks no manifest uses any more
+are removed by collect_garbage()).
+
+Chunk boundaries are chosen by content, but only at 4 KiB aligned offsets. Hashing every aligned block (with zlib's crc32)
+keeps chunking fast in Python, and suits worlds well: region files are laid out in 4 KiB sectors, so chunks that move
+within a region file still line up, and most other files are small enough to be a single chunk.
+
+Classes
+-------
+BackupRepository
+    A directory of snapshot manifests and the chunks they reference
+RepositorySnapshot
+    Writes a new snapshot into a repository
+
+Methods
+-------
+split_chunks(file: `BinaryIO`) -> `Iterator[bytes]`
+    Split a file into content-defined chunks
+'''
+
+from server.backups.chunk_pool import ChunkPool
+from server.backups.throttle import Throttle, ThrottledReader
+from typing import BinaryIO, Dict, Iterator, List, Tuple, Union
+import threading
+import tempfile
+import json
+import zlib
+import time
+import os
+
+
+MANIFEST_VERSION = 1
+BLOCK_SIZE = 4096
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+BOUNDARY_MASK = 0xF  # a boundary after 1 in 16 blocks, so chunks average around 80 KiB
+
+
+def split_chunks(file: BinaryIO) -> Iterator[bytes]:
+    '''
+    Split a file into content-defined chunks, ending a chunk after any 4 KiB aligned block whose crc32 matches the boundary
+    mask (once the chunk is at least MIN_CHUNK_SIZE), or once it reaches MAX_CHUNK_SIZE.
+    '''
+    chunk = bytearray()
+    while True:
+        data = file.read(MAX_CHUNK_SIZE)
+        if len(data) == 0:
+            break
+        view = memoryview(data)
+        for start in range(0, len(data), BLOCK_SIZE):
+            block = view[start:start + BLOCK_SIZE]
+            chunk += block
+            if len(chunk) >= MAX_CHUNK_SIZE or (len(chunk) >= MIN_CHUNK_SIZE and zlib.crc32(block) & BOUNDARY_MASK == 0):
+                yield bytes(chunk)
+                chunk = bytearray()
+    if len(chunk) > 0:
+        yield bytes(chunk)
+
+
+class BackupRepository:
+    '''
+    A directory of snapshot manifests (snapshots/<name>.json) and the chunks they reference (chunks/).
+
+    Parameters
+    ----------
+    directory: `str`
+        The repository directory, created when the first snapshot is written
+
+    Attributes
+    ----------
+    pool: `ChunkPool`
+        The chunks of every snapshot
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self.pool = ChunkPool(os.path.join(self.directory, "chunks"))
+        self._snapshot_directory = os.path.join(self.directory, "snapshots")
+
+    def __contains__(self, name: str) -> bool:
+        return os.path.isfile(self.manifest_path(name))
+
+    def manifest_path(self, name: str) -> str:
+        return os.path.join(self._snapshot_directory, f"{name}.json")
+
+    def snapshots(self) -> List[str]:
+        '''Get the names of every snapshot.'''
+        if not os.path.isdir(self._snapshot_directory):
+            return []
+        return [name[:-len(".json")] for name in os.listdir(self._snapshot_directory) if name.endswith(".json") and not name.startswith(".")]
+
+    def latest(self) -> Union[str, None]:
+        '''Get the name of the most recently created snapshot, or None if there are none.'''
+        snapshots = self.snapshots()
+        if len(snapshots) == 0:
+            return None
+        return max(snapshots, key=lambda name: os.path.getmtime(self.manifest_path(name)))
+
+    def load_manifest(self, name: str) -> Dict:
+        '''Read a snapshot's manifest, raises FileNotFoundError if there is no such snapshot.'''
+        with open(self.manifest_path(name), "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported repository manifest: {self.manifest_path(name)}")
+        return manifest
+
+    def begin_snapshot(self, name: str, throttle: Union[Throttle, None] = None) -> "RepositorySnapshot":
+        '''
+        Start writing a snapshot, which only appears in the repository once it is committed.
+        Changed files take the bytes read from them from the throttle, if given.
+        '''
+        if name in self:
+            raise FileExistsError(f"Snapshot {name} already exists.")
+        previous = self.latest()
+        return RepositorySnapshot(self, name, self.load_manifest(previous) if previous != None else None, throttle)
+
+    def delete_snapshot(self, name: str):
+        '''Delete a snapshot's manifest. Its chunks stay until collect_garbage() finds nothing else uses them.'''
+        os.remove(self.manifest_path(name))
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        '''Delete every chunk that no snapshot references, returning the number of chunks and bytes removed.'''
+        referenced = set()
+        for name in self.snapshots():
+            for entry in self.load_manifest(name)["files"].values():
+                referenced.update(entry["chunks"])
+        return self.pool.collect_garbage(referenced)
+
+    def restore(self, name: str, prefix: str, destination: str):
+        '''
+        Rebuild the files under prefix (such as "world", or a single file such as "world/level.dat") of a snapshot into destination.
+
+        This blocks until the files are written, so run it off the event loop.
+        '''
+        self.restore_many(name, [(prefix, destination)])
+
+    def restore_many(self, name: str, targets: List[Tuple[str, str]]):
+        '''Rebuild several (prefix, destination) pairs of a snapshot, see restore(). The manifest is only read once.'''
+        manifest = self.load_manifest(name)
+        for prefix, destination in targets:
+            prefix = prefix.strip("/")
+            destination = os.path.abspath(destination)
+            for key, entry in sorted(manifest["files"].items()):
+                target = self._target(key, prefix, destination)
+                if target == None:
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as target_file:
+                    for chunk_hash in entry["chunks"]:
+                        target_file.write(self.pool.get(chunk_hash))
+                os.chmod(target, entry["mode"] & 0o7777)
+                os.utime(target, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            # deepest first, after their contents, which change their times
+            for key, entry in sorted(manifest["directories"].items(), reverse=True):
+                target = self._target(key, prefix, destination)
+                if target != None:
+                    os.makedirs(target, exist_ok=True)
+                    os.utime(target, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def _target(self, key: str, prefix: str, destination: str) -> Union[str, None]:
+        '''Get where key is restored to, or None if it is not under prefix.'''
+        if key != prefix and not key.startswith(prefix + "/"):
+            return None
+        target = os.path.normpath(os.path.join(destination, os.path.relpath(key, prefix)))
+        if target != destination and not target.startswith(destination + os.sep):
+            raise ValueError(f"Snapshot entry {key} is outside of the destination.")
+        return target
+
+    def trees(self, name: str) -> List[str]:
+        '''Get the top level folders (such as the worlds) in a snapshot.'''
+        manifest = self.load_manifest(name)
+        return sorted({key.split("/", 1)[0] for key in list(manifest["files"]) + list(manifest["directories"])})
+
+
+class RepositorySnapshot:
+    '''
+    Writes a new snapshot into a repository.
+
+    add_file() stores one file, and is meant to be run by a CopyEngine across its workers (with no destination).
+    Files whose size and modification time match the previous snapshot reuse its chunk list without being read.
+    Nothing is visible in the repository until commit() writes the manifest.
+
+    The counters are safe to update from several workers storing files at once.
+
+    Attributes
+    ----------
+    name: `str`
+        The snapshot being written
+    files_unchanged: `int`
+        Files reused from the previous snapshot without being read
+    chunks_stored: `int`
+        New chunks written to the pool
+    chunks_reused: `int`
+        Chunks of read files that the pool already held
+    '''
+
+    def __init__(self, repository: BackupRepository, name: str, previous_manifest: Union[Dict, None] = None,
+                 throttle: Union[Throttle, None] = None):
+        self.name = name
+        self._repository = repository
+        self._throttle = throttle
+        self._previous_files: Dict[str, Dict] = previous_manifest["files"] if previous_manifest != None else {}
+        self._files: Dict[str, Dict] = {}
+        self._directories: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.files_unchanged = 0
+        self.chunks_stored = 0
+        self.chunks_reused = 0
+
+    def add_file(self, source: str, destination: Union[str, None], previous: Union[str, None], key: str):
+        '''Store a file under key (such as "world/level.dat"). The destination and previous file are unused.'''
+        stat = os.stat(source)
+        previous_entry = self._previous_files.get(key)
+        if previous_entry != None and previous_entry["size"] == stat.st_size and previous_entry["mtime_ns"] == stat.st_mtime_ns:
+            chunks = previous_entry["chunks"]
+            with self._lock:
+                self.files_unchanged += 1
+        else:
+            chunks = []
+            stored = reused = 0
+            with open(source, "rb") as source_file:
+                reader = ThrottledReader(source_file, self._throttle) if self._throttle != None else source_file
+                for chunk in split_chunks(reader):  # type: ignore
+                    chunk_hash = self._repository.pool.hash(chunk)
+                    if chunk_hash in self._repository.pool:
+                        reused += 1
+                    else:
+                        self._repository.pool.put(chunk)
+                        stored += 1
+                    chunks.append(chunk_hash)
+            with self._lock:
+                self.chunks_stored += stored
+                self.chunks_reused += reused
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": stat.st_mode, "chunks": chunks}
+        with self._lock:
+            self._files[key] = entry
+
+    def add_directories(self, source: str, key_prefix: str):
+        '''Record the folders of a tree (so empty ones are restored too), under key_prefix (such as "world").'''
+        for root, _, _ in os.walk(source):
+            key = os.path.normpath(os.path.join(key_prefix, os.path.relpath(root, source))).replace(os.sep, "/")
+            with self._lock:
+                self._directories[key] = {"mtime_ns": os.stat(root).st_mtime_ns}
+
+    def commit(self):
+        '''Write the manifest, making the snapshot part of the repository.'''
+        manifest = {"version": MANIFEST_VERSION, "created": time.time(), "files": self._files, "directories": self._directories}
+        directory = os.path.dirname(self._repository.manifest_path(self.name))
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "w") as manifest_file:
+                json.dump(manifest, manifest_file, separators=(",", ":"))
+            os.replace(temporary_path, self._repository.manifest_path(self.name))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
@@ -0,0 +1,279 @@
+'''
+A small client for S3-compatible object storage (AWS S3, MinIO, Garage, Ceph, Backblaze B2, Cloudflare R2, and others)
+
+Only the requests that replication needs are implemented, signed with AWS Signature Version 4 using the standard library.
+Every request sends the SHA-256 of its body (which the server checks against the signature), and uploads also send
+Content-MD5, so data damaged on the way is rejected rather than stored.
+
+Classes
+-------
+S3Error
+    An error response from the server
+S3Client
+    Sends signed requests to one bucket
+
+Methods
+-------
+signature_v4(...) -> `str`
+    Get the Authorization header for a request
+'''
+
+from typing import Dict, List, Tuple, Union
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import http.client
+import threading
+import datetime
+import hashlib
+import base64
+import hmac
+import time
+
+
+class S3Error(Exception):
+    '''
+    An error response from the server (or a response that failed verification)
+
+    Attributes
+    ----------
+    status: `int`
+        The HTTP status, or 0 if the request never got a response
+    code: `str`
+        The S3 error code, such as "NoSuchUpload"
+    '''
+
+    def __init__(self, status: int, code: str, message: str = ""):
+        super().__init__(f"{status} {code}: {message}" if message != "" else f"{status} {code}")
+        self.status = status
+        self.code = code
+
+
+class S3Client:
+    '''
+    Sends signed requests to one bucket of an S3-compatible server.
+
+    Each thread keeps its own connection, so the client can be shared by several uploading threads.
+    Requests that fail with a server error or a dropped connection are retried a few times.
+
+    Parameters
+    ----------
+    endpoint: `str`
+        The server's URL, such as "https://s3.us-east-1.amazonaws.com" or "http://localhost:9000"
+    bucket: `str`
+        The bucket to use
+    access_key: `str`
+        The access key id
+    secret_key: `str`
+        The secret access key
+    region: `str`
+        The region to sign requests for, default "us-east-1" (which most other servers accept)
+    path_style: `bool`
+        Address the bucket as endpoint/bucket rather than bucket.endpoint, default True (as most other servers expect)
+    timeout: `float`
+        Seconds to wait on the connection before giving up, default 60
+    '''
+
+    RETRIES = 3
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str, region: str = "us-east-1",
+                 path_style: bool = True, timeout: float = 60):
+        url = urlsplit(endpoint)
+        if url.scheme not in ("http", "https") or url.hostname == None:
+            raise ValueError(f"S3 endpoint must be an http:// or https:// URL, not \"{endpoint}\"")
+        self.bucket = bucket
+        self.region = region
+        self._secure = url.scheme == "https"
+        self._port = url.port
+        self._host = url.hostname if path_style else f"{bucket}.{url.hostname}"
+        self._host_header = self._host if url.port == None else f"{self._host}:{url.port}"
+        self._path_prefix = f"{url.path.rstrip('/')}/{bucket}" if path_style else url.path.rstrip("/")
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, key: str = "", query: Union[Dict[str, str], None] = None,
+                headers: Union[Dict[str, str], None] = None, body: bytes = b"") -> Tuple[int, Dict[str, str], bytes]:
+        '''
+        Send a signed request for an object key (or the bucket, if key is ""), returning (status, headers, body).
+        Raises S3Error for error responses.
+        '''
+        query = query if query != None else {}
+        path = quote(f"{self._path_prefix}/{key}" if key != "" or self._path_prefix == "" else self._path_prefix, safe="/~")
+        query_string = "&".join(f"{quote(name, safe='~')}={quote(value, safe='~')}" for name, value in sorted(query.items()))
+        delay = 0.5
+        for attempt in range(self.RETRIES + 1):
+            signed_headers = self._sign(method, path, query_string, dict(headers) if headers != None else {}, body)
+            try:
+                connection = self._connection()
+                connection.request(method, path + ("?" + query_string if query_string != "" else ""), body=body, headers=signed_headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self._local.connection = None  # reconnect on the next attempt
+                if attempt == self.RETRIES:
+                    raise S3Error(0, "ConnectionError", str(e))
+            else:
+                response_headers = {name.lower(): value for name, value in response.getheaders()}
+                if response.status < 300:
+                    return response.status, response_headers, response_body
+                if response.status < 500 or attempt == self.RETRIES:
+                    raise self._error(response.status, response_body)
+            time.sleep(delay)
+            delay *= 2
+        raise S3Error(0, "ConnectionError")  # unreachable
+
+    def head_object(self, key: str) -> Union[Dict[str, str], None]:
+        '''Get an object's headers (such as content-length and etag), or None if it does not exist.'''
+        try:
+            return self.request("HEAD", key)[1]
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_object(self, key: str) -> bytes:
+        return self.request("GET", key)[2]
+
+    def put_object(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+        '''Upload an object in one request, returning its ETag (checked against the data's MD5).'''
+        md5 = hashlib.md5(data)
+        _, headers, _ = self.request("PUT", key, headers={"Content-MD5": base64.b64encode(md5.digest()).decode(),
+                                                          "Content-Type": content_type}, body=data)
+        return self._check_etag(headers, md5.hexdigest(), key)
+
+    def delete_object(self, key: str):
+        self.request("DELETE", key)
+
+    def list_objects(self, prefix: str) -> Dict[str, Tuple[int, str]]:
+        '''Get every object under a prefix, as key: (size, ETag).'''
+        objects = {}
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            root = self._parse(self.request("GET", "", query)[2])
+            for content in _children(root, "Contents"):
+                objects[_text(content, "Key")] = (int(_text(content, "Size")), _text(content, "ETag").strip('"'))
+            if _text(root, "IsTruncated") != "true":
+                return objects
+            query["continuation-token"] = _text(root, "NextContinuationToken")
+
+    def create_multipart_upload(self, key: str, content_type: str = "application/octet-stream") -> str:
+        '''Start a multipart upload, returning its upload id.'''
+        root = self._parse(self.request("POST", key, {"uploads": ""}, {"Content-Type": content_type})[2])
+        return _text(root, "UploadId")
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        '''Upload one part (numbered from 1) of a multipart upload, returning its ETag (checked against the data's MD5).'''
+        md5 = hashlib.md5(data)
+        _, headers, _ = self.request("PUT", key, {"partNumber": str(part_number), "uploadId": upload_id},
+                                     {"Content-MD5": base64.b64encode(md5.digest()).decode()}, data)
+        return self._check_etag(headers, md5.hexdigest(), key)
+
+    def list_parts(self, key: str, upload_id: str) -> Dict[int, Tuple[int, str]]:
+        '''Get the parts uploaded so far, as part number: (size, ETag).'''
+        parts = {}
+        query = {"uploadId": upload_id}
+        while True:
+            root = self._parse(self.request("GET", key, query)[2])
+            for part in _children(root, "Part"):
+                parts[int(_text(part, "PartNumber"))] = (int(_text(part, "Size")), _text(part, "ETag").strip('"'))
+            if _text(root, "IsTruncated") != "true":
+                return parts
+            query["part-number-marker"] = _text(root, "NextPartNumberMarker")
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> str:
+        '''Join the (part number, ETag) parts into the object, returning its ETag.'''
+        body = "<CompleteMultipartUpload>" + "".join(f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etag}\"</ETag></Part>"
+                                                     for number, etag in sorted(parts)) + "</CompleteMultipartUpload>"
+        root = self._parse(self.request("POST", key, {"uploadId": upload_id}, {"Content-Type": "application/xml"}, body.encode())[2])
+        if _local_name(root.tag) == "Error":  # can fail after the 200 status has been sent
+            raise S3Error(200, _text(root, "Code"), _text(root, "Message"))
+        return _text(root, "ETag").strip('"')
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        self.request("DELETE", key, {"uploadId": upload_id})
+
+    def list_multipart_uploads(self, prefix: str) -> List[Tuple[str, str]]:
+        '''Get the unfinished multipart uploads under a prefix, as (key, upload id), oldest first.'''
+        uploads = []
+        query = {"uploads": "", "prefix": prefix}
+        while True:
+            root = self._parse(self.request("GET", "", query)[2])
+            for upload in _children(root, "Upload"):
+                uploads.append((_text(upload, "Initiated"), _text(upload, "Key"), _text(upload, "UploadId")))
+            if _text(root, "IsTruncated") != "true":
+                return [(key, upload_id) for _, key, upload_id in sorted(uploads)]
+            query["key-marker"] = _text(root, "NextKeyMarker")
+            query["upload-id-marker"] = _text(root, "NextUploadIdMarker")
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection == None:
+            connection_type = http.client.HTTPSConnection if self._secure else http.client.HTTPConnection
+            connection = connection_type(self._host, self._port, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+    def _sign(self, method: str, path: str, query_string: str, headers: Dict[str, str], body: bytes) -> Dict[str, str]:
+        '''Add the Signature Version 4 headers to a request's headers.'''
+        now = datetime.datetime.now(datetime.timezone.utc)
+        headers["Host"] = self._host_header
+        headers["x-amz-date"] = now.strftime("%Y%m%dT%H%M%SZ")
+        headers["x-amz-content-sha256"] = hashlib.sha256(body).hexdigest()
+        headers["Content-Length"] = str(len(body))
+        headers["Authorization"] = signature_v4(method, path, query_string, headers, headers["x-amz-content-sha256"],
+                                                self._access_key, self._secret_key, self.region, now)
+        return headers
+
+    def _check_etag(self, headers: Dict[str, str], md5: str, key: str) -> str:
+        etag = headers.get("etag", "").strip('"')
+        if etag.lower() != md5:
+            raise S3Error(0, "ChecksumMismatch", f"{key} was stored with ETag {etag}, expected {md5}")
+        return etag
+
+    def _parse(self, body: bytes) -> ElementTree.Element:
+        try:
+            return ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            raise S3Error(0, "InvalidResponse", body[:200].decode("utf-8", "replace"))
+
+    def _error(self, status: int, body: bytes) -> S3Error:
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError:  # e.g. HEAD responses have no body
+            return S3Error(status, http.client.responses.get(status, "Error"))
+        return S3Error(status, _text(root, "Code"), _text(root, "Message"))
+
+
+def signature_v4(method: str, path: str, query_string: str, headers: Dict[str, str], payload_hash: str,
+                 access_key: str, secret_key: str, region: str, now: datetime.datetime, service: str = "s3") -> str:
+    '''Get the Authorization header for a request, signing every header given (path and query must already be URI encoded).'''
+    date = now.strftime("%Y%m%d")
+    canonical_headers = {name.lower(): " ".join(str(value).split()) for name, value in headers.items() if name.lower() != "authorization"}
+    signed_headers = ";".join(sorted(canonical_headers))
+    canonical_request = "\n".join([method, path, query_string,
+                                   "".join(f"{name}:{canonical_headers[name]}\n" for name in sorted(canonical_headers)),
+                                   signed_headers, payload_hash])
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", now.strftime("%Y%m%dT%H%M%SZ"), scope,
+                                hashlib.sha256(canonical_request.encode()).hexdigest()])
+    key = f"AWS4{secret_key}".encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]  # without the XML namespace
+
+
+def _children(element: ElementTree.Element, name: str) -> List[ElementTree.Element]:
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _text(element: ElementTree.Element, name: str) -> str:
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text or ""
+    return ""
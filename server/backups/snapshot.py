@@ -0,0 +1,122 @@
+from server.backups.region_delta import DELTA_SUFFIX, backup_region, is_region_file, restore_region
+from server.backups.incremental import file_unchanged, hash_file
+from server.backups.chunk_pool import ChunkPool
+from server.backups.copier import copy_file_fast
+from server.backups.throttle import Throttle
+from typing import Dict, Union
+import threading
+import os
+
+
+class SnapshotCopier:
+    '''
+    Copies world files into snapshot directories, and snapshot files back into worlds.
+
+    copy_file() and restore_file() handle one file each, and are meant to be run by a CopyEngine across its workers.
+
+    Every snapshot is a complete directory, though depending on the options its files may be shared with other snapshots:
+    unchanged files can be hard linked to the previous snapshot (like rsync --link-dest),
+    and region files can be stored as chunk manifests (r.x.z.mca.delta) backed by a shared ChunkPool.
+
+    The counters are safe to update from several workers copying files at once.
+
+    Parameters
+    ----------
+    link_unchanged: `bool`
+        Hard link files that are unchanged from the previous snapshot, default False
+    verify_hash: `bool`
+        Require content hashes to match too when checking for unchanged files and chunks, default False
+    previous_hashes: `Dict[str, str]`
+        Content hashes of the previous snapshot's files (keyed by world/relative path), if known
+    region_pool: `ChunkPool`
+        Store region files as chunk manifests in this pool, or None to copy them like other files
+    reflink: `bool`
+        Clone copied files with copy-on-write reflinks where the filesystem supports it, default False
+    throttle: `Throttle`
+        Take the bytes copied into snapshots (but not linked, or restored) from this throttle, if given
+
+    Attributes
+    ----------
+    linked: `int`
+        Files hard linked to the previous snapshot
+    copied: `int`
+        Files copied (or restored), including cloned ones
+    cloned: `int`
+        Files copied as reflink clones
+    regions: `int`
+        Region files stored as chunk manifests
+    chunks_reused: `int`
+        Region chunks unchanged from the previous snapshot
+    chunks_stored: `int`
+        Region chunks read and stored
+    new_hashes: `Dict[str, str]`
+        Content hashes of the new snapshot's files, when verifying
+    '''
+
+    def __init__(self, link_unchanged: bool = False, verify_hash: bool = False,
+                 previous_hashes: Union[Dict[str, str], None] = None, region_pool: Union[ChunkPool, None] = None,
+                 reflink: bool = False, throttle: Union[Throttle, None] = None):
+        self._link_unchanged = link_unchanged
+        self._verify_hash = verify_hash
+        self._previous_hashes = previous_hashes if previous_hashes != None else {}
+        self._region_pool = region_pool
+        self._reflink = reflink
+        self._throttle = throttle
+        self._lock = threading.Lock()
+        self.linked = 0
+        self.copied = 0
+        self.cloned = 0
+        self.regions = 0
+        self.chunks_reused = 0
+        self.chunks_stored = 0
+        self.new_hashes: Dict[str, str] = {}
+
+    def copy_file(self, source_file: str, destination_file: str, previous_file: Union[str, None], key: str):
+        '''Copy a single file into a snapshot, as a link, a region manifest, or a plain copy.'''
+        if self._region_pool != None and is_region_file(source_file):
+            previous_manifest = previous_file + DELTA_SUFFIX if previous_file != None else None
+            if previous_manifest != None and not os.path.exists(previous_manifest):
+                previous_manifest = None
+            reused, stored = backup_region(source_file, destination_file + DELTA_SUFFIX, previous_manifest,
+                                           self._region_pool, self._verify_hash, self._throttle)
+            with self._lock:
+                self.regions += 1
+                self.chunks_reused += reused
+                self.chunks_stored += stored
+            return
+        linked = cloned = False
+        file_hash = None
+        if self._link_unchanged and previous_file != None:
+            unchanged, file_hash = file_unchanged(source_file, previous_file, self._verify_hash, self._previous_hashes.get(key))
+            if unchanged:
+                try:
+                    os.link(previous_file, destination_file)
+                except OSError:  # e.g. too many links or a filesystem without hard links, fall back to copying
+                    pass
+                else:
+                    linked = True
+        if not linked:
+            cloned = copy_file_fast(source_file, destination_file, self._reflink, self._throttle)
+        if self._verify_hash:
+            file_hash = file_hash if file_hash != None else hash_file(destination_file)
+        with self._lock:
+            if linked:
+                self.linked += 1
+            else:
+                self.copied += 1
+                self.cloned += 1 if cloned else 0
+            if file_hash != None:
+                self.new_hashes[key] = file_hash
+
+    def restore_file(self, source_file: str, destination_file: str, previous_file: Union[str, None] = None, key: str = ""):
+        '''Copy a single file out of a snapshot, rebuilding region files from chunk manifests (the extra arguments are unused).'''
+        if source_file.endswith(".mca" + DELTA_SUFFIX):
+            if self._region_pool == None:
+                raise FileNotFoundError("Snapshot contains region manifests, but no chunk pool was given.")
+            restore_region(source_file, destination_file[:-len(DELTA_SUFFIX)], self._region_pool)
+            cloned = False
+        else:
+            cloned = copy_file_fast(source_file, destination_file, self._reflink)
+        with self._lock:
+            self.copied += 1
+            self.cloned += 1 if cloned else 0
@@ -0,0 +1,203 @@
+'''
+Limiting how hard backups use the disk, so the server's own chunk saves and loads are not starved
+
+Classes
+-------
+Throttle
+    Token buckets for bytes and operations per second, shared by every backup worker
+ThrottledReader
+    A file wrapper that takes bytes from a throttle as they are read
+
+Methods
+-------
+lower_thread_priority()
+    Give the calling thread the lowest CPU scheduling priority
+set_idle_io_priority() -> `bool`
+    Put the calling thread in the idle I/O scheduling class
+parse_mspt(message: `str`) -> `Union[float, None]`
+    Read the milliseconds per tick from a console message
+is_overload_warning(message: `str`) -> `bool`
+    Check for the server's "Can't keep up!" warning
+'''
+
+from typing import BinaryIO, Union
+import threading
+import platform
+import ctypes
+import time
+import sys
+import os
+import re
+
+
+IOPRIO_WHO_PROCESS = 1  # with a thread id, sets only that thread
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+# ioprio_set has no wrapper in the C library, and its syscall number depends on the architecture
+SYS_IOPRIO_SET = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30,
+                  "armv7l": 314, "armv6l": 314, "ppc64le": 273, "ppc64": 273, "s390x": 282, "riscv64": 30}
+MSPT_PATTERNS = [re.compile(r"Average time per tick: ([\d.]+) ?ms"),  # vanilla /tick query
+                 re.compile(r"Mean tick time: ([\d.]+) ?ms"),  # Forge /forge tps
+                 re.compile(r"^◴ ([\d.]+)/")]  # Paper /mspt (average over the last 5 seconds)
+
+
+class Throttle:
+    '''
+    Limits the bytes and operations (such as files opened) per second of every thread sharing it, as two token buckets.
+
+    acquire() takes what a thread is about to use, sleeping if it has run ahead of the limits.
+    Each bucket holds up to a second's worth of tokens, so short bursts are allowed after idle time.
+
+    The limits are divided by the slowdown, which slow_down() and speed_up() adjust as the server struggles or recovers.
+    If there is no byte limit, slowing down limits the bytes to the rate measured before the first slow down.
+
+    Parameters
+    ----------
+    bytes_per_second: `float`
+        The byte limit, or 0 for no limit
+    operations_per_second: `float`
+        The operation limit, or 0 for no limit
+
+    Attributes
+    ----------
+    slowdown: `float`
+        What the limits are divided by, from 1 (full speed) up to MAX_SLOWDOWN
+    waited: `float`
+        The total seconds that threads have slept in acquire()
+    '''
+
+    MAX_SLOWDOWN = 64
+    MIN_BYTES_PER_SECOND = 1048576  # the slowest an unlimited throttle is slowed to
+
+    def __init__(self, bytes_per_second: float = 0, operations_per_second: float = 0):
+        self.bytes_per_second = bytes_per_second
+        self.operations_per_second = operations_per_second
+        self.slowdown = 1.0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._last_refill = time.monotonic()
+        self._bytes_available = bytes_per_second
+        self._operations_available = operations_per_second
+        self._measure_start = self._last_refill
+        self._measured_bytes = 0
+        self._measured_rate = 0.0
+        self._unlimited_base: Union[float, None] = None
+
+    def is_limited(self) -> bool:
+        '''Whether acquire() can ever wait.'''
+        return self.bytes_per_second > 0 or self.operations_per_second > 0 or self.slowdown > 1
+
+    def acquire(self, byte_count: int = 0, operations: int = 0):
+        '''Take tokens for byte_count bytes and some operations, sleeping until the limits allow them.'''
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_refill
+            self._last_refill = now
+            self._measure(now, byte_count)
+            byte_rate, operation_rate = self._rates()
+            wait = 0.0
+            if byte_rate > 0:
+                self._bytes_available = min(self._bytes_available + elapsed * byte_rate, byte_rate) - byte_count
+                if self._bytes_available < 0:  # in debt, which the next callers wait for too
+                    wait = -self._bytes_available / byte_rate
+            if operation_rate > 0:
+                self._operations_available = min(self._operations_available + elapsed * operation_rate, operation_rate) - operations
+                if self._operations_available < 0:
+                    wait = max(wait, -self._operations_available / operation_rate)
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def slow_down(self):
+        '''Halve the limits, down to 1/MAX_SLOWDOWN of them.'''
+        with self._lock:
+            if self.bytes_per_second <= 0 and self._unlimited_base == None:
+                self._unlimited_base = max(self._measured_rate, self.MIN_BYTES_PER_SECOND)
+                self._bytes_available = 0
+            self.slowdown = min(self.slowdown * 2, self.MAX_SLOWDOWN)
+
+    def speed_up(self):
+        '''Raise the limits back toward full speed, more gradually than slow_down() lowers them.'''
+        with self._lock:
+            self.slowdown = max(self.slowdown / 1.5, 1.0)
+            if self.slowdown == 1.0:
+                self._unlimited_base = None
+
+    def _rates(self):
+        byte_rate = self.bytes_per_second if self.bytes_per_second > 0 else (self._unlimited_base or 0)
+        return byte_rate / self.slowdown, self.operations_per_second / self.slowdown
+
+    def _measure(self, now: float, byte_count: int):
+        '''Keep the byte rate of the last second or so, for slowing down a throttle with no byte limit.'''
+        self._measured_bytes += byte_count
+        if now - self._measure_start >= 1:
+            self._measured_rate = self._measured_bytes / (now - self._measure_start)
+            self._measure_start = now
+            self._measured_bytes = 0
+
+
+class ThrottledReader:
+    '''
+    Wraps a binary file opened for reading, taking the bytes read from a throttle.
+
+    Parameters
+    ----------
+    file: `BinaryIO`
+        The file to read
+    throttle: `Throttle`
+        The throttle to take bytes from
+    '''
+
+    def __init__(self, file: BinaryIO, throttle: Throttle):
+        self._file = file
+        self._throttle = throttle
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._throttle.acquire(len(data))
+        return data
+
+
+def lower_thread_priority():
+    '''Give the calling thread the lowest CPU scheduling priority, where the platform allows it (Linux sets it per thread).'''
+    if not hasattr(os, "setpriority") or not hasattr(threading, "get_native_id"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except OSError:
+        pass
+
+
+def set_idle_io_priority() -> bool:
+    '''
+    Put the calling thread in the idle I/O scheduling class with ioprio_set, so its reads and writes only use the disk
+    when nothing else is. Returns false where this is unsupported (anywhere but Linux).
+
+    Only I/O schedulers that support priorities (BFQ, or CFQ on older kernels) honor it; others accept and ignore it.
+    '''
+    syscall_number = SYS_IOPRIO_SET.get(platform.machine().lower())
+    if not sys.platform.startswith("linux") or syscall_number == None or not hasattr(threading, "get_native_id"):
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        result = libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, threading.get_native_id(), IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+    except (OSError, AttributeError):
+        return False
+    return result == 0
+
+
+def parse_mspt(message: str) -> Union[float, None]:
+    '''Read the milliseconds per tick from the output of vanilla's /tick query, Forge's /forge tps, or Paper's /mspt.'''
+    for pattern in MSPT_PATTERNS:
+        match = pattern.search(message)
+        if match != None:
+            try:
+                return float(match.group(1))
+            except ValueError:
+                return None
+    return None
+
+
+def is_overload_warning(message: str) -> bool:
+    '''Check for "Can't keep up! Is the server overloaded? Running 2004ms or 40 ticks behind".'''
+    return message.startswith("Can't keep up!")
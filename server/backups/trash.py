@@ -0,0 +1,114 @@
+'''
+Deleting backups in the background
+
+Deleting a large backup directory can take many seconds, so backups are instead renamed into a trash folder
+beside them (which is instant, since it is on the same filesystem) and removed by a low priority thread.
+
+Classes
+-------
+BackupTrash
+    A trash folder and the thread that empties it
+'''
+
+from server.backups.throttle import lower_thread_priority, set_idle_io_priority
+from typing import List, Union
+import threading
+import time
+import os
+
+
+class BackupTrash:
+    '''
+    A trash folder that deleted backups are renamed into, emptied file by file on a background thread at the lowest CPU and I/O priority.
+    The thread only runs while there is something to delete.
+
+    Anything left in the folder (such as after the manager was stopped while deleting) is removed once the trash is next used.
+
+    Parameters
+    ----------
+    directory: `str`
+        The trash folder, which must be on the same filesystem as the backups, created when the first backup is moved into it
+
+    Attributes
+    ----------
+    files_deleted: `int`
+        The number of files and folders deleted by the background thread so far
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self.files_deleted = 0
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread: Union[threading.Thread, None] = None
+        self._lock = threading.Lock()
+        if len(self.pending()) > 0:
+            self._start()
+
+    def move(self, path: str):
+        '''Move a file or folder into the trash, to be deleted in the background. Raises FileNotFoundError if it does not exist.'''
+        os.makedirs(self.directory, exist_ok=True)
+        os.rename(path, os.path.join(self.directory, f"{time.time_ns()}-{os.path.basename(path)}"))
+        self._start()
+
+    def pending(self) -> List[str]:
+        '''Get the names of everything waiting to be deleted, oldest first.'''
+        try:
+            entries = [entry.split("-", 1) for entry in os.listdir(self.directory)]
+        except FileNotFoundError:
+            return []
+        # entries are named <time moved in ns>-<original name>
+        return [entry[1] for entry in sorted(entry for entry in entries if len(entry) == 2 and entry[0].isdigit())]
+
+    def wait_until_empty(self, timeout: Union[float, None] = None) -> bool:
+        '''Block until the trash has been emptied, returning false if the timeout passed first.'''
+        return self._idle.wait(timeout)
+
+    def _start(self):
+        with self._lock:
+            self._idle.clear()
+            self._wake.set()
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._empty_until_done, name="BackupTrash", daemon=True)
+                self._thread.start()
+
+    def _empty_until_done(self):
+        lower_thread_priority()
+        set_idle_io_priority()
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                entries = sorted(os.listdir(self.directory))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                self._delete(os.path.join(self.directory, entry))
+            with self._lock:
+                if not self._wake.is_set():  # nothing was moved in while deleting, so stop until something is
+                    self._idle.set()
+                    self._thread = None
+                    return
+
+    def _delete(self, path: str):
+        '''Delete a file or tree one file at a time (deepest first), skipping anything that cannot be removed.'''
+        if not os.path.isdir(path) or os.path.islink(path):
+            self._remove(os.unlink, path)
+            return
+        for root, directories, files in os.walk(path, topdown=False):
+            for file in files:
+                self._remove(os.unlink, os.path.join(root, file))
+            for directory in directories:
+                directory_path = os.path.join(root, directory)
+                self._remove(os.unlink if os.path.islink(directory_path) else os.rmdir, directory_path)
+        self._remove(os.rmdir, path)
+
+    def _remove(self, remove, path: str):
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:  # e.g. permissions, left in the trash to be tried again next time
+            return
+        self.files_deleted += 1
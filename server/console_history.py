@@ -0,0 +1,171 @@
+from typing import Any, Iterator, Sequence, Union, List
+
+
+class ConsoleHistory:
+    '''
+    A fixed size ring buffer of recent console lines (or records), indexed by sequence number.
+
+    Sequence numbers count up from 0 for every line appended since the buffer was last cleared.
+    Once the buffer is full, appending a line overwrites the oldest one.
+
+    Parameters
+    ----------
+    capacity: `int`
+        The maximum number of lines to hold, default 10000
+    '''
+
+    def __init__(self, capacity: int = 10000):
+        if capacity <= 0:
+            raise ValueError("Console history capacity must be positive.")
+        self._capacity = capacity
+        self._lines: List[Any] = [None] * capacity
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return self._next_seq - self.first_seq()
+
+    def clear(self):
+        '''Remove all lines and restart sequence numbers from 0.'''
+        self._lines = [None] * self._capacity
+        self._next_seq = 0
+
+    def append(self, line: Any) -> int:
+        '''Add a line to the buffer, returning its sequence number.'''
+        seq = self._next_seq
+        self._lines[seq % self._capacity] = line
+        self._next_seq += 1
+        return seq
+
+    def first_seq(self) -> int:
+        '''The sequence number of the oldest line still held.'''
+        return max(0, self._next_seq - self._capacity)
+
+    def next_seq(self) -> int:
+        '''The sequence number that the next appended line will have (i.e. the total number of lines seen).'''
+        return self._next_seq
+
+    def get(self, seq: int) -> Any:
+        '''Get the line with the given sequence number, raises IndexError if it is not held.'''
+        if seq < self.first_seq() or seq >= self._next_seq:
+            raise IndexError(f"Line {seq} is not in the console history.")
+        return self._lines[seq % self._capacity]
+
+    def range(self, start: int, stop: int) -> List[Any]:
+        '''Get the held lines with sequence numbers in [start, stop), clamped to what is held.'''
+        start = max(start, self.first_seq())
+        stop = min(stop, self._next_seq)
+        return [self._lines[seq % self._capacity] for seq in range(start, stop)]
+
+    def tail(self, count: int) -> List[Any]:
+        '''Get up to the last count lines.'''
+        return self.range(self._next_seq - count, self._next_seq)
+
+
+class ConsoleLogView (Sequence):
+    '''
+    Read-only view of a server session's console, indexed by line number.
+
+    Recent lines are served from the console history (as strings, if it holds records).
+    Lines older than the history holds are read from the log file on disk, only when they are asked for.
+    If the history is empty (e.g. the server has not been started since the manager launched), the log file is used for everything.
+
+    Reading from the file needs an index of where its lines start. Build it with index_file() off the event loop (it reads
+    the whole file once), after which each page is read by seeking straight to it. If it was not built, it is built the
+    first time the file is needed.
+
+    Note that the log file and the console output are assumed to match line for line, which is not exact for all servers.
+
+    Parameters
+    ----------
+    history: `ConsoleHistory`
+        The history of the current session
+    log_file: `str`
+        The log file of the current (or most recent) session, such as logs/latest.log
+    '''
+
+    _INDEX_CHUNK_SIZE = 1048576
+
+    def __init__(self, history: ConsoleHistory, log_file: str):
+        self._history = history
+        self._log_file = log_file
+        self._line_offsets: Union[List[int], None] = None  # where each line of the file starts, then where the file ends
+
+    def needs_file(self) -> bool:
+        '''Whether any lines must be read from the log file, because the history is empty or has dropped lines.'''
+        return self._history.next_seq() == 0 or self._history.first_seq() > 0
+
+    def index_file(self):
+        '''Find where each line of the log file starts. This reads the whole file, so run it off the event loop.'''
+        offsets = [0]
+        try:
+            with open(self._log_file, "rb") as log:
+                position = 0
+                while True:
+                    chunk = log.read(self._INDEX_CHUNK_SIZE)
+                    if chunk == b"":
+                        break
+                    newline = chunk.find(b"\n")
+                    while newline != -1:
+                        offsets.append(position + newline + 1)
+                        newline = chunk.find(b"\n", newline + 1)
+                    position += len(chunk)
+        except OSError:  # no log yet
+            position = 0
+        if offsets[-1] != position:  # the last line has no newline
+            offsets.append(position)
+        self._line_offsets = offsets
+
+    def __len__(self) -> int:
+        if self._history.next_seq() > 0:
+            return self._history.next_seq()
+        return self._file_length()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self._get_range(start, stop)
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("Console log index out of range.")
+        return self._get_range(index, index + 1)[0]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self[:])
+
+    def _get_range(self, start: int, stop: int) -> List[str]:
+        if start >= stop:
+            return []
+        if self._history.next_seq() == 0:
+            return self._read_file_lines(start, stop)
+        first_held = self._history.first_seq()
+        lines = []
+        if start < first_held:
+            lines = self._read_file_lines(start, min(stop, first_held))
+            lines += [""] * (min(stop, first_held) - start - len(lines))  # keep numbering if the file is shorter than expected
+        return lines + [str(line) for line in self._history.range(max(start, first_held), stop)]
+
+    def _file_length(self) -> int:
+        if self._line_offsets == None:
+            self.index_file()
+        return len(self._line_offsets) - 1  # type: ignore
+
+    def _read_file_lines(self, start: int, stop: int) -> List[str]:
+        '''Read lines [start, stop) of the log file, clamped to the lines it had when indexed.'''
+        stop = min(stop, self._file_length())
+        if start >= stop:
+            return []
+        offsets: List[int] = self._line_offsets  # type: ignore
+        try:
+            with open(self._log_file, "rb") as log:
+                log.seek(offsets[start])
+                data = log.read(offsets[stop] - offsets[start])
+        except OSError:
+            return []
+        lines = data.decode("utf-8", errors="replace").split("\n")
+        if data.endswith(b"\n"):
+            lines.pop()
+        return [line.rstrip("\r") for line in lines]
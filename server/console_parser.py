@@ -0,0 +1,134 @@
+'''
+Parsing for Minecraft server console lines
+
+Classes
+-------
+ConsoleRecord
+    A parsed console line
+ConsoleParser
+    Turns console lines into ConsoleRecords
+
+Methods
+-------
+benchmark(log_file: `str`, repeat: `int`) -> `float`
+    Measure parsing throughput over a recorded log, in lines per second
+'''
+
+from typing import Iterable, List, Union
+import time
+import sys
+import re
+
+
+class ConsoleRecord:
+    '''
+    A parsed console line
+
+    Lines that do not match a known format (e.g. stack traces) have every field but message and raw set to None.
+
+    Attributes
+    ----------
+    timestamp: `str`
+        The timestamp as printed, such as "12:34:56"
+    thread: `str`
+        The thread that logged the line, such as "Server thread"
+    level: `str`
+        The log level, such as "INFO" or "WARN"
+    source: `str`
+        The logger name, for formats that print one (Forge, Fabric), otherwise None
+    message: `str`
+        The message after the prefix
+    raw: `str`
+        The full line
+    '''
+
+    __slots__ = ("timestamp", "thread", "level", "source", "message", "raw")
+
+    def __init__(self, timestamp: Union[str, None], thread: Union[str, None], level: Union[str, None],
+                 source: Union[str, None], message: str, raw: str):
+        self.timestamp = timestamp
+        self.thread = thread
+        self.level = level
+        self.source = source
+        self.message = message
+        self.raw = raw
+
+    def __str__(self) -> str:
+        return self.raw
+
+    def __repr__(self) -> str:
+        return f"ConsoleRecord({self.raw!r})"
+
+
+# [12:34:56] [Server thread/INFO]: message
+VANILLA_PATTERN = re.compile(r"\[(?P<timestamp>[^\]]+)\] \[(?P<thread>[^\]]+)/(?P<level>[A-Z]+)\]: (?P<message>.*)", re.DOTALL)
+# [12:34:56 INFO]: message
+PAPER_PATTERN = re.compile(r"\[(?P<timestamp>[\d:]+) (?P<level>[A-Z]+)\]: (?P<message>.*)", re.DOTALL)
+# [12:34:56] [Server thread/INFO] [minecraft/DedicatedServer]: message
+# [17Mar2023 12:34:56.789] [Server thread/INFO] [net.minecraft.server.dedicated.DedicatedServer/]: message
+FORGE_PATTERN = re.compile(r"\[(?P<timestamp>[^\]]+)\] \[(?P<thread>[^\]]+)/(?P<level>[A-Z]+)\] \[(?P<source>[^\]]*)\]: (?P<message>.*)", re.DOTALL)
+# [12:34:56] [main/INFO] (FabricLoader) message
+FABRIC_PATTERN = re.compile(r"\[(?P<timestamp>[^\]]+)\] \[(?P<thread>[^\]]+)/(?P<level>[A-Z]+)\] \((?P<source>[^)]*)\) (?P<message>.*)", re.DOTALL)
+
+PATTERNS = [VANILLA_PATTERN, PAPER_PATTERN, FORGE_PATTERN, FABRIC_PATTERN]
+
+
+class ConsoleParser:
+    '''
+    Turns console lines into ConsoleRecords
+
+    A server prints almost every line in the same format, so the pattern that matched last is tried first.
+    Thread, level, and source names are interned, since they repeat on nearly every line.
+    '''
+
+    def __init__(self):
+        self._patterns = list(PATTERNS)
+
+    def parse(self, line: str) -> ConsoleRecord:
+        '''Parse a single line (without its newline).'''
+        for i, pattern in enumerate(self._patterns):
+            match = pattern.match(line)
+            if match != None:
+                if i != 0:
+                    self._patterns.insert(0, self._patterns.pop(i))
+                groups = match.groupdict()
+                thread = groups.get("thread")
+                source = groups.get("source")
+                return ConsoleRecord(groups["timestamp"],
+                                     sys.intern(thread) if thread != None else None,
+                                     sys.intern(groups["level"]),
+                                     sys.intern(source) if source != None else None,
+                                     groups["message"], line)
+        return ConsoleRecord(None, None, None, None, line, line)
+
+    def parse_all(self, lines: Iterable[str]) -> List[ConsoleRecord]:
+        '''Parse many lines (without their newlines).'''
+        return [self.parse(line) for line in lines]
+
+
+def benchmark(log_file: str, repeat: int = 3) -> float:
+    '''
+    Measure parsing throughput over a recorded log, returning the best of repeat runs in lines per second.
+
+    Usage: python -m server.console_parser <log file> [repeat]
+    benchmarks/console_parser.py generates a representative log, and compares this against unparsed checks.
+    '''
+    with open(log_file, "r", errors="replace") as log:
+        lines = [line.rstrip("\r\n") for line in log]
+    best = 0.0
+    for _ in range(repeat):
+        parser = ConsoleParser()
+        start = time.perf_counter()
+        parser.parse_all(lines)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(lines) / elapsed if elapsed > 0 else float("inf"))
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m server.console_parser <log file> [repeat]")
+        exit(1)
+    log_size = sum(1 for _ in open(sys.argv[1], "rb"))
+    lines_per_second = benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    print(f"Parsed {log_size} lines at {lines_per_second:,.0f} lines/s")
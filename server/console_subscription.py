@@ -0,0 +1,138 @@
+from typing import Any, Deque, List, Union
+from collections import deque
+from enum import Enum
+import asyncio
+
+
+class OverflowPolicy (Enum):
+    '''
+    What a subscription does with new console lines while its queue is full
+
+    Values
+    ------
+    BLOCK,
+        Wait for the subscriber to catch up (this pauses reading the server's console for every subscriber)
+    DROP_OLDEST,
+        Discard the oldest queued line to make room
+    COALESCE
+        Merge the line into the newest queued entry, so nothing is lost but it is delivered in one larger batch.
+        Once that entry holds max_batch lines, the oldest entry is discarded instead, as with DROP_OLDEST.
+    '''
+    BLOCK = 0
+    DROP_OLDEST = 1
+    COALESCE = 2
+
+
+class ConsoleSubscription:
+    '''
+    A bounded queue of console lines for one subscriber.
+
+    Create these with ServerRunner.subscribe() rather than directly.
+    Read lines in batches with get_batch(), or with "async for batch in subscription".
+
+    Parameters
+    ----------
+    maxsize: `int`
+        The number of queued entries before the overflow policy applies, default 1000
+    policy: `OverflowPolicy`
+        The overflow policy, default OverflowPolicy.BLOCK
+    max_batch: `int`
+        The most lines to return from one call to get_batch(), default 100
+
+    Attributes
+    ----------
+    policy: `OverflowPolicy`
+        The overflow policy in use
+    dropped: `int`
+        The number of lines discarded by DROP_OLDEST (or by COALESCE, once entries are full)
+    coalesced: `int`
+        The number of lines merged into another entry by COALESCE
+    delivered: `int`
+        The number of lines returned to the subscriber
+    '''
+
+    def __init__(self, maxsize: int = 1000, policy: OverflowPolicy = OverflowPolicy.BLOCK, max_batch: int = 100):
+        if maxsize <= 0 or max_batch <= 0:
+            raise ValueError("Subscription queue and batch sizes must be positive.")
+        self._maxsize = maxsize
+        self._max_batch = max_batch
+        self._entries: Deque[List[Any]] = deque()
+        self._queued = 0
+        self._closed = False
+        self._item_waiter: Union[asyncio.Future, None] = None
+        self._space_waiter: Union[asyncio.Future, None] = None
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.delivered = 0
+
+    def lag(self) -> int:
+        '''The number of lines waiting to be read by the subscriber.'''
+        return self._queued
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        '''Stop accepting lines. Lines already queued can still be read, after which iteration ends.'''
+        self._closed = True
+        self._wake(self._item_waiter)
+        self._wake(self._space_waiter)
+
+    async def put(self, item: Any):
+        '''Queue a line, applying the overflow policy if the queue is full. Lines put after closing are ignored.'''
+        while not self._closed and len(self._entries) >= self._maxsize:
+            if self.policy == OverflowPolicy.DROP_OLDEST or (self.policy == OverflowPolicy.COALESCE and
+                                                             len(self._entries[-1]) >= self._max_batch):
+                discarded = len(self._entries.popleft())
+                self._queued -= discarded
+                self.dropped += discarded
+            elif self.policy == OverflowPolicy.COALESCE:
+                self._entries[-1].append(item)
+                self._queued += 1
+                self.coalesced += 1
+                self._wake(self._item_waiter)
+                return
+            else:
+                if self._space_waiter == None or self._space_waiter.done():
+                    self._space_waiter = asyncio.get_running_loop().create_future()
+                await self._space_waiter
+        if self._closed:
+            return
+        self._entries.append([item])
+        self._queued += 1
+        self._wake(self._item_waiter)
+
+    async def get_batch(self) -> List[Any]:
+        '''
+        Wait for queued lines and return up to max_batch of them, oldest first.
+
+        Returns an empty list once the subscription is closed and drained.
+        '''
+        while len(self._entries) == 0:
+            if self._closed:
+                return []
+            if self._item_waiter == None or self._item_waiter.done():
+                self._item_waiter = asyncio.get_running_loop().create_future()
+            await self._item_waiter
+        batch = []
+        # a coalesced entry is never split, so a batch may exceed max_batch by one entry's worth
+        while len(self._entries) > 0 and len(batch) < self._max_batch:
+            batch.extend(self._entries.popleft())
+        self._queued -= len(batch)
+        self.delivered += len(batch)
+        self._wake(self._space_waiter)
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> List[Any]:
+        batch = await self.get_batch()
+        if len(batch) == 0:
+            raise StopAsyncIteration
+        return batch
+
+    def _wake(self, waiter: Union[asyncio.Future, None]):
+        if waiter != None and not waiter.done():
+            waiter.set_result(None)
@@ -0,0 +1,112 @@
+'''
+The async interface of RemoteServerManager, for servers on this machine
+
+Classes
+-------
+LocalServerManager
+    A ServerManager on this machine, with the methods of RemoteServerManager
+'''
+
+from server.backups.catalog import CatalogEntry
+from server.server_manager import ServerManager
+from server.server import ServerRunner
+from typing import Dict, List, Sequence, Union
+
+
+class LocalServerManager:
+    '''
+    A ServerManager on this machine, with the same methods as RemoteServerManager, so commands can use either.
+
+    The methods that are synchronous on a ServerManager (such as write() and list_backups()) are coroutines here.
+    They still run on the event loop, since they are quick once the backup catalog is loaded (which the backup methods
+    wait for, off the loop). server_active() and server_should_be_running() stay synchronous, as on RemoteServerManager.
+
+    Parameters
+    ----------
+    manager: `ServerManager`
+        The manager to pass calls to
+
+    Attributes
+    ----------
+    manager: `ServerManager`
+        The manager calls are passed to
+    server: `ServerRunner`
+        The server's console, to add listeners to
+    '''
+
+    def __init__(self, manager: ServerManager):
+        self.manager = manager
+        self.server: ServerRunner = manager.server
+
+    @property
+    def _port(self) -> Union[int, None]:
+        return self.manager._port
+
+    @property
+    def _query_port(self) -> Union[int, None]:
+        return self.manager._query_port
+
+    def server_active(self) -> bool:
+        return self.manager.server_active()
+
+    def server_should_be_running(self) -> bool:
+        return self.manager.server_should_be_running()
+
+    async def start_server(self):
+        '''Start the server, returning once its monitor shuts down (see ServerManager.start_server()).'''
+        await self.manager.start_server()
+
+    async def stop_server(self) -> Union[str, None]:
+        return self.manager.stop_server()
+
+    async def write(self, command: str) -> Union[str, None]:
+        return self.manager.write(command)
+
+    async def get_latest_log(self) -> Sequence[str]:
+        return await self.manager.get_latest_log()
+
+    async def backup_world(self, backup_name: Union[str, None] = None) -> Union[str, None]:
+        return await self.manager.backup_world(backup_name)
+
+    async def list_backups(self) -> Union[str, List[str]]:
+        await self.manager.load_backup_catalog()
+        return self.manager.list_backups()
+
+    async def get_backup_infos(self, names: List[str]) -> Dict[str, Union[CatalogEntry, None]]:
+        await self.manager.load_backup_catalog()
+        return self.manager.get_backup_infos(names)
+
+    async def get_backup_info(self, backup: str) -> Union[CatalogEntry, None]:
+        await self.manager.load_backup_catalog()
+        return self.manager.get_backup_info(backup)
+
+    async def get_remote_backups(self) -> Dict[str, Dict]:
+        return await self.manager.get_remote_backups()
+
+    async def pending_deletions(self) -> List[str]:
+        return self.manager.pending_deletions()
+
+    async def restore_backup(self, backup: str, restart: bool = False) -> bool:
+        return await self.manager.restore_backup(backup, restart=restart)
+
+    async def wait_for_restore_swap(self, timeout: Union[float, None] = None):
+        await self.manager.wait_for_restore_swap(timeout)
+
+    async def restore_partial(self, backup: str, dimension: str = "overworld", box: Union[str, None] = None,
+                              player: Union[str, None] = None, chunks_only: bool = False):
+        await self.manager.restore_partial(backup, dimension=dimension, box=box, player=player, chunks_only=chunks_only)
+
+    async def delete_backup(self, backup: str):
+        await self.manager.delete_backup(backup)
+
+    async def rollback_restore(self):
+        self.manager.rollback_restore()
+
+    async def has_restore_rollback(self) -> bool:
+        return self.manager.has_restore_rollback()
+
+    async def discard_restore_rollback(self):
+        await self.manager.discard_restore_rollback()
+
+    async def rebuild_backup_catalog(self) -> int:
+        return await self.manager.rebuild_backup_catalog()
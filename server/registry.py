@@ -0,0 +1,287 @@
+'''
+Running several Minecraft servers from one process
+
+Each server is configured in its own config section. Nothing is created for a server until it is first used, and the
+servers share one event loop and one pool of backup workers, so idle servers cost almost nothing.
+Servers on other machines are controlled through the node agent running there (see server.agent and server.remote).
+
+Classes
+-------
+ServerEntry
+    One configured server, and its manager and status clients once they are needed
+ServerRegistry
+    Every configured server, by key
+'''
+
+from config.configs import ObsidiaConfigParser
+from server.backups.copier import CopyEngine
+from server.server_manager import ServerManager
+from server.local import LocalServerManager
+from server.remote import RemoteServerManager
+from server.rpc import RPCPool
+from server.server_ping import AsyncStatusPing
+from server.server_query import QueryClient
+from server.status_cache import StatusCache
+from typing import Callable, Dict, List, Union
+
+
+SECTION_PREFIX = "Server:"  # [Server:<key>] sections configure one server each, [Server] alone configures a single server
+AGENT_PREFIX = "Agent:"  # [Agent:<name>] sections configure the agents of servers on other machines
+SINGLE_SERVER_KEY = "default"
+
+
+class ServerEntry:
+    '''
+    One configured server. Its manager, status cache and query client are created the first time they are asked for.
+
+    Commands use load(), which returns a LocalServerManager or RemoteServerManager, both with the same async methods.
+    A remote server (one with an agent) must be loaded with load() before its manager is used, since that connects to
+    its agent.
+
+    Parameters
+    ----------
+    key: `str`
+        The name commands use to pick the server
+    directory: `str`
+        The server's directory (see ServerManager)
+    config_file: `str`
+        The config file for the server's manager
+    name: `str`
+        The name shown in queries, default None (the ip, or "MC Server")
+    ip: `str`
+        The ip shown in queries, default None
+    status_ttl: `float`
+        The seconds to reuse the server's status for (see StatusCache), default 10
+    copy_engine: `CopyEngine`
+        The backup workers to give the manager, default None (the manager makes its own)
+    on_load: `Callable[[ServerEntry], None]`
+        Called once the manager has been created, such as to add console listeners, default None
+    agent: `RPCPool`
+        The connections to the agent of a server on another machine, default None (the server is on this machine)
+    remote_key: `str`
+        The server's key on its agent, default None (the same key)
+    '''
+
+    def __init__(self, key: str, directory: str, config_file: str, name: Union[str, None] = None, ip: Union[str, None] = None,
+                 status_ttl: float = 10, copy_engine: Union[CopyEngine, None] = None,
+                 on_load: Union[Callable[["ServerEntry"], None], None] = None, agent: Union[RPCPool, None] = None,
+                 remote_key: Union[str, None] = None):
+        self.key = key
+        self.directory = directory
+        self.config_file = config_file
+        self.name = name if name != "" else None
+        self.ip = ip if ip != "" else None
+        self.status_ttl = status_ttl
+        self._copy_engine = copy_engine
+        self._on_load = on_load
+        self._agent = agent
+        self._remote_key = remote_key if remote_key not in (None, "") else key
+        self._manager: Union[ServerManager, RemoteServerManager, None] = None
+        self._local: Union[LocalServerManager, None] = None
+        self._status_cache: Union[StatusCache, None] = None
+        self._status_port: Union[int, None] = None
+        self._query_client: Union[QueryClient, None] = None
+
+    def is_loaded(self) -> bool:
+        '''Whether the manager has been created.'''
+        return self._manager != None
+
+    def is_remote(self) -> bool:
+        '''Whether the server is on another machine, controlled through its agent.'''
+        return self._agent != None
+
+    def host(self) -> str:
+        '''Get the address of the machine the server runs on, for status pings and queries.'''
+        return self._agent.host if self._agent != None else "localhost"
+
+    async def load(self) -> Union[LocalServerManager, RemoteServerManager]:
+        '''
+        Get the server's manager for commands, creating it on first use (connecting to the agent of a remote server).
+        A local server's ServerManager is returned as a LocalServerManager, so both kinds have the same methods.
+        Raises as manager() does, or OSError or asyncio.TimeoutError if the agent cannot be reached.
+        '''
+        if self._agent == None:
+            if self._local == None:
+                self._local = LocalServerManager(self.manager())  # type: ignore
+            return self._local
+        if self._manager != None:
+            return self._manager  # type: ignore
+        manager = RemoteServerManager(self._agent, self._remote_key)
+        try:
+            await manager.connect()
+        except BaseException:
+            manager.close()
+            raise
+        if self._manager == None:  # another command may have connected it meanwhile
+            self._manager = manager
+            if self._on_load != None:
+                self._on_load(self)
+        else:
+            manager.close()
+        return self._manager  # type: ignore
+
+    def manager(self) -> Union[ServerManager, RemoteServerManager]:
+        '''
+        Get the server's manager, creating it on first use.
+        Raises FileNotFoundError if the server has never been run, or RuntimeError if its config is invalid
+        (or if it is a remote server that has not been loaded).
+        '''
+        if self._manager == None:
+            if self._agent != None:
+                raise RuntimeError(f"Server {self.key} is not connected to its agent yet")
+            self._manager = ServerManager(self.directory, self.config_file, copy_engine=self._copy_engine)
+            if self._on_load != None:
+                self._on_load(self)
+        return self._manager
+
+    def status_cache(self) -> StatusCache:
+        '''Get the cache of the server's status, recreated if the server's port changed since it was last started.'''
+        port = self.manager()._port
+        if self._status_cache == None or self._status_port != port:
+            self._status_cache = StatusCache(AsyncStatusPing(self.host(), port, timeout=2), ttl=self.status_ttl)
+            self._status_port = port
+        return self._status_cache
+
+    def query_client(self) -> Union[QueryClient, None]:
+        '''Get a Query client for the server, or None if enable-query is off in its server.properties.'''
+        port = self.manager()._query_port
+        if port == None:
+            return None
+        if self._query_client == None or self._query_client.port != port:
+            if self._query_client != None:
+                self._query_client.close()
+            self._query_client = QueryClient(self.host(), port, timeout=1)
+        return self._query_client
+
+    def title(self) -> str:
+        '''Get the name to show the server as: its name, otherwise its ip, otherwise "MC Server".'''
+        if self.name != None:
+            return self.name
+        if self.ip != None:
+            return self.ip
+        return "MC Server"
+
+    def address(self) -> Union[str, None]:
+        '''Get the address players connect to (ip:port), or None if no ip is configured.'''
+        if self.ip == None:
+            return None
+        return f"{self.ip}:{self.manager()._port}"
+
+
+class ServerRegistry:
+    '''
+    Every server the process manages, by key, in the order they were added.
+
+    Parameters
+    ----------
+    backup_workers: `int`
+        The number of backup workers shared by every server, default 4
+    idle_priority: `bool`
+        Run the backup workers at idle priority (see CopyEngine), default False
+    on_load: `Callable[[ServerEntry], None]`
+        Called when a server's manager is created, default None
+    '''
+
+    def __init__(self, backup_workers: int = 4, idle_priority: bool = False,
+                 on_load: Union[Callable[[ServerEntry], None], None] = None):
+        self._on_load = on_load
+        self._copy_engine = CopyEngine(backup_workers, idle_priority=idle_priority)  # its threads start when first used
+        self._entries: Dict[str, ServerEntry] = {}
+        self._agents: Dict[str, RPCPool] = {}
+
+    @classmethod
+    def from_config(cls, config_file: str, on_load: Union[Callable[[ServerEntry], None], None] = None) -> "ServerRegistry":
+        '''
+        Read the servers from a config file: a [Server:<key>] section for each server, or a single [Server] section.
+
+        A server's section may set config to a separate config file for its manager (its restarts, backups, and so on),
+        otherwise config_file is used. A server on another machine sets agent to the name of an [Agent:<name>] section
+        instead of setting directory. Raises ValueError if no server is configured.
+        '''
+        config = ObsidiaConfigParser(config_file)
+        registry = cls(int(config.get("Backups", "backup_workers", default="4")),  # type: ignore
+                       config.get("Backups", "idle_priority", default="false").lower() == "true", on_load)  # type: ignore
+        for section in config.sections():
+            if section.startswith(AGENT_PREFIX):
+                host, token = config.get(section, "host", default=""), config.get(section, "token", default="")
+                if host == "" or token == "":
+                    raise ValueError(f"Agent host or token not provided in [{section}]")
+                registry.add_agent(section[len(AGENT_PREFIX):].strip(), host, int(config.get(section, "port", default="25580")),  # type: ignore
+                                   token, int(config.get(section, "connections", default="2")))  # type: ignore
+        sections = [section for section in config.sections() if section.startswith(SECTION_PREFIX)]
+        if len(sections) == 0 and config.get("Server", "directory") not in (None, ""):
+            sections = ["Server"]
+        for section in sections:
+            key = section[len(SECTION_PREFIX):].strip() if section != "Server" else SINGLE_SERVER_KEY
+            directory = config.get(section, "directory", default="")
+            agent = config.get(section, "agent", default="")
+            if directory == "" and agent == "":
+                raise ValueError(f"Server directory not provided in [{section}]")
+            registry.add(key, directory, config.get(section, "config", default=config_file), config.get(section, "name"),  # type: ignore
+                         config.get(section, "ip"), float(config.get(section, "status_ttl", default="10")),  # type: ignore
+                         agent if agent != "" else None, config.get(section, "remote_key"))  # type: ignore
+        if len(registry) == 0:
+            raise ValueError("No servers configured")
+        return registry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def add(self, key: str, directory: str, config_file: str, name: Union[str, None] = None, ip: Union[str, None] = None,
+            status_ttl: float = 10, agent: Union[str, None] = None, remote_key: Union[str, None] = None) -> ServerEntry:
+        '''
+        Add a server (see ServerEntry for the parameters), on the agent with the given name if agent is not None.
+        Raises ValueError if the key is taken or the agent has not been added.
+        '''
+        if key in self._entries:
+            raise ValueError(f"There is already a server called {key}")
+        if agent != None and agent not in self._agents:
+            raise ValueError(f"There is no agent called {agent}")
+        entry = ServerEntry(key, directory, config_file, name, ip, status_ttl, self._copy_engine, self._on_load,
+                            self._agents[agent] if agent != None else None, remote_key)
+        self._entries[key] = entry
+        return entry
+
+    def add_agent(self, name: str, host: str, port: int, token: str, connections: int = 2) -> RPCPool:
+        '''Add the agent of servers on another machine (see RPCPool for the parameters). Raises ValueError if the name is taken.'''
+        if name in self._agents:
+            raise ValueError(f"There is already an agent called {name}")
+        self._agents[name] = RPCPool(host, port, token, connections)
+        return self._agents[name]
+
+    def close_agents(self):
+        '''Disconnect from every agent. Their servers keep running.'''
+        for entry in self._entries.values():
+            if entry.is_remote() and entry.is_loaded():
+                entry.manager().close()  # type: ignore
+        for pool in self._agents.values():
+            pool.close()
+
+    def keys(self) -> List[str]:
+        '''Get every server's key.'''
+        return list(self._entries)
+
+    def entries(self) -> List[ServerEntry]:
+        '''Get every server.'''
+        return list(self._entries.values())
+
+    def loaded(self) -> List[ServerEntry]:
+        '''Get the servers whose managers have been created.'''
+        return [entry for entry in self._entries.values() if entry.is_loaded()]
+
+    def resolve(self, key: Union[str, None]) -> ServerEntry:
+        '''
+        Get the server a command is for: the one with the key, or the only server if key is None.
+        Raises KeyError, with a message to show the user, if there is no such server or several to choose from.
+        '''
+        if key == None or key.strip() == "":
+            if len(self._entries) == 1:
+                return next(iter(self._entries.values()))
+            raise KeyError(f"Choose a server: {', '.join(self._entries)}")
+        entry = self._entries.get(key.strip())
+        if entry == None:
+            raise KeyError(f"There is no server called {key.strip()}. Choose from: {', '.join(self._entries)}")
+        return entry
@@ -0,0 +1,198 @@
+'''
+Controlling servers on other machines through their node agents (see server.agent)
+
+Classes
+-------
+RemoteConsole
+    Console listeners for a remote server, like ServerRunner's
+RemoteServerManager
+    A ServerManager on another machine
+'''
+
+from server.backups.catalog import CatalogEntry
+from server.rpc import RPCPool
+from typing import Any, Dict, List, Sequence, Union
+import asyncio
+
+
+class RemoteConsole:
+    '''
+    Passes a remote server's console lines to listeners, as ServerRunner.add_listener() does for local servers.
+
+    Lines are only received while the manager is connected to the agent, and listeners are told when the connection is lost.
+    '''
+
+    def __init__(self):
+        self._listeners: List[Any] = []
+
+    def add_listener(self, listener_object):
+        '''Subscribe an object with an "update(self, message: `str`)" function to the server's console lines.'''
+        try:
+            listener_object.update(f"Subscribed to server logs.")
+        except (AttributeError, TypeError):
+            raise AttributeError("Listener does not contain update(self, message: str) attribute.")
+        if listener_object not in self._listeners:
+            self._listeners.append(listener_object)
+
+    def remove_listener(self, listener_object):
+        if listener_object in self._listeners:
+            self._listeners.remove(listener_object)
+            listener_object.update(f"Unsubscribed from server logs.")
+
+    def _update_listeners(self, lines: List[str]):
+        for listener_object in self._listeners:
+            for line in lines:
+                listener_object.update(line)
+
+
+class RemoteServerManager:
+    '''
+    A ServerManager on another machine, controlled through its node agent.
+
+    It has the ServerManager methods the bot uses, but the ones that are blocking on a ServerManager (such as write() and
+    list_backups()) are coroutines here, as on LocalServerManager. server_active() and server_should_be_running() stay
+    synchronous: the manager watches the server, and answers them from the last state the agent sent.
+
+    The server keeps running on its machine when the bot stops, and when the connection is lost (which is retried).
+
+    Parameters
+    ----------
+    pool: `RPCPool`
+        The connections to the agent, shared with the agent's other servers
+    key: `str`
+        The server's key on the agent
+
+    Attributes
+    ----------
+    server: `RemoteConsole`
+        The server's console, to add listeners to
+    connected: `bool`
+        Whether the manager is currently receiving the server's state
+    '''
+
+    RECONNECT_DELAYS = [1, 2, 5, 10, 30]  # seconds to wait between attempts to reconnect, the last repeating
+
+    def __init__(self, pool: RPCPool, key: str):
+        self.pool = pool
+        self.key = key
+        self.server = RemoteConsole()
+        self.connected = False
+        self._state: Dict[str, Any] = {"active": False, "should_be_running": False, "port": None, "query_port": None}
+        self._watch_task: Union[asyncio.Task, None] = None
+
+    @property
+    def _port(self) -> Union[int, None]:
+        return self._state["port"]
+
+    @property
+    def _query_port(self) -> Union[int, None]:
+        return self._state["query_port"]
+
+    async def connect(self, timeout: float = 10):
+        '''
+        Get the server's state and start watching it.
+        Raises the agent's error if it cannot load the server (such as KeyError if it has no such server),
+        or OSError or asyncio.TimeoutError if the agent cannot be reached.
+        '''
+        self._state = await asyncio.wait_for(self.pool.call("state", server=self.key), timeout)
+        self.connected = True
+        if self._watch_task == None:
+            self._watch_task = asyncio.ensure_future(self._watch_forever())
+
+    def close(self):
+        '''Stop watching the server. It keeps running on its machine.'''
+        if self._watch_task != None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        self.connected = False
+
+    def server_active(self) -> bool:
+        '''Returns true if the server is running and accepting commands, as of the last state received.'''
+        return self.connected and self._state["active"]
+
+    def server_should_be_running(self) -> bool:
+        '''Returns true if the server should be running (but might be restarting), as of the last state received.'''
+        return self.connected and self._state["should_be_running"]
+
+    async def start_server(self):
+        '''Start the server. Unlike ServerManager.start_server(), this returns once it is starting.'''
+        await self.pool.call("start", server=self.key)
+
+    async def stop_server(self) -> Union[str, None]:
+        return await self.pool.call("stop", server=self.key)
+
+    async def write(self, command: str) -> Union[str, None]:
+        return await self.pool.call("write", server=self.key, command=command.strip())
+
+    async def get_latest_log(self) -> Sequence[str]:
+        '''Get the most recent lines of the server's latest log (see server.agent.LOG_LINES).'''
+        return await self.pool.call("latest_log", server=self.key)
+
+    async def backup_world(self, backup_name: Union[str, None] = None) -> Union[str, None]:
+        return await self.pool.call("backup", server=self.key, name=backup_name)
+
+    async def list_backups(self) -> Union[str, List[str]]:
+        return await self.pool.call("list_backups", server=self.key)
+
+    async def get_backup_infos(self, names: List[str]) -> Dict[str, Union[CatalogEntry, None]]:
+        '''Get the catalog entries of several backups at once, by name (None for those not in the catalog).'''
+        infos = await self.pool.call("backup_infos", server=self.key, names=names)
+        return {name: CatalogEntry.from_dict(info) if info != None else None for name, info in infos.items()}
+
+    async def get_backup_info(self, backup: str) -> Union[CatalogEntry, None]:
+        return (await self.get_backup_infos([backup]))[backup]
+
+    async def get_remote_backups(self) -> Dict[str, Dict]:
+        return await self.pool.call("remote_backups", server=self.key)
+
+    async def pending_deletions(self) -> List[str]:
+        return await self.pool.call("pending_deletions", server=self.key)
+
+    async def restore_backup(self, backup: str, restart: bool = False) -> bool:
+        return await self.pool.call("restore", server=self.key, name=backup, restart=restart)
+
+    async def wait_for_restore_swap(self, timeout: Union[float, None] = None):
+        await self.pool.call("wait_restore_swap", server=self.key, timeout=timeout)
+
+    async def restore_partial(self, backup: str, dimension: str = "overworld", box: Union[str, None] = None,
+                              player: Union[str, None] = None, chunks_only: bool = False):
+        await self.pool.call("restore_partial", server=self.key, name=backup, dimension=dimension, box=box, player=player,
+                             chunks_only=chunks_only)
+
+    async def delete_backup(self, backup: str):
+        await self.pool.call("delete_backup", server=self.key, name=backup)
+
+    async def rollback_restore(self):
+        await self.pool.call("rollback_restore", server=self.key)
+
+    async def has_restore_rollback(self) -> bool:
+        return await self.pool.call("has_restore_rollback", server=self.key)
+
+    async def discard_restore_rollback(self):
+        await self.pool.call("discard_restore_rollback", server=self.key)
+
+    async def rebuild_backup_catalog(self) -> int:
+        return await self.pool.call("rebuild_backups", server=self.key)
+
+    async def _watch_forever(self):
+        '''Keep a watch stream open, reconnecting with increasing delays whenever the connection is lost.'''
+        attempt = 0
+        while True:
+            try:
+                stream = await self.pool.stream("watch", server=self.key)
+                try:
+                    async for event in stream:
+                        if "state" in event:
+                            self._state = event["state"]
+                            self.connected = True
+                            attempt = 0
+                        elif "console" in event:
+                            self.server._update_listeners(event["console"])
+                finally:
+                    await stream.close()
+            except Exception as e:  # the connection was lost, or the agent could not watch the server
+                if self.connected:  # tell the listeners once, not on every failed attempt
+                    self.server._update_listeners([f"Lost connection to the agent at {self.pool.host}:{self.pool.port}: {e}"])
+            self.connected = False
+            await asyncio.sleep(self.RECONNECT_DELAYS[min(attempt, len(self.RECONNECT_DELAYS) - 1)])
+            attempt += 1
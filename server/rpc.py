@@ -0,0 +1,330 @@
+'''
+The framed RPC protocol between the bot and node agents (see server.agent), over one TCP stream per connection
+
+Every frame is a 4 byte big-endian length followed by that many bytes of UTF-8 JSON, holding one message:
+    {"id": n, "method": "...", "params": {...}}          a request
+    {"id": n, "result": ...}                             its result
+    {"id": n, "error": {"type": "...", "message": ...}}  its failure
+    {"id": n, "event": ...}                              an event, for requests that open a stream (the first accepts it)
+    {"id": n, "end": true}                               the agent closed the stream
+    {"cancel": n}                                        the client closed the stream
+
+Requests are answered in any order, so one connection carries many requests and streams at once.
+Connections start with a challenge: the agent sends {"challenge": "<hex>"}, and the client answers
+{"auth": "<HMAC-SHA256 of the challenge, keyed with the shared token>"}, so the token itself is never sent.
+
+Classes
+-------
+RPCError
+    A request failed on the agent with an error the client does not raise as itself
+RPCStream
+    The events of a stream
+RPCConnection
+    One authenticated connection to an agent
+RPCPool
+    Connections to one agent, opened as needed and shared by every caller
+
+Methods
+-------
+read_frame(reader: `asyncio.StreamReader`, max_size: `int`) -> `Dict`
+    Read one message
+encode_frame(message: `Dict`) -> `bytes`
+    Encode one message
+auth_digest(token: `str`, challenge: `str`) -> `str`
+    Answer a challenge
+'''
+
+from typing import Any, Dict, List, Union
+import asyncio
+import struct
+import hashlib
+import hmac
+import json
+
+
+MAX_FRAME_SIZE = 16 * 1048576
+AUTH_FRAME_SIZE = 1024  # the largest frame read before a connection is authenticated
+# errors that are raised as themselves on the client, since callers handle them (e.g. FileNotFoundError for a missing backup)
+REMOTE_EXCEPTIONS = {exception.__name__: exception for exception in
+                     [FileNotFoundError, FileExistsError, PermissionError, OSError, RuntimeError, ValueError, KeyError,
+                      asyncio.TimeoutError]}
+_END = object()  # put in a stream's queue when it ends
+
+
+class RPCError(Exception):
+    '''
+    A request failed on the agent
+
+    Attributes
+    ----------
+    type: `str`
+        The name of the exception raised on the agent
+    '''
+
+    def __init__(self, type: str, message: str):
+        super().__init__(f"{type}: {message}")
+        self.type = type
+
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int = MAX_FRAME_SIZE) -> Dict:
+    '''
+    Read one message of at most max_size bytes.
+    Raises asyncio.IncompleteReadError if the connection closes, or ValueError if the frame is invalid.
+    '''
+    length = struct.unpack(">I", await reader.readexactly(4))[0]
+    if length > max_size:
+        raise ValueError(f"Frame of {length} bytes is too large")
+    message = json.loads(await reader.readexactly(length))
+    if not isinstance(message, dict):
+        raise ValueError("Frame is not an object")
+    return message
+
+
+def encode_frame(message: Dict) -> bytes:
+    data = json.dumps(message, separators=(",", ":")).encode()
+    return struct.pack(">I", len(data)) + data
+
+
+def auth_digest(token: str, challenge: str) -> str:
+    return hmac.new(token.encode(), challenge.encode(), hashlib.sha256).hexdigest()
+
+
+def _error_from_message(error: Dict) -> Exception:
+    '''Get the exception to raise for an error message.'''
+    exception_type = REMOTE_EXCEPTIONS.get(error.get("type", ""))
+    if exception_type == None:
+        return RPCError(str(error.get("type")), str(error.get("message")))
+    return exception_type(error.get("message"))
+
+
+class RPCStream:
+    '''
+    The events of a stream, read with "async for event in stream". Iteration ends when the stream is closed by either side,
+    or raises ConnectionError if the connection is lost.
+    '''
+
+    def __init__(self, connection: "RPCConnection", request_id: int):
+        self._connection = connection
+        self._request_id = request_id
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._closed and self._events.empty():
+            raise StopAsyncIteration
+        event = await self._events.get()
+        if isinstance(event, BaseException):
+            self._closed = True
+            raise event
+        if event is _END:
+            self._closed = True
+            raise StopAsyncIteration
+        return event
+
+    async def close(self):
+        '''Close the stream, telling the agent to stop sending its events.'''
+        if not self._closed:
+            self._closed = True
+            self._events.put_nowait(_END)
+            self._connection._streams.pop(self._request_id, None)
+            if not self._connection.is_closed():
+                await self._connection._send({"cancel": self._request_id})
+
+    def _put(self, event: Any):
+        if not self._closed:
+            self._events.put_nowait(event)
+
+
+class RPCConnection:
+    '''
+    One authenticated connection to an agent. Open with RPCConnection.open().
+
+    Any number of requests and streams can be in progress at once. If the connection is lost, requests in progress
+    raise ConnectionError and streams end with ConnectionError.
+    '''
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._streams: Dict[int, RPCStream] = {}
+        self._write_lock = asyncio.Lock()
+        self._closed = False
+        self._read_task: Union[asyncio.Task, None] = None
+
+    @classmethod
+    async def open(cls, host: str, port: int, token: str, timeout: float = 10) -> "RPCConnection":
+        '''Connect to an agent and authenticate. Raises OSError or asyncio.TimeoutError if it fails, PermissionError if the token is refused.'''
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            challenge = await asyncio.wait_for(read_frame(reader, AUTH_FRAME_SIZE), timeout)
+            writer.write(encode_frame({"auth": auth_digest(token, str(challenge.get("challenge")))}))
+            await writer.drain()
+            reply = await asyncio.wait_for(read_frame(reader, AUTH_FRAME_SIZE), timeout)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            raise PermissionError(f"Agent at {host}:{port} refused the token")
+        except BaseException:
+            writer.close()
+            raise
+        if reply.get("authenticated") != True:
+            writer.close()
+            raise PermissionError(f"Agent at {host}:{port} refused the token")
+        connection = cls(reader, writer)
+        connection._read_task = asyncio.ensure_future(connection._read_forever())
+        return connection
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def load(self) -> int:
+        '''Get the number of requests and streams in progress.'''
+        return len(self._calls) + len(self._streams)
+
+    async def call(self, method: str, **params) -> Any:
+        '''Send a request and wait for its result, raising the agent's error if it fails.'''
+        request_id = self._new_id()
+        future = asyncio.get_running_loop().create_future()
+        self._calls[request_id] = future
+        try:
+            await self._send({"id": request_id, "method": method, "params": params})
+            return await future
+        finally:
+            self._calls.pop(request_id, None)
+
+    async def stream(self, method: str, **params) -> RPCStream:
+        '''Send a request that opens a stream, returning the stream once the agent has sent its first event (or ended it).'''
+        request_id = self._new_id()
+        stream = RPCStream(self, request_id)
+        self._streams[request_id] = stream
+        future = asyncio.get_running_loop().create_future()
+        self._calls[request_id] = future
+        try:
+            await self._send({"id": request_id, "method": method, "params": params})
+            await future
+        except BaseException:
+            self._streams.pop(request_id, None)
+            raise
+        finally:
+            self._calls.pop(request_id, None)
+        return stream
+
+    def close(self):
+        if self._read_task != None:
+            self._read_task.cancel()
+        self._fail(ConnectionResetError("Connection to agent closed"))
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    async def _send(self, message: Dict):
+        if self._closed:
+            raise ConnectionResetError("Connection to agent closed")
+        async with self._write_lock:  # drain() must not be awaited by two writers at once
+            self._writer.write(encode_frame(message))
+            await self._writer.drain()
+
+    async def _read_forever(self):
+        try:
+            while True:
+                message = await read_frame(self._reader)
+                request_id = message.get("id")
+                if "event" in message or "end" in message:
+                    accepting = self._calls.get(request_id)  # type: ignore
+                    if accepting != None and not accepting.done():
+                        accepting.set_result(None)
+                    stream = self._streams.get(request_id)  # type: ignore
+                    if stream != None:
+                        if "end" in message:
+                            self._streams.pop(request_id, None)  # type: ignore
+                            stream._put(_END)
+                        else:
+                            stream._put(message["event"])
+                    continue
+                future = self._calls.get(request_id)  # type: ignore
+                if future == None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(_error_from_message(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self._fail(ConnectionResetError(f"Connection to agent lost: {e}"))
+        except asyncio.CancelledError:
+            pass
+
+    def _fail(self, error: Exception):
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+        for future in self._calls.values():
+            if not future.done():
+                future.set_exception(error)
+        for stream in self._streams.values():
+            stream._put(error)
+        self._calls.clear()
+        self._streams.clear()
+
+
+class RPCPool:
+    '''
+    Connections to one agent, shared by every caller.
+
+    Requests go to the least busy connection. A new connection is only opened when every open one is busy (up to size),
+    and lost connections are replaced on the next request, so a pool to an idle agent holds a single connection.
+
+    Parameters
+    ----------
+    host: `str`
+        The agent's address
+    port: `int`
+        The agent's port
+    token: `str`
+        The token the agent was given
+    size: `int`
+        The most connections to open, default 2
+    timeout: `float`
+        Seconds to wait when connecting, default 10
+    '''
+
+    def __init__(self, host: str, port: int, token: str, size: int = 2, timeout: float = 10):
+        self.host = host
+        self.port = port
+        self._token = token
+        self._size = max(1, size)
+        self._timeout = timeout
+        self._connections: List[RPCConnection] = []
+        self._connect_lock: Union[asyncio.Lock, None] = None
+
+    async def call(self, method: str, **params) -> Any:
+        '''Send a request on a pooled connection and wait for its result (see RPCConnection.call()).'''
+        return await (await self._get_connection()).call(method, **params)
+
+    async def stream(self, method: str, **params) -> RPCStream:
+        '''Open a stream on a pooled connection (see RPCConnection.stream()).'''
+        return await (await self._get_connection()).stream(method, **params)
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+
+    async def _get_connection(self) -> RPCConnection:
+        self._connections = [connection for connection in self._connections if not connection.is_closed()]
+        idle = [connection for connection in self._connections if connection.load() == 0]
+        if len(idle) > 0 or len(self._connections) >= self._size:
+            return min(self._connections, key=lambda connection: connection.load())
+        if self._connect_lock == None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:  # callers arriving while connecting wait for that connection instead of opening more
+            self._connections = [connection for connection in self._connections if not connection.is_closed()]
+            if len(self._connections) < self._size and all(connection.load() > 0 for connection in self._connections):
+                connection = await RPCConnection.open(self.host, self.port, self._token, self._timeout)
+                self._connections.append(connection)  # after opening, since the list may be replaced meanwhile
+        return min(self._connections, key=lambda connection: connection.load())
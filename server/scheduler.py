@@ -0,0 +1,221 @@
+'''
+Deadline scheduling for timed server events
+
+Classes
+-------
+Schedule
+    A compiled set of times, from SMTWRFD HHMM or cron expressions
+ScheduledJob
+    An action that runs on a schedule
+Scheduler
+    A heap of jobs ordered by their next fire time
+'''
+
+from typing import Awaitable, Callable, List, Set, Tuple, Union
+from datetime import datetime, timedelta
+import itertools
+import heapq
+import time
+
+
+class Schedule:
+    '''
+    A compiled set of local times, parsed once and then queried for the next time after a given moment.
+
+    Expressions may contain several entries separated by ";", and the schedule fires at the earliest of them.
+    Each entry is either of:
+        SMTWRFD HHMM - the days (from Sunday to Saturday) and 24 hour time, e.g. "MWF 1830"
+        minute hour day-of-month month day-of-week - a cron expression, e.g. "*/30 8-22 * * 1-5"
+    Cron fields accept *, numbers, ranges (a-b), lists (a,b) and steps (*/n, a-b/n). Day of week 0 and 7 are both Sunday.
+
+    Times are local wall clock times, so they keep firing at the same hour across daylight saving changes.
+    (A time skipped by the clocks going forward fires once the clock passes it.)
+
+    Parameters
+    ----------
+    expression: `str`
+        The schedule to compile, raises ValueError if it is invalid
+    '''
+
+    _DAY_LETTERS = "SMTWRFD"
+    _MAX_DAYS_SEARCHED = 366 * 8  # long enough to find the next Feb 29 on a matching weekday
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        # each entry is (minutes, hours, days of month, months, days of week (0 = Sunday), days of month restricted, days of week restricted)
+        self._entries: List[Tuple[List[int], List[int], Set[int], Set[int], Set[int], bool, bool]] = []
+        for entry in self.expression.split(";"):
+            entry = entry.strip()
+            if entry != "":
+                self._entries.append(self._compile_entry(entry))
+        if len(self._entries) == 0:
+            raise ValueError(f"Empty schedule: \"{expression}\"")
+
+    def __repr__(self) -> str:
+        return f"Schedule({self.expression!r})"
+
+    def _compile_entry(self, entry: str):
+        fields = entry.split()
+        if len(fields) == 2:  # SMTWRFD HHMM
+            days, hhmm = fields
+            if len(hhmm) != 4 or not hhmm.isdigit() or any(day not in self._DAY_LETTERS for day in days):
+                raise ValueError(f"Invalid SMTWRFD HHMM entry: \"{entry}\"")
+            hour, minute = int(hhmm[:2]), int(hhmm[2:])
+            if hour > 23 or minute > 59:
+                raise ValueError(f"Invalid time in entry: \"{entry}\"")
+            weekdays = {self._DAY_LETTERS.index(day) for day in days}
+            return ([minute], [hour], set(range(1, 32)), set(range(1, 13)), weekdays, False, True)
+        elif len(fields) == 5:  # cron
+            minutes = self._parse_cron_field(fields[0], 0, 59, entry)
+            hours = self._parse_cron_field(fields[1], 0, 23, entry)
+            month_days = self._parse_cron_field(fields[2], 1, 31, entry)
+            months = self._parse_cron_field(fields[3], 1, 12, entry)
+            weekdays = {day % 7 for day in self._parse_cron_field(fields[4], 0, 7, entry)}
+            return (sorted(minutes), sorted(hours), month_days, months, weekdays, fields[2] != "*", fields[4] != "*")
+        raise ValueError(f"Schedule entries must be \"SMTWRFD HHMM\" or a 5 field cron expression: \"{entry}\"")
+
+    def _parse_cron_field(self, field: str, low: int, high: int, entry: str) -> Set[int]:
+        values = set()
+        for part in field.split(","):
+            try:
+                if "/" in part:
+                    part, step_text = part.split("/")
+                    step = int(step_text)
+                else:
+                    step = 1
+                if part == "*":
+                    start, end = low, high
+                elif "-" in part:
+                    start, end = (int(value) for value in part.split("-"))
+                else:
+                    start = int(part)
+                    end = high if step > 1 else start
+            except ValueError:
+                raise ValueError(f"Invalid cron field \"{field}\" in \"{entry}\"")
+            if start < low or end > high or start > end or step <= 0:
+                raise ValueError(f"Cron field \"{field}\" out of range in \"{entry}\"")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def next_fire(self, after: float) -> float:
+        '''Get the first time (in epoch seconds) that this schedule fires strictly after the given time.'''
+        return min(self._entry_next_fire(entry, after) for entry in self._entries)
+
+    def _entry_next_fire(self, entry, after: float) -> float:
+        minutes, hours, month_days, months, weekdays, month_days_restricted, weekdays_restricted = entry
+        start = datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(self._MAX_DAYS_SEARCHED):
+            if day.month in months and self._day_matches(day, month_days, weekdays, month_days_restricted, weekdays_restricted):
+                for hour in hours:
+                    for minute in minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate < start:
+                            continue
+                        # mktime resolves the local wall time to an epoch, accounting for daylight saving
+                        fire_time = time.mktime(candidate.timetuple())
+                        if fire_time > after:
+                            return fire_time
+            day += timedelta(days=1)
+        raise ValueError(f"Schedule \"{self.expression}\" never fires.")
+
+    def _day_matches(self, day: datetime, month_days: Set[int], weekdays: Set[int],
+                     month_days_restricted: bool, weekdays_restricted: bool) -> bool:
+        weekday = (day.weekday() + 1) % 7
+        if month_days_restricted and weekdays_restricted:  # cron matches either when both are given
+            return day.day in month_days or weekday in weekdays
+        return day.day in month_days and weekday in weekdays
+
+
+class ScheduledJob:
+    '''
+    An action that runs on a schedule
+
+    Parameters
+    ----------
+    name: `str`
+        A name for logging, such as "backup"
+    action: `Callable[[], Awaitable]`
+        The coroutine function to run when the job fires
+    schedule: `Schedule`
+        When the job fires, or None for a job that fires once at a fixed time (see Scheduler.add_once)
+    offset: `float`
+        Seconds to shift every fire time by, e.g. -300 to fire 5 minutes before the schedule, default 0
+    '''
+
+    def __init__(self, name: str, action: Callable[[], Awaitable], schedule: Union[Schedule, None] = None, offset: float = 0):
+        self.name = name
+        self.action = action
+        self.schedule = schedule
+        self.offset = offset
+
+    def next_fire(self, after: float) -> Union[float, None]:
+        '''Get the next time this job fires strictly after the given time, or None if it does not repeat.'''
+        if self.schedule == None:
+            return None
+        return self.schedule.next_fire(after - self.offset) + self.offset
+
+
+class Scheduler:
+    '''
+    A heap of jobs ordered by their next fire time
+
+    Jobs are only run when run_due() is called, so the owner decides how to wait (see seconds_until_next()).
+    Repeating jobs are put back on the heap for their next time as they fire.
+    Jobs that were missed (e.g. while another job ran long) fire once, not once per missed time.
+    '''
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, ScheduledJob]] = []
+        self._counter = itertools.count()  # tiebreaker, jobs due at the same time run in the order added
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def clear(self):
+        '''Remove all jobs.'''
+        self._heap = []
+
+    def add(self, job: ScheduledJob, after: Union[float, None] = None):
+        '''Add a repeating job, first firing at its next time after the given time (default now).'''
+        fire_time = job.next_fire(time.time() if after == None else after)
+        if fire_time != None:
+            heapq.heappush(self._heap, (fire_time, next(self._counter), job))
+
+    def add_once(self, name: str, fire_time: float, action: Callable[[], Awaitable]):
+        '''Add a job that fires once at the given time.'''
+        heapq.heappush(self._heap, (fire_time, next(self._counter), ScheduledJob(name, action)))
+
+    def jobs(self) -> List[Tuple[float, ScheduledJob]]:
+        '''Get the pending (fire time, job) pairs, soonest first.'''
+        return [(fire_time, job) for fire_time, _, job in sorted(self._heap)]
+
+    def next_time(self) -> Union[float, None]:
+        '''The time the next job fires, or None if there are no jobs.'''
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][0]
+
+    def seconds_until_next(self, limit: Union[float, None] = None) -> Union[float, None]:
+        '''Seconds until the next job fires (0 if overdue), capped at limit, or limit if there are no jobs.'''
+        next_time = self.next_time()
+        if next_time == None:
+            return limit
+        seconds = max(0, next_time - time.time())
+        return seconds if limit == None else min(seconds, limit)
+
+    def pop_due(self, now: Union[float, None] = None) -> List[ScheduledJob]:
+        '''Remove and return the jobs due at the given time (default now), rescheduling the repeating ones.'''
+        now = time.time() if now == None else now
+        due_jobs = []
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            fire_time, _, job = heapq.heappop(self._heap)
+            due_jobs.append(job)
+            self.add(job, after=max(fire_time, now))
+        return due_jobs
+
+    async def run_due(self, should_run: Union[Callable[[], Awaitable[bool]], None] = None):
+        '''Run the jobs that are due, in order, skipping them if should_run is given and returns false.'''
+        for job in self.pop_due():
+            if should_run == None or await should_run():
+                await job.action()
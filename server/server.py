@@ -1,9 +1,18 @@
-from typing import Union, List
-import subprocess
-import threading
+from server.console_subscription import ConsoleSubscription, OverflowPolicy
+from server.console_parser import ConsoleParser, ConsoleRecord
+from server.console_history import ConsoleHistory
+from loguru import logger
+from typing import Callable, Dict, Set, Tuple, Union, List
 import asyncio
-import queue
+import codecs
+import time
 import os
+import re
+
+
+# "Steve joined the game", "Steve left the game" (chat is printed as "<Steve> ...", so it cannot match)
+PLAYER_PATTERN = re.compile(r"([A-Za-z0-9_]{1,16}) (joined|left) the game$")
+LISTENER_QUEUE_SIZE = 10000  # lines queued for an add_listener() listener before the oldest are dropped
 
 
 class ServerRunner:
@@ -21,6 +30,8 @@ class ServerRunner:
     args: `list[str]`
         A list of console arguments, such as -Xmx2G (You may need to add -server before some options)
         These arguments are parsed as java <args> -jar <jarname> -nogui
+    history_size: `int`
+        The number of recent console lines to keep in memory, default 10000
 
     Attributes
     ----------
@@ -28,98 +39,238 @@ class ServerRunner:
         The absolute path to the server directory containing the jar file
     server_name: `str`
         The name of the server being run (note that this is not necessarily read from the config file)
+    history: `ConsoleHistory`
+        Recent console records from the current (or most recent) server process
+    exit_time: `float`
+        The time.monotonic() at which the last server process exited, or None if none has
+    online_players: `Set[str]`
+        The names of the players currently online, according to the console
+    player_joins: `int`
+        The number of times a player has joined, across every server process run by this runner
     '''
 
-    def __init__(self, server_directory: str, executable: str = "java", jarname: str = "server.jar", args: List[str] = []):
+    _READ_CHUNK_SIZE = 65536
+
+    def __init__(self, server_directory: str, executable: str = "java", jarname: str = "server.jar", args: List[str] = [],
+                 history_size: int = 10000):
         self._is_ready = False
         self.server_directory = os.path.abspath(server_directory)
         self._executable = executable
         self._jarname = jarname
         self._args = args
-        self._server = None
-        self._listeners = set()
+        self._server: Union[asyncio.subprocess.Process, None] = None
+        self._log_listener: Union[asyncio.Task, None] = None
+        self._ready_event: Union[asyncio.Event, None] = None
+        self.exit_time: Union[float, None] = None
+        self._subscriptions: Set[ConsoleSubscription] = set()
+        self._listeners: Dict[object, ConsoleSubscription] = {}
+        self._listener_tasks: Dict[object, asyncio.Task] = {}
+        self.history = ConsoleHistory(history_size)
+        self._parser = ConsoleParser()
+        self._line_waiters: List[Tuple[Callable[[ConsoleRecord], bool], asyncio.Future]] = []
+        self.online_players: Set[str] = set()
+        self.player_joins = 0
 
     async def run(self):
         '''Alias to start.'''
         await self.start()
 
     async def start(self):
-        '''Start the server process if not already started.'''
+        '''
+        Start the server process if not already started.
+
+        The process and its log listener are attached to the running event loop, so this must be awaited from
+        the same loop as the rest of the program (e.g. the Discord client's).
+        '''
         if (self._server == None or not self.is_active()):
-            self._server = subprocess.Popen(f"{self._executable} {' '.join(self._args)} -jar {self._jarname} -nogui",
-                                            stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True, cwd=self.server_directory)
-            threading.Thread(target=self._start_async_log_listener, name="ServerLogListener", daemon=True).start()
+            self.history.clear()  # line numbers follow the new session's logs/latest.log
+            self._ready_event = asyncio.Event()
+            self._server = await asyncio.create_subprocess_exec(*self._get_command(), stdout=asyncio.subprocess.PIPE,
+                                                                stdin=asyncio.subprocess.PIPE, cwd=self.server_directory)
+            self._log_listener = asyncio.create_task(self._listen_for_logs(self._server))
 
-    def _start_async_log_listener(self):
-        asyncio.run(self._listen_for_logs())
+    def _get_command(self) -> List[str]:
+        '''Build the startup command, parsed as <executable> <args> -jar <jarname> -nogui.'''
+        return [self._executable, *[arg for arg in self._args if arg != ""], "-jar", self._jarname, "-nogui"]
 
-    async def _listen_for_logs(self):
+    async def _listen_for_logs(self, process: asyncio.subprocess.Process):
         '''
         Monitors stdout for logs, reporting them to listeners.
 
-        This function should only be called once per server thread.
+        Output is read in large chunks and split into lines here, rather than awaiting each line individually.
+        Partial lines are held until the rest arrives, and invalid UTF-8 is replaced rather than dropped.
+
+        This function should only be called once per server process.
         '''
-        while (self.is_active()):
-            try:
-                line = self._server.stdout.readline().decode().strip()  # type: ignore - also blocks until data exists
-            except ValueError:  # info->buf could be NUL
-                pass
-            else:
-                await self._update_listeners(line)
-                if not self._is_ready:
-                    await self._check_if_ready(line)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial_line = ""
+        while True:
+            chunk = await process.stdout.read(self._READ_CHUNK_SIZE)  # type: ignore
+            text = partial_line + decoder.decode(chunk, final=(chunk == b""))
+            lines = text.split("\n")
+            partial_line = lines.pop()
+            if chunk == b"" and partial_line != "":  # EOF, flush whatever is left of the last line
+                lines.append(partial_line)
+            for line in lines:
+                await self._handle_line(line.strip())
+            if chunk == b"":
+                break
+        await process.wait()
         # process is dead
-        self._is_ready = False
-        self._server = None
+        self.exit_time = time.monotonic()
+        self.online_players = set()
+        for _, waiter in self._line_waiters:  # the lines they wait for will never come
+            if not waiter.done():
+                waiter.set_result(None)
+        self._line_waiters = []
+        if self._server is process:
+            self._is_ready = False
+            self._server = None
+
+    async def _handle_line(self, line: str):
+        record = self._parser.parse(line)
+        self.history.append(record)
+        if len(self._line_waiters) > 0:
+            self._resolve_line_waiters(record)
+        await self._update_listeners(record)
+        if not self._is_ready:
+            await self._check_if_ready(record)
+        elif record.level == "INFO":
+            self._track_players(record)
 
-    async def _check_if_ready(self, msg: str):
-        if "INFO]: Done (" in msg:
-            self._is_ready = True
-        elif "INFO]: You need to agree to the EULA" in msg:
-            self.kill()
+    def expect_line(self, predicate: Callable[[ConsoleRecord], bool]) -> asyncio.Future:
+        '''
+        Get a future resolved with the next console record that predicate returns true for, or None if the server exits first.
 
-    async def _update_listeners(self, msg: str):
-        for listener in self._listeners:
-            listener.update(msg)
+        Call this before writing the command that should print the line, so that the line cannot be missed.
+        Cancel the future (e.g. with asyncio.wait_for's timeout) to stop waiting.
+        '''
+        waiter = asyncio.get_running_loop().create_future()
+        self._line_waiters.append((predicate, waiter))
+        return waiter
+
+    def _resolve_line_waiters(self, record: ConsoleRecord):
+        remaining = []
+        for predicate, waiter in self._line_waiters:
+            if waiter.done():  # cancelled or timed out
+                continue
+            if predicate(record):
+                waiter.set_result(record)
+            else:
+                remaining.append((predicate, waiter))
+        self._line_waiters = remaining
+
+    def _track_players(self, record: ConsoleRecord):
+        match = PLAYER_PATTERN.match(record.message)
+        if match != None:
+            if match.group(2) == "joined":
+                self.online_players.add(match.group(1))
+                self.player_joins += 1
+            else:
+                self.online_players.discard(match.group(1))
+
+    async def _check_if_ready(self, record: ConsoleRecord):
+        if record.level == "INFO":
+            if record.message.startswith("Done ("):
+                self._is_ready = True
+                self._ready_event.set()  # type: ignore
+            elif record.message.startswith("You need to agree to the EULA"):
+                self.kill()
+
+    async def _update_listeners(self, msg: ConsoleRecord):
+        '''Queue a record for every subscriber. Waits only if a subscriber with OverflowPolicy.BLOCK is full.'''
+        self._start_listener_pumps()
+        for subscription in list(self._subscriptions):
+            await subscription.put(msg)
+
+    def subscribe(self, maxsize: int = 1000, policy: OverflowPolicy = OverflowPolicy.BLOCK, max_batch: int = 100) -> ConsoleSubscription:
+        '''
+        Subscribe to messages in the server console, returning a queue to read them from in batches of ConsoleRecords.
+
+        Each subscription has its own bounded queue, so a slow subscriber only affects others if its policy is BLOCK.
+        See ConsoleSubscription for the parameters.
+        '''
+        subscription = ConsoleSubscription(maxsize, policy, max_batch)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ConsoleSubscription):
+        '''Stop queueing messages for a subscription. Messages already queued can still be read.'''
+        self._subscriptions.discard(subscription)
+        subscription.close()
+
+    def subscription_stats(self) -> List[Dict[str, int]]:
+        '''Get the lag (queued lines), dropped, coalesced, and delivered counts of each subscription.'''
+        return [{"lag": subscription.lag(), "dropped": subscription.dropped, "coalesced": subscription.coalesced,
+                 "delivered": subscription.delivered} for subscription in self._subscriptions]
 
     def add_listener(self, listener_object):
         '''
-        Subscribe the given object to be notified on this thread whenever there is a new message in the server console.
+        Subscribe the given object to be notified whenever there is a new message in the server console.
 
         The subscriber must contain the function "update(self, message: `str`)", otherwise throws AttributeError when adding listener.
+        Messages are delivered from the listener's own subscription queue on the event loop, never on the console reader.
+        A listener that falls more than LISTENER_QUEUE_SIZE lines behind misses the oldest of them, and one whose update()
+        raises only misses that message.
         '''
         try:
             listener_object.update(f"Subscribed to server logs.")
         except (AttributeError, TypeError):
             raise AttributeError("Listener does not contain update(self, message: str) attribute.")
         else:
-            self._listeners.add(listener_object)
+            if listener_object not in self._listeners:
+                self._listeners[listener_object] = self.subscribe(maxsize=LISTENER_QUEUE_SIZE, policy=OverflowPolicy.DROP_OLDEST)
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:  # no loop yet, starts with the first message
+                    pass
+                else:
+                    self._start_listener_pumps()
 
     def remove_listener(self, listener_object):
-        '''Unsubscribes an object from updates.'''
-        try:
-            self._listeners.remove(listener_object)
-        except KeyError:
-            pass
-        else:
-            try:
+        '''Unsubscribes an object from updates, after it has been sent the messages already queued for it.'''
+        subscription = self._listeners.pop(listener_object, None)
+        if subscription != None:
+            self.unsubscribe(subscription)
+            if listener_object not in self._listener_tasks:  # never started, so nothing will send the final message
                 listener_object.update(f"Unsubscribed from server logs.")
-            except (AttributeError, TypeError):
-                raise AttributeError("Listener does not contain update(self, message: str) attribute.")
+
+    def _start_listener_pumps(self):
+        for listener_object, subscription in self._listeners.items():
+            if listener_object not in self._listener_tasks:
+                self._listener_tasks[listener_object] = asyncio.ensure_future(self._pump_listener(listener_object, subscription))
+
+    async def _pump_listener(self, listener_object, subscription: ConsoleSubscription):
+        try:
+            async for batch in subscription:
+                for msg in batch:
+                    self._notify_listener(listener_object, str(msg))
+            self._notify_listener(listener_object, f"Unsubscribed from server logs.")
+        finally:  # so a listener added again gets a new pump
+            self._listener_tasks.pop(listener_object, None)
+
+    def _notify_listener(self, listener_object, message: str):
+        try:
+            listener_object.update(message)
+        except Exception:  # one failing message must not stop the listener's pump, or its queue would never drain
+            logger.exception(f"Console listener {listener_object!r} failed to handle a message")
 
     def is_active(self) -> bool:
-        '''Check if the server's thread is currently active (not necessarily that the server is running).'''
-        return self._server != None and self._server.poll() == None
+        '''Check if the server's process is currently active (not necessarily that the server is running).'''
+        return self._server != None and self._server.returncode == None
 
     def is_ready(self) -> bool:
         '''Check if the server is currently started, i.e. players are able to join.'''
         return self._is_ready
 
     def write(self, command: str):
-        '''Write a single line command to the server console. Newline automatically appended.'''
+        '''
+        Write a single line command to the server console. Newline automatically appended.
+
+        This does not block: the command is buffered by the event loop and written as the pipe accepts it.
+        '''
         try:
             self._server.stdin.write(bytes(f"{command}\n", "utf-8"))  # type: ignore
-            self._server.stdin.flush()  # type: ignore
         except Exception as e:
             return f"Write failed: {e}"
 
@@ -127,18 +278,44 @@ class ServerRunner:
         '''
         Stop the server, ALWAYS call this before closing the server (unless you've sent stop via rcon).
 
-        Note that is_restarting only changes the message that users see, and does not actually restart.
+        This only sends the stop command, use wait() to wait for the process to actually exit.
         '''
         try:
-            self._server.stdin.flush()  # type: ignore
-            self._server.communicate(b"stop\n", timeout=5)  # type: ignore
+            self._server.stdin.write(b"stop\n")  # type: ignore
         except Exception as e:
             return f"Stop command failed: {e} \t(Server may already be offline.)"
         finally:
             self._is_ready = False
 
+    async def wait(self, timeout: Union[float, None] = None) -> bool:
+        '''
+        Wait until the server process exits and its remaining output has been read, or the timeout expires.
+
+        Returns true if the server is no longer running.
+        '''
+        if self._log_listener == None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._log_listener), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait_until_ready(self, timeout: Union[float, None] = None) -> bool:
+        '''
+        Wait until the server is ready, it exits, or the timeout expires.
+
+        Returns true if the server is ready.
+        '''
+        if self._ready_event == None or self._log_listener == None or self._log_listener.done():
+            return self._is_ready
+        ready_waiter = asyncio.ensure_future(self._ready_event.wait())
+        await asyncio.wait({ready_waiter, self._log_listener}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        ready_waiter.cancel()
+        return self._is_ready
+
     def kill(self):
         '''Kills the server process. DO NOT RUN THIS UNLESS YOU ABSOLUTELY HAVE TO.'''
-        if self._server != None:
+        if self._server != None and self._server.returncode == None:
             self._server.kill()
         self._is_ready = False
@@ -1,9 +1,29 @@
 from config.configs import MCPropertiesParser, ObsidiaConfigParser
+from server.console_history import ConsoleLogView
+from server.backups.region_delta import DELTA_SUFFIX, referenced_chunks
+from server.backups.incremental import fingerprint_trees, load_hashes, save_hashes
+from server.backups.archive import ARCHIVE_SUFFIXES, ArchiveReader, archive_files, archive_name, write_archive
+from server.backups.repository import BackupRepository, RepositorySnapshot
+from server.backups.catalog import BackupCatalog, CatalogEntry
+from server.backups.snapshot import SnapshotCopier
+from server.backups.trash import BackupTrash
+from server.backups.throttle import Throttle, is_overload_warning, parse_mspt
+from server.backups.replication import Replicator
+from server.backups.s3 import S3Client, S3Error
+from server.backups import partial
+from server.backups.chunk_pool import ChunkPool
+from server.backups.copier import CopyEngine, probe_reflink
+from server.console_parser import ConsoleRecord
+from server.console_subscription import OverflowPolicy
 from server.server import ServerRunner
-from typing import Union, List
+from server.scheduler import Schedule, ScheduledJob, Scheduler
+from loguru import logger
+from typing import Callable, Dict, Sequence, Tuple, Union, List
 from datetime import datetime
+import functools
 import asyncio
 import shutil
+import json
 import time
 import os
 
@@ -18,6 +38,8 @@ class ServerManager:
         The directory of the server, the server's jar and server.properties should be one layer below (e.g. server_directory/server.jar)
     config_file: `str`
         The basename of the config file for the server manager, default "obsidia.conf"
+    copy_engine: `CopyEngine`
+        The workers to copy backups on, shared with other managers in the same process, default a new engine for this manager
 
     Attributes
     ----------
@@ -28,16 +50,42 @@ class ServerManager:
         The config file in use
     server_directory: `str`
         The absolute path to the server directory containing the jar file
+    last_restart_latency: `float`
+        Seconds from the last crash being detected to the restarted server being ready, or None if there hasn't been one
     '''
 
-    def __init__(self, server_directory: str, config_file: str = "obsidia.conf"):
+    def __init__(self, server_directory: str, config_file: str = "obsidia.conf", copy_engine: Union[CopyEngine, None] = None):
         self.server_directory = os.path.abspath(server_directory)
         self.config_file = config_file
         self._server_should_be_running = False
         self._save_is_off = False
         self._doing_backup = False
+        self._chunk_gc_pending = False
+        self._chunk_gc_task: Union[asyncio.Future, None] = None
+        self._chunk_lock: Union[asyncio.Lock, None] = None
+        self._catalog: Union[BackupCatalog, None] = None
+        self._catalog_rebuild: Union[asyncio.Future, None] = None
+        self._trash: Union[BackupTrash, None] = None
+        self._replicator: Union[Replicator, None] = None
+        self._replicator_settings: Union[Tuple, None] = None
+        self._replication_task: Union[asyncio.Future, None] = None
+        self._replication_requested = False
+        self._remote_backups: Dict[str, Dict] = {}
+        self._remote_backups_time: Union[float, None] = None
+        self._reflink_support: Dict[Tuple[int, int], bool] = {}
+        self._staged_restore: Union[List[str], None] = None
+        self._swap_restore_on_start = False
+        self._restore_swapped: Union[asyncio.Future, None] = None
+        self._players_at_last_backup: Union[Tuple[int, bool], None] = None
+        self._scheduler = Scheduler()
+        self.last_restart_latency: Union[float, None] = None
+        self._restart_latency_task: Union[asyncio.Future, None] = None
         self._reset_server_startup_vars()
-        self.server = ServerRunner(self.server_directory, executable=self._executable, jarname=self._server_jar, args=self._args)  # type: ignore
+        if copy_engine == None:
+            copy_engine = CopyEngine(self._backup_workers, idle_priority=self._backup_idle_priority)
+        self._copy_engine = copy_engine
+        self.server = ServerRunner(self.server_directory, executable=self._executable, jarname=self._server_jar, args=self._args,  # type: ignore
+                                   history_size=self._console_history_size)
 
     def _reset_server_startup_vars(self):
         '''Initial vars are those that need to be reset every time the server is launched.'''
@@ -65,6 +113,10 @@ class ServerManager:
         self._is_autorestarting = True
         return self.server.stop()
 
+    async def wait_for_server_exit(self, timeout: Union[float, None] = None) -> bool:
+        '''Wait until the server process exits or the timeout expires. Returns true if the server is no longer running.'''
+        return await self.server.wait(timeout)
+
     async def start_server(self):
         '''
         Runs the server and monitors it for crashing/backups/etc.
@@ -76,8 +128,12 @@ class ServerManager:
         '''
         self._server_should_be_running = True
         self._reset_server_startup_vars()
+        self._queue_replication()  # resume any uploads interrupted by the last shutdown
         await self._spawn_server()
-        await self._running_loop()
+        try:
+            await self._running_loop()
+        finally:
+            self._cancel_restart_latency_report()
         await self._update_server_listeners("Server shut down")
 
     def clean_up_keyboard_interrupt(self):
@@ -88,37 +144,32 @@ class ServerManager:
         '''
         self.stop_server()
         self._server_should_be_running = False
+        self._cancel_restart_latency_report()
 
     async def _spawn_server(self):
+        if self._swap_restore_on_start:  # a restore was staged while the server ran, swap it in while it is down
+            swapped = self._restore_swapped
+            try:
+                await self._run_blocking(self._swap_in_staged_restore)
+            except OSError as e:
+                await self._update_server_listeners(f"Failed to swap in the restored backup, the worlds were left as they were: {e}")
+                if swapped != None and not swapped.done():
+                    swapped.set_exception(e)
+            else:
+                await self._update_server_listeners("Restoration complete")
+                if swapped != None and not swapped.done():
+                    swapped.set_result(None)
         self._server_start_time = self._get_current_time()
         await self.server.start()
 
     async def _running_loop(self):
         while (self.server_should_be_running()):
-            time_until_restart = self._get_offset_until(self._autorestart_datetime)
-            time_until_backup = self._get_offset_until(self._backup_datetime)
+            self._schedule_events()
             while (await self.server_running()):
-                await asyncio.sleep(5)  # longer causes high delay between server shutdown and server appearing shut down in _server_should_be_running
-
-                if self._do_autorestart and not self._doing_backup:
-                    new_time_until_restart = self._get_offset_until(self._autorestart_datetime)
-                    if new_time_until_restart > time_until_restart:  # passed timestamp, it's sending next occurrence
-                        self.write("say Restarting now!")
-                        self._is_autorestarting = True
-                        self.server.stop()
-                    elif new_time_until_restart <= 60 and time_until_restart > 60:
-                        self.write("say Restarting in 60 seconds!")
-                    elif new_time_until_restart <= 300 and time_until_restart > 300:
-                        self.write("say Restarting in 5 minutes.")
-                    elif new_time_until_restart <= 900 and time_until_restart > 900:
-                        self.write("say Restarting in 15 minutes.")
-                    time_until_restart = new_time_until_restart
-
-                if self._do_backups:
-                    new_time_until_backup = self._get_offset_until(self._backup_datetime)
-                    if new_time_until_backup > time_until_backup:  # passed timestamp, it's sending next occurrence
-                        await self.backup_world()
-                    time_until_backup = new_time_until_backup
+                # sleep until the next job is due, waking immediately if the server exits
+                # (capped so that changes to the system clock are noticed within the hour)
+                await self.server.wait(self._scheduler.seconds_until_next(limit=3600))
+                await self._scheduler.run_due(should_run=self.server_running)
 
                 if self._save_is_off and not self._doing_backup:  # edge case for backing up as server shuts down
                     self.set_saving(True)
@@ -130,129 +181,966 @@ class ServerManager:
                     self._reset_server_startup_vars()
                     await self._spawn_server()
                 elif self._restart_on_crash and not self._sent_stop_signal:
+                    crash_time = self.server.exit_time
                     await self._update_server_listeners("Detected server crash: Restarting")
                     self._reset_server_startup_vars()
                     await self._spawn_server()
+                    self._cancel_restart_latency_report()  # the last crash's restart never became ready
+                    self._restart_latency_task = asyncio.ensure_future(self._report_restart_latency(crash_time))
                 else:
                     self._server_should_be_running = False
+            else:  # a backup is copying as the server went down, let it finish before deciding
+                await asyncio.sleep(1)
+
+    def _schedule_events(self):
+        '''Put the restart warnings, restart, backup, and scheduled commands from the current configs on the scheduler.'''
+        self._scheduler.clear()
+        if self._do_autorestart and self._autorestart_schedule != None:
+            for warning_offset, warning in ((900, "say Restarting in 15 minutes."), (300, "say Restarting in 5 minutes."), (60, "say Restarting in 60 seconds!")):
+                self._scheduler.add(ScheduledJob("restart warning", functools.partial(self._send_command, warning),
+                                                 self._autorestart_schedule, offset=-warning_offset))
+            self._scheduler.add(ScheduledJob("restart", self._autorestart, self._autorestart_schedule))
+        if self._do_backups and self._backup_schedule != None:
+            self._scheduler.add(ScheduledJob("backup", self._scheduled_backup, self._backup_schedule))
+        for job in self._scheduled_jobs:
+            self._scheduler.add(job)
+
+    async def _send_command(self, command: str):
+        self.write(command)
+
+    async def _autorestart(self):
+        if self._doing_backup:  # try again once the backup finishes
+            self._scheduler.add_once("restart", time.time() + 5, self._autorestart)
+            return
+        self.write("say Restarting now!")
+        self._is_autorestarting = True
+        self.server.stop()
+
+    async def _report_restart_latency(self, crash_time: Union[float, None]):
+        '''Report how long it took from the crash being detected to the server being ready for players again.'''
+        if crash_time == None:
+            return
+        spawn_latency = time.monotonic() - crash_time
+        if await self.server.wait_until_ready():
+            self.last_restart_latency = time.monotonic() - crash_time
+            await self._update_server_listeners(f"Restarted after crash: process started in {spawn_latency:.2f}s, "
+                                                f"ready in {self.last_restart_latency:.2f}s")
+
+    def _cancel_restart_latency_report(self):
+        if self._restart_latency_task != None:
+            self._restart_latency_task.cancel()
+            self._restart_latency_task = None
 
     def _get_current_time(self) -> int:
         return int(time.time())
 
-    def _get_offset_until(self, timestamp: Union[str, None]) -> int:
-        '''Parse SMTWRFD HHMM timestamp and check how far away it is from now, in seconds.'''
-        if timestamp == None:
-            return -1
-        offset = 0
-        current_time = datetime.now()
-        timestamp_parts = timestamp.split(" ")
-        days = timestamp_parts[0]
-        hour = int(timestamp_parts[1][:2])
-        mins = int(timestamp_parts[1][2:])
-        offset += (hour - current_time.hour) * 3600
-        offset += (mins - current_time.minute) * 60
-        offset -= current_time.second
-        current_day_num = (current_time.weekday() + 1) % 7
-        for i in range(14 - current_day_num):  # 14 not 7 because we have to account for wrapping if we skip the one day a week it runs
-            # check offset < 0 because we need to skip if we already passed the timestamp on the first day checked (today)
-            if "SMTWRFDSMTWRFD"[current_day_num + i] not in days or offset < 0:
-                offset += 86400
-            else:
-                break
-        return offset
-
     async def backup_world(self, backup_name: Union[str, None] = None):
         '''
         Creates a backup of the world in the backup directory.
 
         If backup_name is not set, then it will use a timestamp and delete old backups to maintain max.
         If it is set, then that name will be used (after checking that it isn't already in use!).
+
+        Autosaving is only turned off for the snapshot itself: the server is told to save-all flush, and the snapshot starts once
+        it confirms the save (or the save_flush_timeout passes). How long autosaving was off for is reported with the result.
         '''
         # if we save-off/save-on while changing state, it's possible to permanently disable saving until the next backup
-        while self.server_should_be_running() and not self.server.is_ready() and await self.server_running():
+        if self.server_should_be_running() and not self.server.is_ready() and await self.server_running():
             await self._update_server_listeners("Waiting for world backup (server changing state)")
-            await asyncio.sleep(3)
-        self._doing_backup = True
+            await self.server.wait_until_ready()
         os.makedirs(self.backup_directory, exist_ok=True)
-        # turn off autosaving while doing the backup to prevent conflicts
-        self.set_saving(False)
-        await self._update_server_listeners("Backing up world")
-        # timestamp backup
-        if backup_name == None:
-            if self._max_backups > 0:
-                # hacky way to check which backups were created automatically and use the timestamp name
-                backup_list = self.list_backups()
-                total_backups = 0
-                oldest_backup = 1000000000000000000000  # eh good enough
-                for backup in backup_list:
-                    try:
-                        backup = int(backup)
-                    except:
-                        pass
-                    else:
-                        oldest_backup = min(backup, oldest_backup)
-                        total_backups += 1
-                if total_backups >= self._max_backups:
-                    self._delete_world(os.path.join(self.backup_directory, f"{oldest_backup}"))
-            backup_dir = os.path.join(self.backup_directory, f"{self._get_current_time()}")
+        await self.load_backup_catalog()
         # named backup
-        else:
+        if backup_name != None:
             backup_name = backup_name.strip()
-            if backup_name in os.listdir(self.backup_directory):
+            if backup_name.startswith("."):
+                await self._update_server_listeners("Failed to back up world: Backup names cannot start with \".\"")
+                return "Failed to back up world: Backup names cannot start with \".\""
+            if backup_name in self.list_backups() or self.get_backup_path(backup_name) != None:
                 await self._update_server_listeners("Failed to back up world: A backup with that name already exists")
                 return "Failed to back up world: A backup with that name already exists"
+        async with self._get_chunk_lock():  # chunk garbage collection waits until this backup is in the catalog
+            failure = await self._take_backup(backup_name)
+        if self._chunk_gc_pending:
+            await self._collect_chunk_garbage()
+        if failure != None:
+            return failure
+        self._queue_replication()
+
+    async def _take_backup(self, backup_name: Union[str, None]) -> Union[str, None]:
+        '''Take the backup and add it to the catalog, returning why it failed (or None). Hold the chunk lock while calling this.'''
+        self._doing_backup = True
+        await self._update_server_listeners("Backing up world")
+        details = []
+        tick_watcher = None
+        try:
+            # timestamp backup
+            if backup_name == None:
+                backup_dir = os.path.join(self.backup_directory, f"{self._get_current_time()}")
             else:
                 backup_dir = os.path.join(self.backup_directory, backup_name)
-        try:
-            for world in self._worlds:
-                self._copy_world(os.path.join(self.server_directory, world), os.path.join(backup_dir, world))
+            # turn off autosaving while taking the snapshot to prevent conflicts, after flushing pending saves
+            server_was_ready = self.server.is_ready()
+            players = (self.server.player_joins, len(self.server.online_players) > 0)
+            throttle = self._make_backup_throttle()
+            if throttle != None and self._throttle_adaptive and server_was_ready:
+                tick_watcher = asyncio.ensure_future(self._watch_tick_rate(throttle))
+            save_off_time = time.monotonic()
+            self.set_saving(False)
+            flush_seconds = await self._flush_world_saves()
+            fingerprint = await self._run_blocking(self._fingerprint_worlds) if self._skip_unchanged == "files" else None
+            snapshot_start = time.monotonic()
+            if self._backup_format == "archive":
+                archive_size = await self._archive_worlds_to_backup(backup_dir, throttle)
+                details.append(f"{archive_size / 1048576:.1f} MiB {self._archive_compression} archive")
+            elif self._backup_format == "repository":
+                snapshot = await self._store_worlds_in_repository(os.path.basename(backup_dir), throttle)
+                details.append(f"{snapshot.files_unchanged} unchanged files reused, {snapshot.chunks_stored} chunks stored, "
+                               f"{snapshot.chunks_reused} unchanged chunks reused")
+            else:
+                previous_backup = self._get_latest_backup() if self._incremental_backups or self._region_delta_backups else None
+                copier = await self._copy_worlds_to_backup(backup_dir, previous_backup, throttle)
+                if copier.cloned > 0:
+                    details.append(f"{copier.cloned} files cloned with reflinks")
+                if self._incremental_backups:
+                    details.append(f"{copier.copied} files copied, {copier.linked} unchanged files linked")
+                if self._region_delta_backups:
+                    details.append(f"{copier.chunks_stored} chunks stored, {copier.chunks_reused} unchanged chunks reused")
+            snapshot_seconds = time.monotonic() - snapshot_start
+            if throttle != None and throttle.waited > 0:
+                details.append(f"throttled for {throttle.waited:.1f}s across workers")
+            # turn back on autosaving
+            # NOTE: should probably save the initial state of it and set it back to that, rather than forcing it on (config?)
+            self.set_saving(True)
+            if server_was_ready:
+                flush_text = f"flush {flush_seconds:.2f}s" if flush_seconds != None else "flush not confirmed"
+                details.append(f"autosave off for {time.monotonic() - save_off_time:.2f}s: {flush_text}, snapshot {snapshot_seconds:.2f}s")
+            entry = await self._run_blocking(self._describe_backup, os.path.basename(backup_dir))
         except Exception as e:
             await self._update_server_listeners(f"Failed to back up world: {e}")
             return f"Failed to back up world: {e}"
-        # turn back on autosaving
-        # NOTE: should probably save the initial state of it and set it back to that, rather than forcing it on (config?)
-        self.set_saving(True)
-        self._doing_backup = False
-        await self._update_server_listeners("Backup completed")
+        finally:
+            if tick_watcher != None:
+                tick_watcher.cancel()
+            if self._save_is_off:
+                self.set_saving(True)
+            self._doing_backup = False
+        entry.origin = "scheduled" if backup_name == None else "named"
+        entry.created = time.time()
+        entry.fingerprint = fingerprint
+        entry.replication = "pending" if self._replicate else None
+        self._get_catalog().add(entry)
+        self._players_at_last_backup = players
+        if backup_name == None:
+            self._prune_scheduled_backups()
+        await self._update_server_listeners("Backup completed" + (f" ({'; '.join(details)})" if len(details) > 0 else ""))
+
+    def _prune_scheduled_backups(self):
+        '''
+        Delete the oldest scheduled backup if there are more than max_backups. This runs after the new backup is taken,
+        so that the backup it replaces could still be the base the new one linked its unchanged files and chunks to.
+        '''
+        if self._max_backups <= 0:
+            return
+        scheduled_backups = [entry for entry in self._get_catalog().entries() if entry.origin == "scheduled"]  # oldest first
+        if len(scheduled_backups) > self._max_backups:
+            self._delete_backup_files(scheduled_backups[0].name)
+            self._get_catalog().remove(scheduled_backups[0].name)
+            self._chunk_gc_pending = True  # collected once the chunk lock is released
+            # (for repository snapshots, deleting is only dropping the manifest, the collection frees the space)
+
+    def _make_backup_throttle(self) -> Union[Throttle, None]:
+        '''Get a throttle for a backup's workers from the throttle settings, or None if backups are not throttled.'''
+        if self._throttle_bandwidth <= 0 and self._throttle_iops <= 0 and not self._throttle_adaptive:
+            return None
+        return Throttle(self._throttle_bandwidth * 1048576, self._throttle_iops)
+
+    async def _watch_tick_rate(self, throttle: Throttle, interval: float = 5):
+        '''
+        Slow a backup's throttle down while the server struggles to keep its tick rate, and speed it back up once it recovers.
+
+        Every interval, the throttle is slowed if the console reported "Can't keep up!", or an MSPT reading (from sending
+        throttle_mspt_command) rose well above the first reading, and sped up otherwise. Runs until cancelled.
+        '''
+        subscription = self.server.subscribe(maxsize=100, policy=OverflowPolicy.DROP_OLDEST)
+        baseline_mspt = None
+        try:
+            while True:
+                if self._throttle_mspt_command != "":
+                    self.write(self._throttle_mspt_command)
+                struggling = False
+                deadline = time.monotonic() + interval
+                while time.monotonic() < deadline:
+                    try:
+                        batch = await asyncio.wait_for(subscription.get_batch(), deadline - time.monotonic())
+                    except asyncio.TimeoutError:
+                        break
+                    if len(batch) == 0:  # unsubscribed
+                        return
+                    for record in batch:
+                        if is_overload_warning(record.message):
+                            struggling = True
+                        mspt = parse_mspt(record.message)
+                        if mspt != None:
+                            if baseline_mspt == None:
+                                baseline_mspt = mspt
+                            elif mspt > max(baseline_mspt * 1.5, baseline_mspt + 5) or mspt > 45:  # 50ms is a full tick
+                                struggling = True
+                previous_slowdown = throttle.slowdown
+                if struggling:
+                    throttle.slow_down()
+                else:
+                    throttle.speed_up()
+                if throttle.slowdown != previous_slowdown and (struggling or throttle.slowdown == 1):
+                    await self._update_server_listeners("Server is struggling, slowing the backup down" if struggling
+                                                        else "Server has recovered, backing up at full speed")
+        finally:
+            self.server.unsubscribe(subscription)
+
+    async def _scheduled_backup(self):
+        '''Take a timestamped backup, unless skip_unchanged finds that the world has not changed since the last backup.'''
+        reason = await self._backup_skip_reason()
+        if reason != None:
+            await self._update_server_listeners(f"Skipping scheduled backup: {reason}")
+            return
+        await self.backup_world()
+
+    async def _backup_skip_reason(self) -> Union[str, None]:
+        '''Get why the world is unchanged since the latest backup, or None if it may have changed (or skip_unchanged is off).'''
+        if self._skip_unchanged == "players":
+            if self._players_at_last_backup == None:
+                return None  # nothing is known about the players before this manager's first backup
+            joins, anyone_was_online = self._players_at_last_backup
+            if joins == self.server.player_joins and not anyone_was_online and len(self.server.online_players) == 0:
+                return "no players have been online since the last backup"
+        elif self._skip_unchanged == "files":
+            latest = self._get_catalog().entries()
+            if len(latest) == 0 or latest[-1].fingerprint == None:
+                return None
+            if self.server.is_ready():
+                await self._flush_world_saves()  # so changes still in memory reach the files
+            if await self._run_blocking(self._fingerprint_worlds) == latest[-1].fingerprint:
+                return f"no world files have changed since backup {latest[-1].name}"
+        return None
+
+    def _fingerprint_worlds(self) -> str:
+        return fingerprint_trees([(os.path.join(self.server_directory, world), world) for world in self._worlds])
+
+    async def _flush_world_saves(self) -> Union[float, None]:
+        '''
+        Have the server write the world to disk with save-all flush, and wait for it to confirm the save.
+
+        Returns the seconds it took, 0 if the server is not running, or None if it did not confirm within save_flush_timeout.
+        '''
+        if not self.server.is_ready():
+            return 0
+        start = time.monotonic()
+        saved = self.server.expect_line(lambda record: record.message.startswith(("Saved the game", "Saved the world")))
+        self.write("save-all flush")
+        try:
+            record = await asyncio.wait_for(saved, self._save_flush_timeout)
+        except asyncio.TimeoutError:
+            await self._update_server_listeners(f"Server did not confirm saving within {self._save_flush_timeout}s, backing up anyway")
+            return None
+        if record == None:  # the server stopped, which saves the world anyway
+            return None
+        return time.monotonic() - start
+
+    async def _copy_worlds_to_backup(self, backup_dir: str, previous_backup: Union[str, None],
+                                     throttle: Union[Throttle, None] = None) -> SnapshotCopier:
+        '''
+        Copy every world into backup_dir on the copy engine's workers, returning the copier for its counts.
+
+        With incremental backups, files unchanged since previous_backup are hard linked to it instead of copied.
+        With region delta backups, region files are stored as chunk manifests, only storing chunks changed since previous_backup.
+        '''
+        verify = self._verify_incremental_backups
+        copier = SnapshotCopier(link_unchanged=self._incremental_backups, verify_hash=verify,
+                                previous_hashes=await self._run_blocking(load_hashes, previous_backup) if verify else None,
+                                region_pool=self._get_chunk_pool() if self._region_delta_backups else None,
+                                reflink=await self._run_blocking(self._can_reflink, self.server_directory, self.backup_directory),
+                                throttle=throttle)
+        trees = []
+        for world in self._worlds:
+            previous_world = os.path.join(previous_backup, world) if previous_backup != None else None
+            trees.append((os.path.join(self.server_directory, world), os.path.join(backup_dir, world), previous_world, f"{world}/"))
+        await self._copy_engine.copy_trees(trees, copier.copy_file, progress=functools.partial(self._report_copy_progress, "Backing up world"),
+                                           throttle=throttle)
+        if verify:
+            await self._run_blocking(save_hashes, backup_dir, copier.new_hashes)
+        return copier
+
+    def _can_reflink(self, source_directory: str, destination_directory: str) -> bool:
+        '''Whether files can be cloned with reflinks between the directories, probed once per pair of filesystems.'''
+        if not self._use_reflinks:
+            return False
+        os.makedirs(destination_directory, exist_ok=True)
+        devices = (os.stat(source_directory).st_dev, os.stat(destination_directory).st_dev)
+        if devices not in self._reflink_support:
+            try:
+                self._reflink_support[devices] = probe_reflink(source_directory, destination_directory)
+            except OSError:  # e.g. no permission to write the probe files
+                self._reflink_support[devices] = False
+        return self._reflink_support[devices]
+
+    async def _archive_worlds_to_backup(self, backup_dir: str, throttle: Union[Throttle, None] = None) -> int:
+        '''Write every world into a compressed archive named after backup_dir (on a copy engine worker), returning the archive's size.'''
+        loop = asyncio.get_running_loop()
+
+        def report_progress(*counts):  # called from the archiving thread
+            asyncio.run_coroutine_threadsafe(self._report_copy_progress("Backing up world", *counts), loop)
+
+        sources = [(os.path.join(self.server_directory, world), world) for world in self._worlds]
+        return await self._copy_engine.run(functools.partial(write_archive, backup_dir + ARCHIVE_SUFFIXES[self._archive_compression], sources,
+                                                             self._archive_compression, self._archive_level, self._backup_workers,
+                                                             progress=report_progress, throttle=throttle))
+
+    async def _store_worlds_in_repository(self, name: str, throttle: Union[Throttle, None] = None) -> RepositorySnapshot:
+        '''Store every world as a snapshot in the backup repository, returning the snapshot for its counts.'''
+        repository = self._get_repository()
+        snapshot = await self._run_blocking(repository.begin_snapshot, name, throttle)
+        trees = []
+        for world in self._worlds:
+            world_dir = os.path.join(self.server_directory, world)
+            await self._run_blocking(snapshot.add_directories, world_dir, world)
+            trees.append((world_dir, None, None, f"{world}/"))
+        await self._copy_engine.copy_trees(trees, snapshot.add_file, progress=functools.partial(self._report_copy_progress, "Backing up world"),
+                                           throttle=throttle)
+        await self._run_blocking(snapshot.commit)
+        return snapshot
+
+    async def _report_copy_progress(self, action: str, files_done: int, total_files: int, bytes_done: int, total_bytes: int):
+        percent = 100 * bytes_done // total_bytes if total_bytes > 0 else 100
+        await self._update_server_listeners(f"{action}: {percent}% ({files_done}/{total_files} files)")
+
+    def _get_chunk_pool(self) -> ChunkPool:
+        return ChunkPool(os.path.join(self.backup_directory, ".chunks"))
+
+    def _get_repository(self) -> BackupRepository:
+        return BackupRepository(os.path.join(self.backup_directory, ".repository"))
+
+    def _get_chunk_lock(self) -> asyncio.Lock:
+        '''
+        Get the lock held by backups (from before their first chunk is stored until they are in the catalog) and by chunk
+        garbage collection, since a backup may reuse a chunk that no backup in the catalog references yet.
+        '''
+        if self._chunk_lock == None:
+            self._chunk_lock = asyncio.Lock()
+        return self._chunk_lock
+
+    async def _collect_chunk_garbage(self):
+        '''Delete region and repository chunks no backup uses any more, once any backup in progress has finished.'''
+        async with self._get_chunk_lock():
+            self._chunk_gc_pending = False
+            await self.load_backup_catalog()
+            # read the catalog on the loop, where it is changed, then walk the folders in a worker
+            backup_paths = [self.get_backup_path(backup) for backup in self.list_backups()]
+            await self._run_blocking(self._collect_chunk_garbage_files, [path for path in backup_paths if path != None])
+
+    def _queue_chunk_garbage_collection(self):
+        '''Collect chunk garbage in the background, once more after the current collection if one is running.'''
+        if self._chunk_gc_task != None and not self._chunk_gc_task.done():
+            self._chunk_gc_pending = True  # picked up once the current collection finishes
+            return
+        self._chunk_gc_task = asyncio.ensure_future(self._collect_chunk_garbage())
+        self._chunk_gc_task.add_done_callback(self._chunk_garbage_collected)
+
+    def _chunk_garbage_collected(self, task: asyncio.Future):
+        if task.cancelled():
+            return
+        if task.exception() != None:
+            logger.error(f"Failed to delete unused chunks: {task.exception()}")
+        if self._chunk_gc_pending:
+            self._queue_chunk_garbage_collection()
+
+    def _collect_chunk_garbage_files(self, backup_paths: List[str]):
+        repository = self._get_repository()
+        if os.path.isdir(repository.directory):
+            repository.collect_garbage()
+        pool = self._get_chunk_pool()
+        if not os.path.isdir(pool.directory):
+            return
+        referenced = set()
+        for backup_path in backup_paths:
+            if os.path.isdir(backup_path):
+                referenced |= referenced_chunks(backup_path)
+        pool.collect_garbage(referenced)
+
+    def _get_latest_backup(self) -> Union[str, None]:
+        '''Get the path of the most recently created directory backup, or None if there are none.'''
+        for entry in reversed(self._get_catalog().entries()):
+            backup_path = os.path.join(self.backup_directory, entry.name)
+            if entry.format == "directory" and os.path.isdir(backup_path):
+                return backup_path
+        return None
+
+    def _get_catalog(self) -> BackupCatalog:
+        '''
+        Get the backup catalog. A catalog that has not been saved yet reads as empty until load_backup_catalog()
+        has rebuilt it, so await that before relying on it.
+        '''
+        catalog_path = os.path.join(self.backup_directory, ".catalog.json")
+        if self._catalog == None or self._catalog.path != catalog_path:
+            self._catalog = BackupCatalog(catalog_path)
+        return self._catalog
+
+    async def load_backup_catalog(self):
+        '''
+        Rebuild the backup catalog from the backup folder if it has not been saved yet (such as on the first run after
+        upgrading). This reads every backup, so it runs off the event loop, and concurrent callers share one rebuild.
+        '''
+        if self._catalog_rebuild == None:
+            if self._get_catalog().exists() or not os.path.isdir(self.backup_directory):
+                return
+            self._catalog_rebuild = asyncio.ensure_future(self._run_blocking(self._rebuild_missing_catalog))
+            self._catalog_rebuild.add_done_callback(self._catalog_rebuilt)
+        await asyncio.shield(self._catalog_rebuild)
+
+    def _rebuild_missing_catalog(self):
+        catalog = self._get_catalog()
+        if not catalog.exists() and os.path.isdir(self.backup_directory):
+            catalog.replace_all([self._describe_backup(backup) for backup in self._scan_backups()])
+
+    def _catalog_rebuilt(self, rebuild: asyncio.Future):
+        if self._catalog_rebuild is rebuild:
+            self._catalog_rebuild = None  # if it failed, the next caller tries again
+        if not rebuild.cancelled() and rebuild.exception() != None:
+            logger.error(f"Failed to rebuild the backup catalog: {rebuild.exception()}")
+
+    async def rebuild_backup_catalog(self) -> int:
+        '''Rebuild the backup catalog by reading every backup in the backup folder, returning the number of backups found.'''
+        def rebuild():
+            entries = [self._describe_backup(backup) for backup in self._scan_backups()]
+            for entry in entries:  # only the catalog knows what has been replicated
+                previous_entry = self._get_catalog().get(entry.name)
+                entry.replication = previous_entry.replication if previous_entry != None else None
+            self._get_catalog().replace_all(entries)
+            return len(entries)
+        return await self._run_blocking(rebuild)
+
+    def _get_replicator(self) -> Union[Replicator, None]:
+        '''Get the replicator for the current replication settings, or None if replication is off.'''
+        if not self._replicate:
+            return None
+        settings = (self._replication_endpoint, self._replication_bucket, self._replication_access_key, self._replication_secret_key,
+                    self._replication_region, self._replication_path_style, self._replication_prefix, self._replication_workers,
+                    self._replication_bandwidth)
+        if self._replicator == None or self._replicator_settings != settings:
+            if self._replicator != None:
+                self._replicator.shutdown()
+            client = S3Client(self._replication_endpoint, self._replication_bucket, self._replication_access_key,
+                              self._replication_secret_key, self._replication_region, self._replication_path_style)
+            throttle = Throttle(self._replication_bandwidth * 1048576) if self._replication_bandwidth > 0 else None
+            self._replicator = Replicator(client, self._replication_prefix, self._replication_workers, throttle=throttle)
+            self._replicator_settings = settings
+            self._remote_backups_time = None
+        return self._replicator
+
+    def _queue_replication(self):
+        '''Upload every backup waiting to be replicated (or that failed to be) in the background, one at a time.'''
+        if not self._replicate:
+            return
+        if self._replication_task != None and not self._replication_task.done():
+            self._replication_requested = True  # picked up once the current uploads finish
+            return
+        self._replication_task = asyncio.ensure_future(self._replicate_backups())
+
+    async def _replicate_backups(self):
+        await self.load_backup_catalog()
+        while True:
+            self._replication_requested = False
+            for entry in self._get_catalog().entries():
+                if entry.replication in ("pending", "uploading", "failed") and entry.name in self._get_catalog():
+                    await self._replicate_backup(entry)
+            if not self._replication_requested:
+                return
+
+    async def _replicate_backup(self, entry: CatalogEntry):
+        '''Upload a backup to the replication bucket, recording how it went in its catalog entry.'''
+        loop = asyncio.get_running_loop()
+        last_report = time.monotonic()
+
+        def report_progress(bytes_done: int, total_bytes: int):  # called from the uploading threads
+            nonlocal last_report
+            if time.monotonic() - last_report >= 30:
+                last_report = time.monotonic()
+                percent = 100 * bytes_done // total_bytes if total_bytes > 0 else 100
+                asyncio.run_coroutine_threadsafe(self._update_server_listeners(f"Replicating backup {entry.name}: {percent}%"), loop)
+
+        replicator = self._get_replicator()
+        if replicator == None:
+            return
+        entry.replication = "uploading"
+        self._get_catalog().save()
+        marker = entry.to_dict()
+        marker["replication"] = "replicated"
+        start = time.monotonic()
+        try:
+            files, shared_files = await self._run_blocking(self._get_replication_files, entry.name)
+            uploaded, skipped, byte_count = await self._run_blocking(replicator.replicate, entry.name, files, shared_files, marker, report_progress)
+        except (S3Error, OSError, ValueError) as e:
+            state = "failed"
+            await self._update_server_listeners(f"Failed to replicate backup {entry.name}: {e}")
+        else:
+            state = "replicated"
+            self._remote_backups[entry.name] = marker
+            await self._update_server_listeners(f"Replicated backup {entry.name} ({uploaded} files uploaded, {skipped} already uploaded, "
+                                                f"{byte_count / 1048576:.1f} MiB in {time.monotonic() - start:.1f}s)")
+        current_entry = self._get_catalog().get(entry.name)
+        if current_entry != None:  # not deleted while uploading
+            current_entry.replication = state
+            self._get_catalog().save()
+
+    def _get_replication_files(self, backup: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        '''
+        Get the files to upload for a backup, as (own files, shared chunk files), each a list of
+        (local file, path relative to the backup folder).
+        '''
+        backup_path = self.get_backup_path(backup)
+        if backup_path == None:
+            raise FileNotFoundError(f"Backup {backup} does not exist.")
+        shared_paths = []
+        if os.path.isdir(backup_path):
+            paths = [os.path.join(root, file) for root, _, files in os.walk(backup_path) for file in files]
+            pool = self._get_chunk_pool()
+            shared_paths = [pool.path(chunk_hash) for chunk_hash in sorted(referenced_chunks(backup_path))]
+        elif backup in self._get_repository():
+            repository = self._get_repository()
+            paths = [backup_path]
+            chunk_hashes = {chunk_hash for entry in repository.load_manifest(backup)["files"].values() for chunk_hash in entry["chunks"]}
+            shared_paths = [repository.pool.path(chunk_hash) for chunk_hash in sorted(chunk_hashes)]
+        else:
+            paths = archive_files(backup_path)
+        return ([(path, os.path.relpath(path, self.backup_directory)) for path in paths],
+                [(path, os.path.relpath(path, self.backup_directory)) for path in shared_paths])
+
+    async def get_remote_backups(self, max_age: float = 60) -> Dict[str, Dict]:
+        '''
+        Get the backups stored in the replication bucket, as name: catalog entry (as a dict), or an empty dict if replication is off.
+        The bucket is listed at most every max_age seconds. If it cannot be listed, the last listing is returned.
+        '''
+        replicator = self._get_replicator()
+        if replicator == None:
+            return {}
+        if self._remote_backups_time == None or time.monotonic() - self._remote_backups_time >= max_age:
+            try:
+                self._remote_backups = await self._run_blocking(replicator.remote_snapshots)
+                self._remote_backups_time = time.monotonic()
+            except (S3Error, OSError) as e:
+                await self._update_server_listeners(f"Failed to list replicated backups: {e}")
+        return self._remote_backups
+
+    def get_backup_info(self, backup: str) -> Union[CatalogEntry, None]:
+        '''Get what the backup catalog records about a backup, or None if there is no such backup.'''
+        return self._get_catalog().get(backup)
+
+    def get_backup_infos(self, backups: List[str]) -> Dict[str, Union[CatalogEntry, None]]:
+        '''Get the catalog entries of several backups at once, by name (None for those not in the catalog).'''
+        catalog = self._get_catalog()
+        return {backup: catalog.get(backup) for backup in backups}
+
+    def _describe_backup(self, backup: str) -> CatalogEntry:
+        '''Read a backup from disk to make its catalog entry. Timestamped backups are dated by their name, others by their files.'''
+        backup_path = self.get_backup_path(backup)
+        if backup_path == None:
+            raise FileNotFoundError(f"Backup {backup} does not exist.")
+        size = files = 0
+        if os.path.isdir(backup_path):
+            backup_format = "directory"
+            worlds = sorted(world for world in os.listdir(backup_path) if not world.startswith("."))
+            for world in worlds:
+                for root, _, names in os.walk(os.path.join(backup_path, world)):
+                    for name in names:
+                        size += os.path.getsize(os.path.join(root, name))
+                        files += 1
+        elif backup in self._get_repository():
+            backup_format = "repository"
+            repository = self._get_repository()
+            worlds = repository.trees(backup)
+            for file in repository.load_manifest(backup)["files"].values():
+                size += file["size"]
+                files += 1
+        else:
+            backup_format = "archive"
+            reader = ArchiveReader(backup_path)
+            worlds = reader.top_level()
+            for member in reader.members():
+                if reader.is_file(member):
+                    size += reader.size(member)
+                    files += 1
+        origin = "scheduled" if backup.isdigit() else "named"
+        created = int(backup) if backup.isdigit() else os.path.getmtime(backup_path)
+        return CatalogEntry(backup, created, size, files, worlds, backup_format, origin)
 
     def list_backups(self) -> Union[str, List[str]]:
-        '''Returns a list of world backups.'''
+        '''Returns a list of world backups from the backup catalog, oldest first (await load_backup_catalog() first).'''
+        if not os.path.isdir(self.backup_directory):
+            return ""
+        return self._get_catalog().names()
+
+    def _scan_backups(self) -> List[str]:
+        '''Read the backup folder for backups: directories, archives (by name, without the archive suffix), and repository snapshots.'''
         try:
-            return os.listdir(self.backup_directory)
+            entries = os.listdir(self.backup_directory)
         except FileNotFoundError:
-            return ""
+            return []
+        backups = []
+        for entry in entries:
+            if entry.startswith("."):  # hidden entries are the manager's own bookkeeping, not backups
+                continue
+            if os.path.isdir(os.path.join(self.backup_directory, entry)):
+                backups.append(entry)
+            else:
+                name = archive_name(entry)
+                if name != None:
+                    backups.append(name)
+        return backups + self._get_repository().snapshots()
+
+    def get_backup_path(self, backup: str) -> Union[str, None]:
+        '''Get the path of a backup's directory, archive, or repository manifest, or None if it does not exist.'''
+        backup_path = os.path.join(self.backup_directory, backup)
+        if os.path.isdir(backup_path):
+            return backup_path
+        for suffix in ARCHIVE_SUFFIXES.values():
+            if os.path.isfile(backup_path + suffix):
+                return backup_path + suffix
+        repository = self._get_repository()
+        if backup in repository:
+            return repository.manifest_path(backup)
+        return None
+
+    def _delete_backup_files(self, backup: str):
+        '''Move a backup's directory or archive into the trash (to be deleted in the background), or delete its repository manifest.'''
+        backup_path = self.get_backup_path(backup)
+        if backup_path == None:
+            return
+        if os.path.isdir(backup_path):
+            self._get_trash().move(backup_path)
+        elif backup in self._get_repository():
+            self._get_repository().delete_snapshot(backup)
+        else:
+            for file in archive_files(backup_path):
+                if os.path.exists(file):
+                    self._get_trash().move(file)
+
+    def _get_trash(self) -> BackupTrash:
+        trash_path = os.path.join(self.backup_directory, ".trash")
+        if self._trash == None or self._trash.directory != trash_path:
+            self._trash = BackupTrash(trash_path)
+        return self._trash
+
+    def pending_deletions(self) -> List[str]:
+        '''Get the names of deleted backups whose files are still being removed in the background, oldest first.'''
+        return self._get_trash().pending()
 
-    async def restore_backup(self, backup: str):
+    async def restore_backup(self, backup: str, restart: bool = False) -> bool:
         '''
         Restores a backup with the specified name.
 
-        Fails if the server is currently running, or if the specified backup does not exist (RuntimeError/FileNotFoundError).
-        (Note that only the existance of the directory pointed to is checked. It may be empty.)
+        The backup is first rebuilt into staging folders beside the worlds, then swapped in by renaming,
+        so the live worlds are untouched until the swap and the swap itself takes moments.
+        If any world fails to swap, the worlds already swapped are put back, so the save is never left mixed.
+        The replaced worlds are kept as a rollback point (see rollback_restore() and discard_restore_rollback()).
+
+        If the server is running and restart is true, the backup is staged while the server keeps running,
+        then the server is restarted and the staged worlds are swapped in while it is down. Returns true in this case,
+        use wait_for_restore_swap() to learn whether the swap succeeded.
+        Otherwise, fails if the server is currently running, or if the specified backup does not exist (RuntimeError/FileNotFoundError),
+        or raises OSError if the swap failed.
         '''
-        if self.server_should_be_running():
+        if self.server_should_be_running() and not restart:
             raise RuntimeError("Cannot restore backup while server is running.")
-        backup_list = self.list_backups()
-        if backup in backup_list:
-            await self._update_server_listeners(f"Restoring backup {backup}")
-            for world in os.listdir(os.path.join(self.backup_directory, backup)):
-                world_dir = os.path.join(self.server_directory, world)
-                backup_dir = os.path.join(self.backup_directory, os.path.join(backup, world))
-                self._delete_world(world_dir)
-                self._copy_world(backup_dir, world_dir)
-            await self._update_server_listeners("Restoration complete")
+        await self.stage_restore(backup)
+        if self.server_should_be_running():
+            self._swap_restore_on_start = True
+            self._restore_swapped = asyncio.get_running_loop().create_future()
+            self._restore_swapped.add_done_callback(lambda future: future.cancelled() or future.exception())  # retrieved even if unawaited
+            await self._update_server_listeners(f"Backup {backup} staged, restarting to swap it in")
+            self.restart_server()
+            return True
+        await self._run_blocking(self._swap_in_staged_restore)
+        await self._update_server_listeners("Restoration complete")
+        return False
+
+    async def wait_for_restore_swap(self, timeout: Union[float, None] = None):
+        '''
+        Wait until a restore staged by restore_backup() has been swapped in as the server restarted.
+        Returns at once if no swap is pending. Raises the swap's OSError if it failed, RuntimeError if the staged
+        restore was replaced by another, or asyncio.TimeoutError.
+        '''
+        if self._restore_swapped != None:
+            await asyncio.wait_for(asyncio.shield(self._restore_swapped), timeout)
+
+    async def stage_restore(self, backup: str):
+        '''
+        Rebuild a backup's worlds into staging folders beside the live worlds, ready to be swapped in.
+
+        Safe to run while the server is running, since the live worlds are not touched.
+        Raises FileNotFoundError if the specified backup does not exist.
+        '''
+        await self.load_backup_catalog()
+        if backup not in self.list_backups():
+            raise FileNotFoundError("Specified backup does not exist.")
+        backup_path = self.get_backup_path(backup)
+        if backup_path == None:
+            raise FileNotFoundError("Specified backup is missing from the backup folder.")
+        await self._discard_staged_restore()
+        await self._update_server_listeners(f"Restoring backup {backup}")
+        worlds = await self._run_blocking(self._get_backup_worlds, backup, backup_path)
+        self._staged_restore = worlds
+        for world in worlds:
+            await self._restore_world(backup, backup_path, world, self._get_restore_path(world, "staging"))
+
+    def _get_restore_path(self, world: str, stage: str) -> str:
+        '''Get the hidden folder beside a world used for a stage of restoring ("staging", "rollback", or "previous" and "swap" while swapping).'''
+        return os.path.join(self.server_directory, f".{world}.restore-{stage}")
+
+    def _get_backup_worlds(self, backup: str, backup_path: str) -> List[str]:
+        if os.path.isdir(backup_path):
+            return [world for world in os.listdir(backup_path) if not world.startswith(".")]  # skip bookkeeping, such as hashes
+        if backup in self._get_repository():
+            return self._get_repository().trees(backup)
+        return ArchiveReader(backup_path).top_level()
+
+    async def _restore_world(self, backup: str, backup_path: str, world: str, destination: str):
+        '''Rebuild one world of a backup (in any format) into destination.'''
+        if os.path.isdir(backup_path):
+            await self._copy_engine.copy_tree(os.path.join(backup_path, world), destination,
+                                              SnapshotCopier(region_pool=self._get_chunk_pool(), reflink=await self._run_blocking(
+                                                  self._can_reflink, backup_path, self.server_directory)).restore_file,
+                                              progress=functools.partial(self._report_copy_progress, f"Restoring {world}"))
+            return
+        await self._update_server_listeners(f"Restoring {world}")
+        if backup in self._get_repository():
+            await self._run_blocking(self._get_repository().restore, backup, world, destination)
         else:
+            reader = await self._run_blocking(ArchiveReader, backup_path)
+            await self._run_blocking(reader.extract_all, world, destination)
+
+    async def _discard_staged_restore(self):
+        '''Delete staging folders left by an unfinished restore.'''
+        worlds = set(self._worlds) | set(self._staged_restore if self._staged_restore != None else [])
+        self._staged_restore = None
+        self._swap_restore_on_start = False
+        if self._restore_swapped != None and not self._restore_swapped.done():
+            self._restore_swapped.set_exception(RuntimeError("The staged restore was replaced by another."))
+        for world in worlds:
+            staging_path = self._get_restore_path(world, "staging")
+            if os.path.exists(staging_path):
+                await self._copy_engine.delete_tree(staging_path)
+
+    def _swap_in_staged_restore(self):
+        '''
+        Rename each staged world into place, keeping the worlds it replaces as the rollback point.
+        If any rename fails, every rename already made is undone (including setting aside the old rollback point),
+        the restore stays staged, and the OSError is raised. Only call while the server is stopped.
+        '''
+        worlds = self._staged_restore if self._staged_restore != None else []
+        previous_worlds = self._get_rollback_worlds()
+        for world in previous_worlds:  # left over from a swap that was interrupted while cleaning up
+            previous_path = self._get_restore_path(world, "previous")
+            if os.path.exists(previous_path):
+                shutil.rmtree(previous_path)
+        renames = [(self._get_restore_path(world, "rollback"), self._get_restore_path(world, "previous")) for world in previous_worlds]
+        for world in worlds:
+            world_path = os.path.join(self.server_directory, world)
+            renames.append((world_path, self._get_restore_path(world, "rollback")))
+            renames.append((self._get_restore_path(world, "staging"), world_path))
+        self._rename_all(renames)
+        self._staged_restore = None
+        self._swap_restore_on_start = False
+        self._save_rollback_worlds(worlds)
+        for world in previous_worlds:  # the new rollback point replaces the old one
+            previous_path = self._get_restore_path(world, "previous")
+            if os.path.exists(previous_path):
+                shutil.rmtree(previous_path)
+
+    def _rename_all(self, renames: List[Tuple[str, str]]):
+        '''Rename each (source, destination) pair in order, skipping missing sources. If one fails, undo the rest and raise.'''
+        done = []
+        try:
+            for source, destination in renames:
+                if os.path.exists(source):
+                    os.rename(source, destination)
+                    done.append((source, destination))
+        except OSError:
+            for source, destination in reversed(done):
+                os.rename(destination, source)
+            raise
+
+    def _get_rollback_manifest_path(self) -> str:
+        return os.path.join(self.server_directory, ".restore-rollback.json")
+
+    def _get_rollback_worlds(self) -> List[str]:
+        '''Get the worlds of the rollback point, as recorded when it was made (or those with rollback folders, if unrecorded).'''
+        try:
+            with open(self._get_rollback_manifest_path(), "r") as manifest:
+                return json.load(manifest)["worlds"]
+        except FileNotFoundError:  # made before the worlds were recorded
+            return [world for world in self._worlds if os.path.exists(self._get_restore_path(world, "rollback"))]
+
+    def _save_rollback_worlds(self, worlds: Union[List[str], None]):
+        '''Record the worlds of the rollback point, or remove the record if None.'''
+        if worlds == None:
+            if os.path.exists(self._get_rollback_manifest_path()):
+                os.remove(self._get_rollback_manifest_path())
+            return
+        with open(self._get_rollback_manifest_path(), "w") as manifest:
+            json.dump({"worlds": worlds}, manifest)
+
+    def has_restore_rollback(self) -> bool:
+        '''Returns true if worlds replaced by a restore are still kept as a rollback point.'''
+        worlds = self._get_rollback_worlds()
+        return len(worlds) > 0 and (os.path.exists(self._get_rollback_manifest_path()) or
+                                    any(os.path.exists(self._get_restore_path(world, "rollback")) for world in worlds))
+
+    def rollback_restore(self):
+        '''
+        Undo the last restore by swapping the worlds it replaced back in (the restored worlds become the rollback point).
+        Worlds the restore added that did not exist before are moved out. If any rename fails, the rest are undone.
+
+        Fails if the server is currently running, or if there is no rollback point (RuntimeError/FileNotFoundError).
+        '''
+        if self.server_should_be_running():
+            raise RuntimeError("Cannot roll back a restore while server is running.")
+        if not self.has_restore_rollback():
+            raise FileNotFoundError("There is no restore to roll back.")
+        renames = []
+        for world in self._get_rollback_worlds():
+            world_path = os.path.join(self.server_directory, world)
+            rollback_path = self._get_restore_path(world, "rollback")
+            swap_path = self._get_restore_path(world, "swap")
+            renames += [(world_path, swap_path), (rollback_path, world_path), (swap_path, rollback_path)]
+        self._rename_all(renames)
+
+    async def discard_restore_rollback(self):
+        '''Delete the worlds kept as a rollback point by the last restore, raises FileNotFoundError if there are none.'''
+        if not self.has_restore_rollback():
+            raise FileNotFoundError("There is no restore rollback point to discard.")
+        for world in self._get_rollback_worlds():
+            rollback_path = self._get_restore_path(world, "rollback")
+            if os.path.exists(rollback_path):
+                await self._copy_engine.delete_tree(rollback_path)
+        self._save_rollback_worlds(None)
+
+    async def restore_partial(self, backup: str, dimension: str = "overworld", box: Union[str, None] = None,
+                              player: Union[str, None] = None, chunks_only: bool = False) -> int:
+        '''
+        Restores part of a backup, leaving the rest of the world as it is. Returns the number of files restored.
+
+        With only a dimension, that dimension's region folders (terrain, entities, and points of interest) are restored.
+        With a box of block coordinates ("x1 z1 x2 z2"), only the dimension's region files overlapping it are restored,
+        or, if chunks_only is true, only the chunks overlapping it are copied into the live region files.
+        With a player UUID, only that player's data, statistics, and advancements are restored.
+        Regions and chunks that the backup does not contain are left as they are.
+
+        Fails if the server is currently running, if the backup does not exist, or if an option is invalid
+        (RuntimeError/FileNotFoundError/ValueError). A player cannot be combined with a dimension, box, or chunks_only,
+        and chunks_only needs a box.
+        '''
+        if player != None and (box != None or chunks_only or dimension != "overworld"):
+            raise ValueError("A player's data cannot be restored with a dimension, box, or chunks only.")
+        if chunks_only and box == None:
+            raise ValueError("Restoring chunks only needs a box.")
+        if self.server_should_be_running():
+            raise RuntimeError("Cannot restore backup while server is running.")
+        await self.load_backup_catalog()
+        if backup not in self.list_backups():
             raise FileNotFoundError("Specified backup does not exist.")
+        backup_path = self.get_backup_path(backup)
+        if backup_path == None:
+            raise FileNotFoundError("Specified backup is missing from the backup folder.")
+        primary_world = self._worlds[0]
+        parsed_box = None
+        if player != None:
+            keys = partial.player_keys(primary_world, player)
+            description = f"player {player}"
+        else:
+            worlds = await self._run_blocking(self._get_backup_worlds, backup, backup_path)
+            roots = partial.dimension_roots(primary_world, worlds, dimension)
+            if box != None:
+                parsed_box = partial.parse_box(box)
+                keys = partial.region_keys(roots, parsed_box)
+                description = f"{dimension} from {parsed_box[0]}, {parsed_box[1]} to {parsed_box[2]}, {parsed_box[3]}"
+            else:
+                keys = partial.dimension_keys(roots)
+                description = dimension
+        await self._update_server_listeners(f"Restoring {description} from backup {backup}")
+        # restore into staging paths beside each target, then move them into place
+        staged = [(key, os.path.join(self.server_directory, key + ".restore-staging")) for key in keys]
+        for _, staging_path in staged:  # left over from an interrupted restore
+            if os.path.isdir(staging_path):
+                await self._copy_engine.delete_tree(staging_path)
+            elif os.path.exists(staging_path):
+                os.remove(staging_path)
+        restored = await self._restore_backup_keys(backup, backup_path, staged)
+        files = 0
+        for key, staging_path in restored:
+            target = os.path.join(self.server_directory, key)
+            if chunks_only and parsed_box != None:
+                chunks = await self._run_blocking(partial.splice_chunks, target, staging_path, partial.chunk_indexes(key, parsed_box))
+                await self._run_blocking(os.remove, staging_path)
+                files += 1 if chunks > 0 else 0
+            else:
+                await self._run_blocking(self._move_into_place, staging_path, target)
+                files += 1
+        await self._update_server_listeners(f"Restoration complete ({files} files restored)")
+        return files
+
+    async def _restore_backup_keys(self, backup: str, backup_path: str, targets: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        '''
+        Rebuild files or folders of a backup (in any format), given as (key, destination) pairs such as ("world/DIM-1/region", path).
+        Returns the pairs that the backup contained.
+        '''
+        if os.path.isdir(backup_path):
+            copier = SnapshotCopier(region_pool=self._get_chunk_pool(),
+                                    reflink=await self._run_blocking(self._can_reflink, backup_path, self.server_directory))
+            for key, destination in targets:
+                source = os.path.join(backup_path, key)
+                if os.path.isdir(source):
+                    await self._copy_engine.copy_tree(source, destination, copier.restore_file)
+                elif os.path.isfile(source):
+                    await self._run_blocking(copier.restore_file, source, destination)
+                elif os.path.isfile(source + DELTA_SUFFIX):
+                    await self._run_blocking(copier.restore_file, source + DELTA_SUFFIX, destination + DELTA_SUFFIX)
+        elif backup in self._get_repository():
+            await self._run_blocking(self._get_repository().restore_many, backup, targets)
+        else:
+            reader = await self._run_blocking(ArchiveReader, backup_path)
+            for key, destination in targets:
+                await self._run_blocking(reader.extract, key, destination)
+        return [(key, destination) for key, destination in targets if os.path.exists(destination)]
 
-    def delete_backup(self, backup: str):
+    def _move_into_place(self, staging_path: str, target: str):
+        '''Replace target (a file or folder) with staging_path.'''
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.isdir(target):
+            old_path = target + ".restore-old"
+            os.rename(target, old_path)
+            os.rename(staging_path, target)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(staging_path, target)
+
+    async def delete_backup(self, backup: str):
         '''
         Deletes a backup with the specified name.
 
-        Raises FileNotFoundError if the folder does not exist.
+        The backup is gone as soon as this returns, but its files are removed in the background (see pending_deletions()),
+        as are any chunks that only it used.
+
+        Raises FileNotFoundError if the backup does not exist.
         '''
+        await self.load_backup_catalog()
         backup_list = self.list_backups()
         if backup in backup_list:
-            backup_dir = os.path.join(self.backup_directory, backup)
-            self._delete_world(backup_dir)
+            backup_path = self.get_backup_path(backup)
+            self._get_catalog().remove(backup)
+            if backup_path == None:  # already gone from disk, only the catalog needed updating
+                return
+            self._delete_backup_files(backup)
+            if not backup_path.endswith(tuple(ARCHIVE_SUFFIXES.values())):  # archives do not share chunks
+                self._queue_chunk_garbage_collection()
         else:
             raise FileNotFoundError("Specified backup does not exist.")
 
@@ -267,11 +1155,9 @@ class ServerManager:
             except Exception:
                 pass
 
-    def _copy_world(self, source, destination):
-        shutil.copytree(source, destination, ignore=shutil.ignore_patterns("*.lock"))
-
-    def _delete_world(self, world):
-        shutil.rmtree(world)
+    async def _run_blocking(self, function: Callable, *args):
+        '''Run a blocking function on the default executor, since the server shares its event loop with the bot.'''
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
 
     def server_should_be_running(self) -> bool:
         '''Returns true if the server should be running (but might be restarting), false otherwise.'''
@@ -295,18 +1181,21 @@ class ServerManager:
             self._motd = config.get("motd")
             if self._motd != None:
                 self._motd = self._motd.strip()
-            try:
-                self._port = int(config.get("query.port"))  # type: ignore
-            except TypeError:  # in case the version doesn't have a query port, such as FTB 1.7.10
-                self._port = int(config.get("server-port"))  # type: ignore - further error -> crash
+            self._port = int(config.get("server-port"))  # type: ignore - further error -> crash
+            self._query_port: Union[int, None] = None
+            if config.get("enable-query") == "true":
+                try:
+                    self._query_port = int(config.get("query.port"))  # type: ignore
+                except TypeError:  # query.port defaults to server-port, and old versions (such as FTB 1.7.10) may not write it
+                    self._query_port = self._port
         except FileNotFoundError:
             raise FileNotFoundError("You must run your servers before using the server manager.")
 
     async def _update_server_listeners(self, message: str):
-        timestamp = f"[{datetime.now().strftime('%H:%M:%S')}] [Manager]: "
+        timestamp = datetime.now().strftime('%H:%M:%S')
         # headache: since the loop gets stuck in monitoring, it couldn't run this task
         # to fix: make sure that the monitor has an awaitable that lets other tasks go
-        await self.server._update_listeners(timestamp + message)
+        await self.server._update_listeners(ConsoleRecord(timestamp, "Manager", "INFO", "Manager", message, f"[{timestamp}] [Manager]: {message}"))
 
     def reload_configs(self):
         '''Reload the configs from the current config file.'''
@@ -320,28 +1209,98 @@ class ServerManager:
             self._worlds = config.get("Server Information", "world_folders").split(",")  # type: ignore
             for i in range(len(self._worlds)):
                 self._worlds[i] = self._worlds[i].strip()
+            self._console_history_size = int(config.get("Server Information", "console_history", default="10000"))  # type: ignore
 
             self._do_autorestart = config.get("Restarts", "autorestart").lower() == "true"  # type: ignore
-            self._autorestart_datetime = config.get("Restarts", "autorestart_datetime")
+            self._autorestart_schedule = self._compile_schedule(config.get("Restarts", "autorestart_datetime"))
             self._restart_on_crash = config.get("Restarts", "restart_on_crash").lower() == "true"  # type: ignore
 
             self._do_backups = config.get("Backups", "backup").lower() == "true"  # type: ignore
             self._max_backups = int(config.get("Backups", "max_backups"))  # type: ignore
-            self._backup_datetime = config.get("Backups", "backup_datetime")
+            self._backup_schedule = self._compile_schedule(config.get("Backups", "backup_datetime"))
+            self._incremental_backups = config.get("Backups", "incremental", default="false").lower() == "true"  # type: ignore
+            self._verify_incremental_backups = config.get("Backups", "incremental_verify", default="false").lower() == "true"  # type: ignore
+            self._region_delta_backups = config.get("Backups", "region_delta", default="false").lower() == "true"  # type: ignore
+            self._backup_workers = int(config.get("Backups", "backup_workers", default="4"))  # type: ignore
+            self._use_reflinks = config.get("Backups", "reflink", default="true").lower() == "true"  # type: ignore
+            self._save_flush_timeout = float(config.get("Backups", "save_flush_timeout", default="60"))  # type: ignore
+            self._skip_unchanged = config.get("Backups", "skip_unchanged", default="off").lower()  # type: ignore
+            self._throttle_bandwidth = float(config.get("Backups", "throttle_bandwidth", default="0"))  # type: ignore
+            self._throttle_iops = float(config.get("Backups", "throttle_iops", default="0"))  # type: ignore
+            self._throttle_adaptive = config.get("Backups", "throttle_adaptive", default="false").lower() == "true"  # type: ignore
+            self._throttle_mspt_command = config.get("Backups", "throttle_mspt_command", default="").strip()  # type: ignore
+            self._backup_idle_priority = config.get("Backups", "idle_priority", default="false").lower() == "true"  # type: ignore
+
+            self._replicate = config.get("Replication", "replicate", default="false").lower() == "true"  # type: ignore
+            self._replication_endpoint = config.get("Replication", "endpoint", default="")
+            self._replication_bucket = config.get("Replication", "bucket", default="")
+            self._replication_access_key = config.get("Replication", "access_key", default="")
+            self._replication_secret_key = config.get("Replication", "secret_key", default="")
+            self._replication_region = config.get("Replication", "region", default="us-east-1")
+            self._replication_path_style = config.get("Replication", "path_style", default="true").lower() == "true"  # type: ignore
+            self._replication_prefix = config.get("Replication", "prefix", default="")
+            self._replication_workers = int(config.get("Replication", "workers", default="2"))  # type: ignore
+            self._replication_bandwidth = float(config.get("Replication", "bandwidth", default="0"))  # type: ignore
+            if self._replicate and (self._replication_endpoint == "" or self._replication_bucket == ""):
+                raise ValueError("Replication needs an endpoint and a bucket")
+            if self._skip_unchanged not in ("off", "players", "files"):
+                raise ValueError(f"skip_unchanged must be off, players, or files, not {self._skip_unchanged}")
+            self._backup_format = config.get("Backups", "backup_format", default="directory").lower()  # type: ignore
+            if self._backup_format not in ("directory", "archive", "repository"):
+                raise ValueError(f"backup_format must be directory, archive, or repository, not {self._backup_format}")
+            self._archive_compression = config.get("Backups", "archive_compression", default="gzip").lower()  # type: ignore
+            if self._archive_compression not in ARCHIVE_SUFFIXES:
+                raise ValueError(f"archive_compression must be one of {', '.join(ARCHIVE_SUFFIXES)}, not {self._archive_compression}")
+            self._archive_level = int(config.get("Backups", "archive_level", default="6"))  # type: ignore
             self.backup_directory = os.path.join(self.server_directory, config.get("Backups", "backup_folder"))  # type: ignore
+
+            self._scheduled_jobs = [self._parse_scheduled_job(name, config.get("Schedule", name))  # type: ignore
+                                    for name in config.options("Schedule")]
         except Exception as e:
             raise RuntimeError(f"Error reading configs for server: {e}")
 
+    def _compile_schedule(self, expression: Union[str, None]) -> Union[Schedule, None]:
+        if expression == None or expression == "":
+            return None
+        return Schedule(expression)
+
+    def _parse_scheduled_job(self, name: str, value: str) -> ScheduledJob:
+        '''Parse a [Schedule] option, formatted as "<schedule> | <action>".'''
+        try:
+            expression, action_text = value.rsplit("|", 1)
+        except ValueError:
+            raise ValueError(f"Scheduled job {name} must be formatted as <schedule> | <action>")
+        action_parts = action_text.strip().split(" ", 1)
+        action_type = action_parts[0].lower()
+        argument = action_parts[1].strip() if len(action_parts) > 1 else ""
+        if action_type == "command" and argument != "":
+            action = functools.partial(self._send_command, argument)
+        elif action_type == "say" and argument != "":
+            action = functools.partial(self._send_command, f"say {argument}")
+        elif action_type == "backup":
+            action = self._scheduled_backup
+        elif action_type == "restart":
+            action = self._autorestart
+        else:
+            raise ValueError(f"Scheduled job {name} has an unknown action \"{action_text.strip()}\"")
+        return ScheduledJob(name, action, Schedule(expression))
+
     async def uptime(self) -> int:
         '''Get the time the server has been running since it was last started, in seconds.'''
         if (await self.server_running()):
             return self._get_current_time() - self._server_start_time
         return 0
 
-    def get_latest_log(self) -> List[str]:
-        '''Get a list of all console logs for the latest server session.'''
-        try:
-            log_file = open(os.path.join(self.server_directory, "logs", "latest.log"), "r")
-        except IOError:
+    async def get_latest_log(self) -> Sequence[str]:
+        '''
+        Get all console logs for the latest server session.
+
+        Recent lines are kept in memory, older ones are only read from logs/latest.log when they are indexed.
+        If the file is needed, where its lines start is found off the event loop first, so pages are read by seeking to them.
+        '''
+        log = ConsoleLogView(self.server.history, os.path.join(self.server_directory, "logs", "latest.log"))
+        if log.needs_file():
+            await self._run_blocking(log.index_file)
+        if len(log) == 0:
             return ["No latest log found."]
-        return log_file.readlines()
+        return log
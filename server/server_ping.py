@@ -23,110 +23,209 @@
 #
 # For more information, please refer to <http://unlicense.org/>
 #
-# Source: https://gist.github.com/ewized/97814f57ac85af7128bf, with minor changes
+# Based on: https://gist.github.com/ewized/97814f57ac85af7128bf, rewritten for asyncio
 
-import socket
+'''
+Server List Ping, the protocol the multiplayer menu uses to show a server's players, version and latency
+
+Classes
+-------
+AsyncStatusPing
+    Gets the status without blocking the event loop
+StatusPing
+    A blocking wrapper around AsyncStatusPing
+'''
+
+from typing import Dict, Tuple, Union
+import asyncio
 import struct
+import time
 import json
 
 
-class StatusPing:
-    """ Get the ping status for the Minecraft server """
-
-    def __init__(self, host='localhost', port=25565, timeout=5):
-        """ Init the hostname and the port """
-        self._host = host
-        self._port = port
-        self._timeout = timeout
+MAX_PACKET_SIZE = 2097151  # the largest length a 3 byte varint can hold, as the game itself allows
+INITIAL_BUFFER_SIZE = 16384  # enough for most responses, grown if a large favicon needs more
 
-    def _unpack_varint(self, sock):
-        """ Unpack the varint """
-        data = 0
-        for i in range(5):
-            ordinal = sock.recv(1)
 
-            if len(ordinal) == 0:
-                break
+def _pack_varint(value: int) -> bytes:
+    packed = bytearray()
+    value &= 0xFFFFFFFF  # negative values are sent as their 32 bit two's complement
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        packed.append(byte | (0x80 if value > 0 else 0))
+        if value == 0:
+            return bytes(packed)
 
-            byte = ord(ordinal)
-            data |= (byte & 0x7F) << 7*i
 
-            if not byte & 0x80:
-                break
+def _unpack_varint(view: memoryview, offset: int) -> Tuple[int, int]:
+    '''Read a varint at offset, returning it and the offset after it. Raises IndexError if the view ends first.'''
+    value = 0
+    for i in range(5):
+        byte = view[offset + i]
+        value |= (byte & 0x7F) << 7 * i
+        if not byte & 0x80:
+            return value, offset + i + 1
+    raise ValueError("Varint is longer than 5 bytes")
 
-        return data
 
-    def _pack_varint(self, data):
-        """ Pack the var int """
-        ordinal = b''
+def _pack_packet(packet_id: int, *fields: bytes) -> bytes:
+    data = _pack_varint(packet_id) + b"".join(fields)
+    return _pack_varint(len(data)) + data
 
-        while True:
-            byte = data & 0x7F
-            data >>= 7
-            ordinal += struct.pack('B', byte | (0x80 if data > 0 else 0))
 
-            if data == 0:
-                break
+def _pack_string(text: str) -> bytes:
+    data = text.encode("utf8")
+    return _pack_varint(len(data)) + data
 
-        return ordinal
 
-    def _pack_data(self, data):
-        """ Page the data """
-        if type(data) is str:
-            data = data.encode('utf8')
-            return self._pack_varint(len(data)) + data
-        elif type(data) is int:
-            return struct.pack('H', data)
-        elif type(data) is float:
-            return struct.pack('L', int(data))
-        else:
-            return data
+class _PacketProtocol(asyncio.BufferedProtocol):
+    '''
+    Receives straight into a preallocated buffer (no copy per read, unlike a StreamReader) and splits it into packets.
 
-    def _send_data(self, connection, *args):
-        """ Send the data on the connection """
-        data = b''
+    Packets are returned as memoryviews into the buffer, which stay valid because a buffer that must grow is replaced
+    rather than resized.
+    '''
 
-        for arg in args:
-            data += self._pack_data(arg)
+    def __init__(self):
+        self._buffer = bytearray(INITIAL_BUFFER_SIZE)
+        self._start = 0  # where the next unread packet starts
+        self._end = 0  # where received data ends
+        self._waiter: Union[asyncio.Future, None] = None
+        self._error: Union[Exception, None] = None
+        self.transport: Union[asyncio.Transport, None] = None
 
-        connection.send(self._pack_varint(len(data)) + data)
+    def connection_made(self, transport):
+        self.transport = transport
 
-    def _read_fully(self, connection, extra_varint=False):
-        """ Read the connection and return the bytes """
-        packet_length = self._unpack_varint(connection)
-        packet_id = self._unpack_varint(connection)
-        byte = b''
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._end == len(self._buffer):
+            if len(self._buffer) >= MAX_PACKET_SIZE + 8:
+                raise ValueError("Status response is too large")
+            buffer = bytearray(len(self._buffer) * 2)
+            buffer[:self._end] = memoryview(self._buffer)[:self._end]
+            self._buffer = buffer
+        return memoryview(self._buffer)[self._end:]
 
-        if extra_varint:
-            # Packet contained netty header offset for this
-            if packet_id > packet_length:
-                self._unpack_varint(connection)
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        self._wake()
 
-            extra_length = self._unpack_varint(connection)
+    def connection_lost(self, exc):
+        self._error = exc if exc != None else ConnectionResetError("Connection closed by the server")
+        self._wake()
 
-            while len(byte) < extra_length:
-                byte += connection.recv(extra_length)
+    def _wake(self):
+        if self._waiter != None and not self._waiter.done():
+            self._waiter.set_result(None)
 
-        else:
-            byte = connection.recv(packet_length)
+    async def read_packet(self) -> Tuple[int, memoryview]:
+        '''Wait for the next whole packet, returning its id and the rest of its data.'''
+        while True:
+            view = memoryview(self._buffer)[:self._end]
+            try:
+                length, data_start = _unpack_varint(view, self._start)
+                if length > MAX_PACKET_SIZE:
+                    raise ValueError(f"Packet length {length} is too large")
+                if data_start + length <= self._end:
+                    self._start = data_start + length
+                    packet_id, offset = _unpack_varint(view, data_start)
+                    return packet_id, view[offset:self._start]
+            except IndexError:  # the length has not all arrived
+                pass
+            if self._error != None:
+                raise self._error
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+
+
+class AsyncStatusPing:
+    '''
+    Gets a server's status with Server List Ping, without blocking the event loop.
+
+    Every call opens a new connection: the server closes it after answering.
+
+    Parameters
+    ----------
+    host: `str`
+        The server's address, default localhost
+    port: `int`
+        The server's port, default 25565
+    timeout: `float`
+        Seconds to wait for the whole exchange before giving up, default 5
+    '''
+
+    def __init__(self, host: str = "localhost", port: int = 25565, timeout: float = 5):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
 
-        return byte
+    async def get_status(self) -> Union[Dict, None]:
+        '''Get the status response (as sent by the server), or None if the server could not be reached or answered wrongly.'''
+        result = await self.get_status_and_latency()
+        return None if result == None else result[0]
 
-    def get_status(self):
-        """ Get the status response """
+    async def get_status_and_latency(self) -> Union[Tuple[Dict, float], None]:
+        '''
+        Get the status response and the round trip time in milliseconds (of the ping after the status, as the game
+        measures it), or None if the server could not be reached or answered wrongly.
+        '''
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as connection:
-                connection.settimeout(self._timeout)
-                connection.connect((self._host, self._port))
+            return await asyncio.wait_for(self._exchange(), self._timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            return None
 
-                # Send handshake + status request
-                self._send_data(connection, b'\x00\x00', self._host, self._port, b'\x01')
-                self._send_data(connection, b'\x00')
+    async def _exchange(self) -> Tuple[Dict, float]:
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_connection(_PacketProtocol, self._host, self._port)
+        try:
+            # handshake (protocol version -1 is for pings) then status request, in one write
+            transport.write(_pack_packet(0x00, _pack_varint(-1), _pack_string(self._host),
+                                         struct.pack(">H", self._port), _pack_varint(1)) + _pack_packet(0x00))
+            packet_id, data = await protocol.read_packet()
+            if packet_id != 0x00:
+                raise ValueError(f"Expected a status response, got packet {packet_id}")
+            length, offset = _unpack_varint(data, 0)
+            if offset + length > len(data):
+                raise ValueError("Status response is shorter than its length")
+            status = json.loads(str(data[offset:offset + length], "utf8"))
+            if not isinstance(status, dict):
+                raise ValueError("Status response is not an object")
+            payload = time.monotonic_ns() & 0x7FFFFFFFFFFFFFFF
+            sent = time.perf_counter()
+            transport.write(_pack_packet(0x01, struct.pack(">q", payload)))
+            packet_id, data = await protocol.read_packet()
+            latency = (time.perf_counter() - sent) * 1000
+            if packet_id != 0x01 or len(data) != 8 or struct.unpack(">q", data)[0] != payload:
+                raise ValueError("Invalid pong")
+            return status, latency
+        finally:
+            transport.close()
 
-                # Read response, offset for string length
-                data = self._read_fully(connection, extra_varint=True)
-        except:
-            return None
 
-        # Load json and return
-        return json.loads(data.decode('utf8'))
+class StatusPing:
+    '''
+    A blocking wrapper around AsyncStatusPing, for code outside the event loop.
+
+    It runs each ping on a new event loop, so it must not be called from a coroutine (use AsyncStatusPing there).
+
+    Parameters
+    ----------
+    host: `str`
+        The server's address, default localhost
+    port: `int`
+        The server's port, default 25565
+    timeout: `float`
+        Seconds to wait for the whole exchange before giving up, default 5
+    '''
+
+    def __init__(self, host: str = "localhost", port: int = 25565, timeout: float = 5):
+        self._pinger = AsyncStatusPing(host, port, timeout)
+
+    def get_status(self) -> Union[Dict, None]:
+        '''Get the status response, or None if the server could not be reached or answered wrongly.'''
+        return asyncio.run(self._pinger.get_status())
+
+    def get_status_and_latency(self) -> Union[Tuple[Dict, float], None]:
+        '''Get the status response and the round trip time in milliseconds, or None if the server could not be reached.'''
+        return asyncio.run(self._pinger.get_status_and_latency())
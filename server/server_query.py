@@ -0,0 +1,210 @@
+'''
+The Query protocol (GameSpy4 over UDP), which servers answer when enable-query is set in server.properties
+
+Unlike Server List Ping, its full stat lists every online player rather than a sample of them.
+
+Classes
+-------
+QueryClient
+    Gets basic and full stats over a single UDP socket, reusing challenge tokens
+
+Methods
+-------
+session_id(counter: `int`) -> `int`
+    Get the session id to send for a request counter
+'''
+
+from typing import Dict, List, Tuple, Union
+import asyncio
+import struct
+import time
+
+
+MAGIC = b"\xFE\xFD"
+TYPE_HANDSHAKE = 0x09
+TYPE_STAT = 0x00
+SESSION_MASK = 0x0F0F0F0F  # the server ignores the high bits of each byte of the session id
+SESSION_COUNT = 0x10000  # the ids with distinct masked values, 4 bits from each byte
+TOKEN_LIFETIME = 30  # servers forget challenge tokens after 30 seconds
+TOKEN_MARGIN = 5  # renew tokens this much earlier, since the server's 30 seconds started before ours
+FULL_STAT_PADDING = b"\x00\x00\x00\x00"
+KEY_VALUE_START = b"splitnum\x00\x80\x00"
+PLAYERS_START = b"\x01player_\x00\x00"
+BASIC_STAT_FIELDS = ["motd", "gametype", "map", "numplayers", "maxplayers"]
+
+
+def session_id(counter: int) -> int:
+    '''Spread a counter below SESSION_COUNT across the low 4 bits of each byte of a session id, which the server echoes intact.'''
+    return sum(((counter >> (4 * nibble)) & 0x0F) << (8 * nibble) for nibble in range(4)) & SESSION_MASK
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    '''Hands each response to the request waiting for its type and session id.'''
+
+    def __init__(self):
+        self.transport: Union[asyncio.DatagramTransport, None] = None
+        self.waiters: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 5:
+            return
+        waiter = self.waiters.pop((data[0], struct.unpack(">i", data[1:5])[0]), None)
+        if waiter != None and not waiter.done():
+            waiter.set_result(data[5:])
+
+    def error_received(self, exc: Exception):  # such as ICMP port unreachable, when query is not enabled
+        self._fail_waiters(exc)
+
+    def connection_lost(self, exc):
+        self._fail_waiters(exc if exc != None else ConnectionResetError("Query socket closed"))
+
+    def _fail_waiters(self, exc: Exception):
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+
+class QueryClient:
+    '''
+    Gets a server's stats with the Query protocol, without blocking the event loop.
+
+    All requests go through one UDP socket, opened on the first request. Every stat needs a challenge token from a
+    handshake, which is kept and reused until shortly before the server would expire it, so most requests are one round trip.
+    Requests are sent twice before giving up, since UDP packets can be lost.
+
+    Parameters
+    ----------
+    host: `str`
+        The server's address, default 127.0.0.1 (servers bind query to IPv4)
+    port: `int`
+        The server's query.port, default 25565
+    timeout: `float`
+        Seconds to wait for each response before resending or giving up, default 2
+    '''
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 25565, timeout: float = 2):
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._transport: Union[asyncio.DatagramTransport, None] = None
+        self._protocol: Union[_QueryProtocol, None] = None
+        self._socket_lock: Union[asyncio.Lock, None] = None
+        self._next_session = 0
+        self._token: Union[int, None] = None
+        self._token_time = 0.0
+        self._token_task: Union[asyncio.Future, None] = None
+
+    async def basic_stat(self) -> Union[Dict, None]:
+        '''
+        Get the basic stat: motd, gametype, map, numplayers, maxplayers, hostport and hostip, with the counts and port as ints.
+        Returns None if the server did not answer.
+        '''
+        data = await self._stat(b"")
+        if data == None:
+            return None
+        try:
+            fields = data.split(b"\x00", len(BASIC_STAT_FIELDS))
+            stat: Dict = {name: self._decode(value) for name, value in zip(BASIC_STAT_FIELDS, fields)}
+            remainder = fields[len(BASIC_STAT_FIELDS)]
+            stat["numplayers"] = int(stat["numplayers"])
+            stat["maxplayers"] = int(stat["maxplayers"])
+            stat["hostport"] = struct.unpack("<H", remainder[:2])[0]  # the only little-endian field in the protocol
+            stat["hostip"] = self._decode(remainder[2:].split(b"\x00", 1)[0])
+        except (IndexError, ValueError, struct.error):
+            return None
+        return stat
+
+    async def full_stat(self) -> Union[Dict, None]:
+        '''
+        Get the full stat: every key the server sends (hostname, gametype, game_id, version, plugins, map, numplayers,
+        maxplayers, hostport, hostip), with the counts and port as ints, and "players", the names of every online player.
+        Returns None if the server did not answer.
+        '''
+        data = await self._stat(FULL_STAT_PADDING)
+        if data == None or not data.startswith(KEY_VALUE_START):
+            return None
+        try:
+            key_values, players = data[len(KEY_VALUE_START):].split(b"\x00\x00" + PLAYERS_START, 1)
+            items = key_values.split(b"\x00")
+            stat: Dict = {self._decode(key): self._decode(value) for key, value in zip(items[::2], items[1::2])}
+            for key in ["numplayers", "maxplayers", "hostport"]:
+                if key in stat:
+                    stat[key] = int(stat[key])
+        except ValueError:
+            return None
+        stat["players"] = self._parse_players(players)
+        return stat
+
+    def close(self):
+        '''Close the socket. It is opened again by the next request.'''
+        if self._transport != None:
+            self._transport.close()
+        self._transport = None
+        self._protocol = None
+
+    def _parse_players(self, data: bytes) -> List[str]:
+        players = []
+        for name in data.split(b"\x00"):
+            if name == b"":  # the list ends with an empty name
+                break
+            players.append(self._decode(name))
+        return players
+
+    def _decode(self, value: bytes) -> str:
+        return value.decode("utf8", errors="replace")
+
+    async def _stat(self, padding: bytes) -> Union[bytes, None]:
+        for attempt in range(2):
+            try:
+                token = await self._get_token(renew=attempt > 0)
+                return await self._request(TYPE_STAT, struct.pack(">i", token) + padding)
+            except (OSError, asyncio.TimeoutError, ValueError, struct.error):
+                # servers ignore requests with expired tokens rather than answering, so retry with a new one
+                continue
+        return None
+
+    async def _get_token(self, renew: bool = False) -> int:
+        '''Get a challenge token, doing a handshake if the last one is too old. Concurrent callers share one handshake.'''
+        if not renew and self._token != None and time.monotonic() - self._token_time < TOKEN_LIFETIME - TOKEN_MARGIN:
+            return self._token
+        if self._token_task == None:
+            self._token_task = asyncio.ensure_future(self._handshake())
+        try:
+            return await asyncio.shield(self._token_task)
+        finally:
+            if self._token_task != None and self._token_task.done():
+                self._token_task = None
+
+    async def _handshake(self) -> int:
+        sent = time.monotonic()
+        data = await self._request(TYPE_HANDSHAKE, b"")
+        # the token is sent as a decimal string, and must be sent back as a 32 bit integer
+        self._token = int(data.split(b"\x00", 1)[0])
+        self._token_time = sent
+        return self._token
+
+    async def _request(self, packet_type: int, payload: bytes) -> bytes:
+        protocol = await self._get_protocol()
+        self._next_session = (self._next_session + 1) % SESSION_COUNT
+        session = session_id(self._next_session)
+        waiter = asyncio.get_running_loop().create_future()
+        protocol.waiters[(packet_type, session)] = waiter
+        try:
+            protocol.transport.sendto(MAGIC + bytes([packet_type]) + struct.pack(">i", session) + payload)  # type: ignore
+            return await asyncio.wait_for(waiter, self._timeout)
+        finally:
+            protocol.waiters.pop((packet_type, session), None)
+
+    async def _get_protocol(self) -> _QueryProtocol:
+        if self._socket_lock == None:
+            self._socket_lock = asyncio.Lock()
+        async with self._socket_lock:
+            if self._transport == None or self._transport.is_closing():
+                self._transport, self._protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+                    _QueryProtocol, remote_addr=(self.host, self.port))
+        return self._protocol  # type: ignore
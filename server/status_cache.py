@@ -0,0 +1,130 @@
+'''
+Sharing server status pings between everything that shows the server's status
+
+Classes
+-------
+CachedStatus
+    A status response and when it was received
+StatusCache
+    Serves recent statuses from memory, with at most one ping in flight
+'''
+
+from server.server_ping import AsyncStatusPing
+from typing import Dict, Union
+import asyncio
+import time
+
+
+class CachedStatus:
+    '''
+    A status response and when it was received
+
+    Attributes
+    ----------
+    status: `Dict`
+        The status response, as sent by the server
+    latency: `float`
+        The round trip time of the ping that got it, in milliseconds
+    received: `float`
+        When it was received, in time.monotonic() seconds
+    stale: `bool`
+        True if the latest ping failed and this is the last status the server gave
+    '''
+
+    __slots__ = ("status", "latency", "received", "stale")
+
+    def __init__(self, status: Dict, latency: float, received: float, stale: bool = False):
+        self.status = status
+        self.latency = latency
+        self.received = received
+        self.stale = stale
+
+    def age(self) -> float:
+        '''Get the seconds since the status was received.'''
+        return time.monotonic() - self.received
+
+
+class StatusCache:
+    '''
+    Answers status requests from the last ping until it is ttl seconds old, then pings again.
+
+    Requests that arrive while a ping is in flight wait for that ping instead of starting their own, so the server is
+    pinged at most once per ttl however many requests there are. A failed ping is remembered for ttl seconds too.
+
+    While the server does not answer (such as while it restarts), the last status it gave is returned marked as stale,
+    until it is older than max_stale.
+
+    Parameters
+    ----------
+    pinger: `AsyncStatusPing`
+        The pinger to get statuses with
+    ttl: `float`
+        The seconds to reuse a ping's result for, default 10 (0 pings for every request not sharing a ping in flight)
+    max_stale: `float`
+        The oldest a stale status can be before None is returned instead, default 300
+
+    Attributes
+    ----------
+    hits: `int`
+        The requests answered from the cache
+    misses: `int`
+        The requests that started a ping
+    coalesced: `int`
+        The requests that waited for a ping another request started
+    stale_served: `int`
+        The requests answered with a stale status
+    '''
+
+    def __init__(self, pinger: AsyncStatusPing, ttl: float = 10, max_stale: float = 300):
+        self.pinger = pinger
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self._last_good: Union[CachedStatus, None] = None
+        self._last_ping = -float("inf")  # when the last ping finished, successful or not
+        self._last_ping_failed = False
+        self._ping_task: Union[asyncio.Task, None] = None
+
+    async def get(self) -> Union[CachedStatus, None]:
+        '''Get the server's status, pinging it if the last ping is older than ttl, or None if there is no status to give.'''
+        if time.monotonic() - self._last_ping < self.ttl:
+            self.hits += 1
+            return self._result()
+        if self._ping_task == None:
+            self.misses += 1
+            self._ping_task = asyncio.ensure_future(self._ping())
+        else:
+            self.coalesced += 1
+        # shielded so that a cancelled request (such as a timed out interaction) does not cancel the ping others wait for
+        await asyncio.shield(self._ping_task)
+        return self._result()
+
+    def invalidate(self):
+        '''Make the next request ping the server, such as after it was started or stopped.'''
+        self._last_ping = -float("inf")
+
+    def stats(self) -> Dict[str, int]:
+        '''Get the counters, by name.'''
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "stale_served": self.stale_served}
+
+    async def _ping(self):
+        try:
+            result = await self.pinger.get_status_and_latency()
+        finally:
+            self._ping_task = None
+        self._last_ping = time.monotonic()
+        self._last_ping_failed = result == None
+        if result != None:
+            self._last_good = CachedStatus(result[0], result[1], self._last_ping)
+
+    def _result(self) -> Union[CachedStatus, None]:
+        if not self._last_ping_failed:
+            return self._last_good
+        if self._last_good == None or self._last_good.age() > self.max_stale:
+            return None
+        self.stale_served += 1
+        last_good = self._last_good
+        return CachedStatus(last_good.status, last_good.latency, last_good.received, stale=True)
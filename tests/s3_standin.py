@@ -0,0 +1,147 @@
+'''
+A local stand-in for an S3-compatible bucket, for testing server.backups.s3 and server.backups.replication
+
+It checks request signatures (so clients must sign as S3 expects) and Content-MD5 headers, and supports the requests
+S3Client sends: objects, paged listings, and multipart uploads. Listings are paged a few keys at a time to exercise
+continuation tokens.
+'''
+
+from server.backups.s3 import signature_v4
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from typing import Dict, Tuple
+import threading
+import datetime
+import hashlib
+import base64
+import uuid
+import re
+
+
+ACCESS_KEY = "AK"
+SECRET_KEY = "SK"
+REGION = "us-east-1"
+BUCKET = "bucket"
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;")
+
+
+class S3StandIn:
+    '''
+    A bucket served on a local port until close() is called.
+
+    Attributes
+    ----------
+    objects: `Dict[str, Tuple[bytes, str]]`
+        The stored objects, as (data, etag) by key, which tests may change directly
+    requests: `List[Tuple[str, str]]`
+        The (method, key) of every request received
+    endpoint: `str`
+        The URL to give S3Client
+    '''
+
+    PAGE_SIZE = 7
+
+    def __init__(self):
+        self.objects: Dict[str, Tuple[bytes, str]] = {}
+        self.uploads: Dict[str, Tuple[str, Dict[int, bytes]]] = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self):
+                standin._handle(self)
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body: bytes = b"", headers: Dict[str, str] = {}):
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if handler.command != "HEAD":
+            handler.wfile.write(body)
+
+    def _error(self, handler: BaseHTTPRequestHandler, status: int, code: str):
+        self._send(handler, status, f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode())
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        url = urlsplit(handler.path)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        authorization = re.search(r"SignedHeaders=([^,]+), Signature=(\w+)", handler.headers.get("Authorization", ""))
+        if authorization == None:
+            return self._error(handler, 403, "AccessDenied")
+        signed_headers = {name: handler.headers[name] for name in authorization.group(1).split(";")}
+        now = datetime.datetime.strptime(handler.headers["x-amz-date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=datetime.timezone.utc)
+        expected = signature_v4(handler.command, url.path, url.query, signed_headers, hashlib.sha256(body).hexdigest(),
+                                ACCESS_KEY, SECRET_KEY, REGION, now)
+        if expected.split("Signature=")[1] != authorization.group(2):
+            return self._error(handler, 403, "SignatureDoesNotMatch")
+        if "Content-MD5" in handler.headers and base64.b64encode(hashlib.md5(body).digest()).decode() != handler.headers["Content-MD5"]:
+            return self._error(handler, 400, "BadDigest")
+        path = unquote(url.path).split("/", 2)
+        key = path[2] if len(path) > 2 else ""
+        with self._lock:
+            self.requests.append((handler.command, key))
+            if handler.command == "GET" and key == "" and "uploads" in query:
+                items = "".join(f"<Upload><Key>{_escape(upload_key)}</Key><UploadId>{upload_id}</UploadId></Upload>"
+                                for upload_id, (upload_key, _) in self.uploads.items() if upload_key.startswith(query.get("prefix", "")))
+                return self._send(handler, 200, f"<ListMultipartUploadsResult>{items}<IsTruncated>false</IsTruncated></ListMultipartUploadsResult>".encode())
+            if handler.command == "GET" and key == "":
+                keys = sorted(object_key for object_key in self.objects if object_key.startswith(query.get("prefix", "")))
+                start = int(query.get("continuation-token", "0"))
+                items = "".join(f"<Contents><Key>{_escape(object_key)}</Key><Size>{len(self.objects[object_key][0])}</Size>"
+                                f"<ETag>&quot;{self.objects[object_key][1]}&quot;</ETag></Contents>" for object_key in keys[start:start + self.PAGE_SIZE])
+                truncated = "true" if start + self.PAGE_SIZE < len(keys) else "false"
+                return self._send(handler, 200, f"<ListBucketResult>{items}<IsTruncated>{truncated}</IsTruncated>"
+                                                f"<NextContinuationToken>{start + self.PAGE_SIZE}</NextContinuationToken></ListBucketResult>".encode())
+            if handler.command == "POST" and "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self.uploads[upload_id] = (key, {})
+                return self._send(handler, 200, f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>".encode())
+            if "uploadId" in query and query["uploadId"] not in self.uploads:
+                return self._error(handler, 404, "NoSuchUpload")
+            if handler.command == "PUT" and "partNumber" in query:
+                self.uploads[query["uploadId"]][1][int(query["partNumber"])] = body
+                return self._send(handler, 200, headers={"ETag": f"\"{hashlib.md5(body).hexdigest()}\""})
+            if handler.command == "GET" and "uploadId" in query:
+                items = "".join(f"<Part><PartNumber>{number}</PartNumber><Size>{len(data)}</Size><ETag>\"{hashlib.md5(data).hexdigest()}\"</ETag></Part>"
+                                for number, data in sorted(self.uploads[query["uploadId"]][1].items()))
+                return self._send(handler, 200, f"<ListPartsResult>{items}<IsTruncated>false</IsTruncated></ListPartsResult>".encode())
+            if handler.command == "POST" and "uploadId" in query:
+                upload_key, parts = self.uploads.pop(query["uploadId"])
+                numbers = [int(number) for number in re.findall(r"<PartNumber>(\d+)</PartNumber>", body.decode())]
+                etag = hashlib.md5(b"".join(hashlib.md5(parts[number]).digest() for number in numbers)).hexdigest() + f"-{len(numbers)}"
+                self.objects[upload_key] = (b"".join(parts[number] for number in numbers), etag)
+                return self._send(handler, 200, f"<CompleteMultipartUploadResult><ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>".encode())
+            if handler.command == "DELETE" and "uploadId" in query:
+                self.uploads.pop(query["uploadId"])
+                return self._send(handler, 204)
+            if handler.command == "PUT":
+                self.objects[key] = (body, hashlib.md5(body).hexdigest())
+                return self._send(handler, 200, headers={"ETag": f"\"{self.objects[key][1]}\""})
+            if handler.command in ("GET", "HEAD"):
+                if key not in self.objects:
+                    return self._error(handler, 404, "NoSuchKey")
+                return self._send(handler, 200, self.objects[key][0], {"ETag": f"\"{self.objects[key][1]}\""})
+            if handler.command == "DELETE":
+                self.objects.pop(key, None)
+                return self._send(handler, 204)
+        self._error(handler, 400, "NotImplemented")
@@ -0,0 +1,160 @@
+'''Node agents on localhost, controlled through RemoteServerManager as the bot does'''
+
+from server.agent import NodeAgent
+from server.registry import ServerRegistry
+from server.rpc import RPCConnection, auth_digest, encode_frame, read_frame
+import tempfile
+import unittest
+import asyncio
+import struct
+import sys
+import os
+
+
+TOKEN = "secret"
+FAKE_SERVER = '''
+import sys
+print("[12:00:00] [Server thread/INFO]: Starting minecraft server", flush=True)
+print("[12:00:01] [Server thread/INFO]: Done (1.0s)! For help, type \\"help\\"", flush=True)
+for line in sys.stdin:
+    print(f"[12:00:02] [Server thread/INFO]: {line.strip()}", flush=True)
+    if line.strip() == "stop":
+        break
+'''
+CONFIG = '''
+[Server Information]
+server_jar=server.jar
+world_folders=world
+executable={executable}
+args=fake_server.py
+console_history=1000
+
+[Restarts]
+autorestart=False
+autorestart_datetime=S 0000
+restart_on_crash=False
+
+[Backups]
+backup=False
+max_backups=3
+backup_datetime=S 0000
+backup_folder=backups
+'''
+
+
+class Listener:
+    def __init__(self):
+        self.lines = []
+        self.changed = asyncio.Event()
+
+    def update(self, message: str):
+        self.lines.append(message)
+        self.changed.set()
+
+    async def wait_for(self, text: str, timeout: float = 10):
+        async def find():
+            while not any(text in line for line in self.lines):
+                self.changed.clear()
+                await self.changed.wait()
+        await asyncio.wait_for(find(), timeout)
+
+
+class NodeAgentTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.agents = []
+        self.bot = ServerRegistry(backup_workers=1)
+        for name, servers in [("north", {"survival": sys.executable, "broken": os.path.join(self.folder, "missing")}),
+                              ("south", {"survival": sys.executable})]:
+            registry = ServerRegistry(backup_workers=1)
+            for key, executable in servers.items():
+                directory = os.path.join(self.folder, name, key)
+                os.makedirs(os.path.join(directory, "world"))
+                with open(os.path.join(directory, "server.properties"), "w") as properties:
+                    properties.write("server-port=25565\n")
+                with open(os.path.join(directory, "fake_server.py"), "w") as script:
+                    script.write(FAKE_SERVER)
+                with open(os.path.join(directory, "obsidia.conf"), "w") as config:
+                    config.write(CONFIG.format(executable=executable))
+                registry.add(key, directory, os.path.join(directory, "obsidia.conf"))
+            agent = NodeAgent(registry, TOKEN, port=0)
+            await agent.start()
+            self.agents.append(agent)
+            self.bot.add_agent(name, "127.0.0.1", agent.port, TOKEN)
+            for key in servers:
+                self.bot.add(f"{name}-{key}", "", "", agent=name, remote_key=key)
+        self.addAsyncCleanup(self.close)
+
+    async def load(self, key: str):
+        '''Load a server on the bot, returning its manager once the agent is sending it console lines.'''
+        entry = self.bot.resolve(key)
+        manager = await entry.load()
+        console = self.agents[[agent.port for agent in self.agents].index(entry._agent.port)].registry.resolve(entry._remote_key).manager().server
+        while len(console._subscriptions) == 0:
+            await asyncio.sleep(0.01)
+        return manager
+
+    async def close(self):
+        self.bot.close_agents()
+        for agent in self.agents:
+            await agent.close()
+            for entry in agent.registry.loaded():
+                if entry.manager().stop_server() == None:
+                    await entry.manager().wait_for_server_exit(timeout=10)
+
+    async def test_agents_on_localhost(self):
+        self.assertEqual(self.agents[0].host, "127.0.0.1")
+        managers = [await self.load(key) for key in ["north-survival", "south-survival"]]
+        listeners = [Listener(), Listener()]
+        for manager, listener in zip(managers, listeners):
+            self.assertFalse(manager.server_active())
+            manager.server.add_listener(listener)
+            await manager.start_server()
+        for manager, listener in zip(managers, listeners):
+            await listener.wait_for("Done (")
+            self.assertEqual(await manager.write("say hello"), None)
+            await listener.wait_for("say hello")
+        self.assertEqual([line for line in listeners[1].lines if "say hello" in line], ["[12:00:02] [Server thread/INFO]: say hello"])
+        with self.assertRaises(RuntimeError):
+            await managers[0].start_server()
+        self.assertEqual(await managers[1].list_backups(), "")  # no backup folder yet
+        self.assertEqual((await managers[1].get_latest_log())[-1], "[12:00:02] [Server thread/INFO]: say hello")
+
+    async def test_start_failure_reported(self):
+        manager = await self.load("north-broken")
+        listener = Listener()
+        manager.server.add_listener(listener)
+        await manager.start_server()
+        await listener.wait_for("Server stopped with an error")
+        self.assertEqual(self.agents[0]._start_tasks, {})
+
+    async def test_unknown_server(self):
+        self.bot.add("south-creative", "", "", agent="south", remote_key="creative")
+        with self.assertRaisesRegex(KeyError, "There is no server called creative"):
+            await self.bot.resolve("south-creative").load()
+
+    async def test_wrong_token(self):
+        with self.assertRaises(PermissionError):
+            await RPCConnection.open("127.0.0.1", self.agents[1].port, "wrong")
+
+    async def test_large_frame_before_auth(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.agents[1].port)
+        self.addCleanup(writer.close)
+        challenge = await read_frame(reader)
+        writer.write(struct.pack(">I", 8 * 1048576) + b"{")
+        await writer.drain()
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b"")  # closed without reading the frame or answering
+        self.assertIn("challenge", challenge)
+
+    async def test_authenticated(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.agents[0].port)
+        self.addCleanup(writer.close)
+        challenge = await read_frame(reader)
+        writer.write(encode_frame({"auth": auth_digest(TOKEN, challenge["challenge"])}))
+        writer.write(encode_frame({"id": 1, "method": "list_servers", "params": {}}))
+        await writer.drain()
+        self.assertEqual(await read_frame(reader), {"authenticated": True})
+        self.assertEqual([server["key"] for server in (await read_frame(reader))["result"]], ["survival", "broken"])
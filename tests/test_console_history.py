@@ -0,0 +1,58 @@
+'''ConsoleHistory, and ConsoleLogView over the history and a log file'''
+
+from server.console_history import ConsoleHistory, ConsoleLogView
+import tempfile
+import unittest
+import os
+
+
+class ConsoleLogViewTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.log_file = os.path.join(folder.name, "latest.log")
+
+    def write_log(self, data: bytes):
+        with open(self.log_file, "wb") as log:
+            log.write(data)
+
+    def test_file_only(self):
+        self.write_log(b"".join(f"line {number}\n".encode() for number in range(1000)) + b"last, no newline")
+        view = ConsoleLogView(ConsoleHistory(10), self.log_file)
+        self.assertTrue(view.needs_file())
+        view.index_file()
+        self.assertEqual(len(view), 1001)
+        self.assertEqual(view[990:995], ["line 990", "line 991", "line 992", "line 993", "line 994"])
+        self.assertEqual(view[-1], "last, no newline")
+        self.assertEqual(view[0], "line 0")
+        self.assertEqual(view[995:2000][-2:], ["line 999", "last, no newline"])
+
+    def test_line_endings_and_invalid_utf8(self):
+        self.write_log(b"one\r\n\xfftwo\r\n\nfour\n")
+        view = ConsoleLogView(ConsoleHistory(10), self.log_file)
+        self.assertEqual(list(view), ["one", "�two", "", "four"])  # indexed when first needed
+
+    def test_missing_file(self):
+        view = ConsoleLogView(ConsoleHistory(10), self.log_file)
+        view.index_file()
+        self.assertEqual(len(view), 0)
+        self.assertEqual(view[:], [])
+
+    def test_history_with_dropped_lines(self):
+        self.write_log(b"".join(f"line {number}\n".encode() for number in range(25)))
+        history = ConsoleHistory(10)
+        for number in range(25):
+            history.append(f"held {number}")
+        view = ConsoleLogView(history, self.log_file)
+        self.assertTrue(view.needs_file())
+        view.index_file()
+        self.assertEqual(len(view), 25)
+        self.assertEqual(view[13:17], ["line 13", "line 14", "held 15", "held 16"])
+
+    def test_history_holding_everything(self):
+        history = ConsoleHistory(10)
+        history.append("held 0")
+        view = ConsoleLogView(history, self.log_file)
+        self.assertFalse(view.needs_file())
+        self.assertEqual(view[:], ["held 0"])
@@ -0,0 +1,43 @@
+'''LocalServerManager, which gives local servers the interface of RemoteServerManager'''
+
+from server.local import LocalServerManager
+from server.registry import ServerRegistry
+from server.remote import RemoteServerManager
+from tests.test_agent import CONFIG
+import tempfile
+import unittest
+import inspect
+import sys
+import os
+
+
+class LocalServerManagerTest(unittest.IsolatedAsyncioTestCase):
+
+    def test_same_interface(self):
+        for name, method in inspect.getmembers(RemoteServerManager, inspect.isfunction):
+            if name.startswith("_") or name in ("connect", "close"):  # the connection to the agent
+                continue
+            with self.subTest(name):
+                self.assertTrue(hasattr(LocalServerManager, name))
+                local = getattr(LocalServerManager, name)
+                self.assertEqual(inspect.iscoroutinefunction(local), inspect.iscoroutinefunction(method))
+                self.assertEqual(list(inspect.signature(local).parameters), list(inspect.signature(method).parameters))
+
+    async def test_registry_loads_local_managers(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, "world"))
+            with open(os.path.join(folder, "server.properties"), "w") as properties:
+                properties.write("server-port=25566\nenable-query=true\nquery.port=25567\n")
+            with open(os.path.join(folder, "obsidia.conf"), "w") as config:
+                config.write(CONFIG.format(executable=sys.executable))
+            registry = ServerRegistry(backup_workers=1)
+            entry = registry.add("survival", folder, os.path.join(folder, "obsidia.conf"))
+            manager = await entry.load()
+            self.assertIsInstance(manager, LocalServerManager)
+            self.assertIs(await entry.load(), manager)
+            self.assertIs(manager.manager, entry.manager())
+            self.assertEqual((manager._port, manager._query_port), (25566, 25567))
+            self.assertFalse(manager.server_active())
+            self.assertEqual(await manager.list_backups(), "")
+            self.assertEqual(await manager.pending_deletions(), [])
+            self.assertFalse(await manager.has_restore_rollback())
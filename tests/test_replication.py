@@ -0,0 +1,57 @@
+'''Replication to a local S3 stand-in (see tests/s3_standin.py)'''
+
+from server.backups.replication import Replicator, file_etag
+from server.backups.s3 import S3Client
+from tests.s3_standin import S3StandIn, ACCESS_KEY, SECRET_KEY, REGION, BUCKET
+import tempfile
+import unittest
+import json
+import os
+
+
+class ReplicatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = S3StandIn()
+        self.addCleanup(self.standin.close)
+        self.replicator = Replicator(S3Client(self.standin.endpoint, BUCKET, ACCESS_KEY, SECRET_KEY, REGION), prefix="backups")
+        self.addCleanup(self.replicator.shutdown)
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def write(self, relative: str, data: bytes) -> tuple:
+        path = os.path.join(self.folder, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path, relative
+
+    def chunks(self, count: int) -> list:
+        return [self.write(f".chunks/{number:02}", f"chunk {number}".encode()) for number in range(count)]
+
+    def test_uploads_files_and_marker(self):
+        files = [self.write("one/level.dat", b"level"), self.write("one/region.mca", b"region" * 1000)]
+        uploaded, skipped, byte_count = self.replicator.replicate("one", files, self.chunks(10), {"size": 1})
+        self.assertEqual((uploaded, skipped), (12, 0))
+        self.assertEqual(byte_count, sum(os.path.getsize(path) for path, _ in files + self.chunks(10)))
+        self.assertEqual(self.standin.objects["backups/one/region.mca"][1], file_etag(files[1][0]))
+        self.assertEqual(len([key for key in self.standin.objects if key.startswith("backups/.chunks/")]), 10)
+        self.assertEqual(json.loads(self.standin.objects["backups/.snapshots/one.json"][0]), {"size": 1})
+        self.assertEqual(self.replicator.remote_snapshots(), {"one": {"size": 1}})
+
+    def test_skips_uploaded_files(self):
+        files = [self.write("one/level.dat", b"level")]
+        self.replicator.replicate("one", files, self.chunks(10), {})
+        self.standin.requests.clear()
+        uploaded, skipped, _ = self.replicator.replicate("one", files, self.chunks(10), {})
+        self.assertEqual((uploaded, skipped), (0, 1))
+        self.assertEqual([key for method, key in self.standin.requests if method == "PUT"], ["backups/.snapshots/one.json"])
+
+    def test_reuploads_chunks_deleted_remotely(self):
+        chunks = self.chunks(10)
+        self.replicator.replicate("one", [self.write("one/level.dat", b"level")], chunks, {})
+        del self.standin.objects["backups/.chunks/03"]
+        uploaded, _, _ = self.replicator.replicate("two", [self.write("two/level.dat", b"level 2")], chunks, {})
+        self.assertEqual(uploaded, 2)
+        self.assertEqual(self.standin.objects["backups/.chunks/03"][0], b"chunk 3")
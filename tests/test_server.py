@@ -0,0 +1,40 @@
+'''ServerRunner's console listeners'''
+
+from server.console_parser import ConsoleParser
+from server.server import ServerRunner
+from loguru import logger
+import tempfile
+import unittest
+import asyncio
+
+
+class FailingListener:
+    def __init__(self):
+        self.messages = []
+
+    def update(self, message: str):
+        self.messages.append(message)
+        if "fail" in message:
+            raise ValueError("could not handle it")
+
+
+class ListenerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_failing_listener_logged_and_kept(self):
+        errors = []
+        sink = logger.add(lambda message: errors.append(message.record), level="ERROR")
+        self.addCleanup(logger.remove, sink)
+        with tempfile.TemporaryDirectory() as folder:
+            runner = ServerRunner(folder)
+            listener = FailingListener()
+            runner.add_listener(listener)
+            parser = ConsoleParser()
+            for line in ["[12:00:00] [Server thread/INFO]: please fail", "[12:00:01] [Server thread/INFO]: after"]:
+                await runner._update_listeners(parser.parse(line))
+            for _ in range(20):
+                await asyncio.sleep(0)
+            runner.remove_listener(listener)
+        self.assertEqual(listener.messages[-1], "[12:00:01] [Server thread/INFO]: after")
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["name"], "server.server")
+        self.assertIsInstance(errors[0]["exception"].value, ValueError)
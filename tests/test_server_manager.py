@@ -0,0 +1,105 @@
+'''ServerManager on a server directory of its own'''
+
+from server.server_manager import ServerManager
+from server.local import LocalServerManager
+from tests.test_agent import CONFIG, FAKE_SERVER
+import tempfile
+import unittest
+import asyncio
+import sys
+import os
+
+
+class ServerManagerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        os.makedirs(os.path.join(self.folder, "world"))
+        with open(os.path.join(self.folder, "server.properties"), "w") as properties:
+            properties.write("server-port=25565\n")
+        with open(os.path.join(self.folder, "obsidia.conf"), "w") as config:
+            config.write(CONFIG.format(executable=sys.executable))
+        self.manager = ServerManager(self.folder, os.path.join(self.folder, "obsidia.conf"))
+
+    async def wait_until(self, condition, timeout: float = 10):
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.05)
+        await asyncio.wait_for(poll(), timeout)
+
+    async def stop(self, monitor: asyncio.Future):
+        if not monitor.done():
+            self.manager.stop_server()
+            self.manager._server_should_be_running = False
+            await asyncio.wait_for(monitor, 10)
+
+    async def test_restore_partial_rejects_invalid_options(self):
+        player = "069a79f4-44e9-4726-a5be-fca90e38aaf5"
+        for options in [{"player": player, "box": "0 0 100 100"}, {"player": player, "dimension": "nether"},
+                        {"player": player, "chunks_only": True}, {"player": player, "box": "0 0 100 100", "chunks_only": True},
+                        {"chunks_only": True}, {"dimension": "nether", "chunks_only": True}]:
+            with self.subTest(**options), self.assertRaises(ValueError):
+                await self.manager.restore_partial("backup", **options)
+
+    async def test_restore_partial_missing_backup(self):
+        with self.assertRaises(FileNotFoundError):
+            await self.manager.restore_partial("backup", box="0 0 100 100", chunks_only=True)
+
+    async def test_catalog_rebuilt_off_the_loop(self):
+        for backup in ["2024-01-01_00-00-00", "before-update"]:
+            os.makedirs(os.path.join(self.manager.backup_directory, backup, "world"))
+            with open(os.path.join(self.manager.backup_directory, backup, "world", "level.dat"), "wb") as level:
+                level.write(b"level")
+        self.assertEqual(self.manager.list_backups(), [])  # not rebuilt inline
+        await asyncio.gather(self.manager.load_backup_catalog(), self.manager.load_backup_catalog())
+        self.assertEqual(sorted(self.manager.list_backups()), ["2024-01-01_00-00-00", "before-update"])
+        self.assertTrue(os.path.isfile(os.path.join(self.manager.backup_directory, ".catalog.json")))
+        self.assertEqual(await LocalServerManager(self.manager).get_backup_info("missing"), None)
+
+    async def test_delete_backup_collects_chunks_in_background(self):
+        for backup in ["one", "two"]:
+            os.makedirs(os.path.join(self.manager.backup_directory, backup, "world"))
+        await self.manager.load_backup_catalog()
+        await self.manager.delete_backup("one")
+        task = self.manager._chunk_gc_task
+        await self.manager.delete_backup("two")  # while the first collection is still running
+        self.assertIs(self.manager._chunk_gc_task, task)
+        self.assertTrue(self.manager._chunk_gc_pending)
+        await task
+        await self.manager._chunk_gc_task
+        self.assertFalse(self.manager._chunk_gc_pending)
+        self.assertEqual(self.manager.list_backups(), [])
+
+    async def test_restart_latency_report_cancelled_on_shutdown(self):
+        with open(os.path.join(self.folder, "fake_server.py"), "w") as script:
+            script.write(FAKE_SERVER.replace("    if line.strip() == \"stop\":", "    if line.strip() == \"crash\":\n        sys.exit(1)\n    if line.strip() == \"stop\":"))
+        with open(os.path.join(self.folder, "obsidia.conf"), "w") as config:
+            config.write(CONFIG.format(executable=sys.executable).replace("restart_on_crash=False", "restart_on_crash=True"))
+        self.manager.reload_configs()
+        monitor = asyncio.ensure_future(self.manager.start_server())
+        self.addAsyncCleanup(self.stop, monitor)
+        await self.wait_until(self.manager.server_active)
+        self.manager.write("crash")
+        await self.wait_until(lambda: self.manager._restart_latency_task != None)
+        task = self.manager._restart_latency_task
+        self.manager.stop_server()
+        await asyncio.wait_for(monitor, 10)
+        self.assertIsNone(self.manager._restart_latency_task)
+        self.assertTrue(task.done())
+
+    async def test_incremental_backup_links_to_the_backup_it_replaces(self):
+        with open(os.path.join(self.folder, "obsidia.conf"), "w") as config:
+            config.write(CONFIG.format(executable=sys.executable).replace("max_backups=3", "max_backups=1\nincremental=True"))
+        self.manager.reload_configs()
+        with open(os.path.join(self.folder, "world", "level.dat"), "wb") as level:
+            level.write(b"level")
+        times = iter([1000, 2000])
+        self.manager._get_current_time = lambda: next(times)
+        subscription = self.manager.server.subscribe()
+        self.assertIsNone(await self.manager.backup_world())
+        self.assertIsNone(await self.manager.backup_world())
+        messages = [record.message for record in await subscription.get_batch()]
+        self.assertEqual(self.manager.list_backups(), ["2000"])
+        self.assertIn("0 files copied, 1 unchanged files linked", [message for message in messages if message.startswith("Backup completed")][-1])
@@ -0,0 +1,101 @@
+'''The Query client against a local UDP stand-in for a server's query listener'''
+
+from server.server_query import QueryClient, session_id, SESSION_COUNT, SESSION_MASK
+from typing import Dict, List
+import unittest
+import asyncio
+import struct
+
+
+class QueryResponder(asyncio.DatagramProtocol):
+    '''
+    Answers Query requests as a server does: handshakes get a new token, and stats with an unknown token are ignored.
+
+    Attributes
+    ----------
+    tokens: `Set[int]`
+        The tokens the responder accepts, which tests may clear to expire them
+    handshakes: `int`
+        The number of handshakes answered
+    sessions: `List[int]`
+        The session id of every request
+    '''
+
+    def __init__(self, stat: Dict[str, str], players: List[str]):
+        self.stat = stat
+        self.players = players
+        self.tokens = set()
+        self.handshakes = 0
+        self.sessions = []
+        self._next_token = 9513307
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        packet_type, session = data[2], struct.unpack(">i", data[3:7])[0]
+        self.sessions.append(session)
+        header = bytes([packet_type]) + data[3:7]
+        if packet_type == 0x09:
+            self.handshakes += 1
+            self._next_token += 1
+            self.tokens.add(self._next_token)
+            self.transport.sendto(header + str(self._next_token).encode() + b"\x00", addr)
+        elif struct.unpack(">i", data[7:11])[0] in self.tokens:
+            self.transport.sendto(header + (self._full_stat() if len(data) == 15 else self._basic_stat()), addr)
+
+    def _basic_stat(self) -> bytes:
+        fields = [self.stat[name] for name in ["hostname", "gametype", "map", "numplayers", "maxplayers"]]
+        return b"".join(field.encode() + b"\x00" for field in fields) + struct.pack("<H", 25565) + b"127.0.0.1\x00"
+
+    def _full_stat(self) -> bytes:
+        key_values = b"".join(key.encode() + b"\x00" + value.encode() + b"\x00" for key, value in self.stat.items())
+        players = b"".join(name.encode() + b"\x00" for name in self.players)
+        return b"splitnum\x00\x80\x00" + key_values + b"\x00\x01player_\x00\x00" + players + b"\x00"
+
+
+class QueryClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.stat = {"hostname": "A Minecraft Server", "gametype": "SMP", "game_id": "MINECRAFT", "version": "1.20.1",
+                     "plugins": "", "map": "world", "numplayers": "300", "maxplayers": "500", "hostport": "25565", "hostip": ""}
+        self.players = [f"Player_{number}" for number in range(300)]
+        transport, self.responder = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: QueryResponder(self.stat, self.players), local_addr=("127.0.0.1", 0))
+        self.addCleanup(transport.close)
+        self.client = QueryClient(port=transport.get_extra_info("sockname")[1], timeout=0.2)
+        self.addCleanup(self.client.close)
+
+    async def test_handshake_token_reused(self):
+        basic = await self.client.basic_stat()
+        self.assertEqual(basic, {"motd": "A Minecraft Server", "gametype": "SMP", "map": "world", "numplayers": 300,
+                                 "maxplayers": 500, "hostport": 25565, "hostip": "127.0.0.1"})
+        self.assertIsNotNone(await self.client.full_stat())
+        await asyncio.gather(*[self.client.basic_stat() for _ in range(5)])
+        self.assertEqual(self.responder.handshakes, 1)
+
+    async def test_expired_token_retried(self):
+        await self.client.basic_stat()
+        self.responder.tokens.clear()
+        self.assertEqual((await self.client.basic_stat())["numplayers"], 300)
+        self.assertEqual(self.responder.handshakes, 2)
+
+    async def test_full_stat(self):
+        stat = await self.client.full_stat()
+        self.assertEqual(stat["players"], self.players)
+        self.assertEqual(stat["plugins"], "")
+        self.assertEqual(stat["hostip"], "")
+        self.assertEqual((stat["numplayers"], stat["maxplayers"], stat["hostport"]), (300, 500, 25565))
+        self.assertEqual(stat["version"], "1.20.1")
+
+    async def test_no_answer(self):
+        self.responder.transport.close()
+        self.assertIsNone(await self.client.basic_stat())
+
+    async def test_session_ids(self):
+        ids = {session_id(counter) for counter in range(SESSION_COUNT)}
+        self.assertEqual(len(ids), SESSION_COUNT)
+        self.assertTrue(all(session & ~SESSION_MASK == 0 for session in ids))
+        for _ in range(20):
+            await self.client.basic_stat()
+        self.assertEqual(len(set(self.responder.sessions)), len(self.responder.sessions))